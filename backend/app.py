@@ -1,16 +1,29 @@
+import functools
 import os
 from pathlib import Path
 
 import dotenv
-from flask import Flask, jsonify, request, send_from_directory, url_for
+from flask import Flask, Response, jsonify, request, send_from_directory, url_for
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, send_file
 from spider.sync_schedule import sync_schedule
 import spider.login as login
 import spider.spider as spider
 import spider.ddl_LLM as ddl_LLM
 from database import storage
-import shutil
+from database.backup import start_scheduler as start_backup_scheduler
+from database.blobstore import (
+    BLOB_DIR,
+    USER_QUOTA_BYTES,
+    BlobStore,
+    QuotaExceeded,
+    is_digest,
+    migrate_legacy_files,
+)
+from database.cache import VersionedLRUCache
+from database.maintenance import start_scheduler as start_maintenance_scheduler
+from database.slots import SLOT_COUNT
+from database.transfer import ndjson_lines, parse_ndjson, read_archive, tar_stream
 import requests
 from concurrent.futures import ThreadPoolExecutor
 EXECUTOR = ThreadPoolExecutor(max_workers=4)
@@ -20,9 +33,41 @@ LocalHost = os.getenv("localhost") or ""
 # Resolve and ensure the base storage directory exists
 BASE_STORAGE_DIR = Path(os.getenv("storage_dir", "./uploads/")).resolve()
 BASE_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+# 笔记文件按内容摘要存放，相同的文件只存一份（环境变量 blob_dir，默认 <storage_dir>/blobs）
+BLOB_STORE = BlobStore(BLOB_DIR or BASE_STORAGE_DIR / "blobs")
+# 下载链接带 v=<sha256> 时内容不会再变，浏览器可以长期缓存（秒）
+FILE_CACHE_MAX_AGE = int(os.getenv("file_cache_max_age", str(365 * 24 * 3600)))
+# 由前置代理发送文件："x-sendfile"（Apache/lighttpd）或 "x-accel-redirect"（nginx），留空则由 Flask 发送
+FILE_SENDFILE = os.getenv("file_sendfile", "").lower()
+# x-accel-redirect 模式下 nginx 中映射到 blob 目录的 internal location
+FILE_ACCEL_PREFIX = os.getenv("file_accel_prefix", "/_blobs/")
 
 app = Flask(__name__)
 CORS(app)
+# 单个请求体的大小上限（字节），超出时 werkzeug 在读取过程中返回 413；未设置则不限制
+if os.getenv("max_upload_bytes"):
+    app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("max_upload_bytes"))
+
+# /userdata 的序列化结果缓存，按 (userId, 数据版本号) 精确失效
+USERDATA_CACHE = VersionedLRUCache(
+    max_entries=int(os.getenv("userdata_cache_size", "256")),
+    ttl=float(os.getenv("userdata_cache_ttl", "300")),
+)
+
+# 定时在线备份（环境变量 db_backup_interval_s > 0 时开启）；分片模式下每个库文件各一个
+BACKUP_SCHEDULERS = [
+    scheduler
+    for scheduler in map(start_backup_scheduler, storage.db.db_paths)
+    if scheduler is not None
+]
+# 定时维护：ANALYZE、清理孤儿行和过期的上传会话、WAL 检查点、增量 vacuum（db_maintenance_interval_s > 0 时开启）
+MAINTENANCE_SCHEDULERS = [
+    scheduler
+    for scheduler in (
+        start_maintenance_scheduler(path, blob_store=BLOB_STORE) for path in storage.db.db_paths
+    )
+    if scheduler is not None
+]
 
 # 全局复用的 session，但先不登录，等第一次请求再说
 _session = None
@@ -30,6 +75,30 @@ _session = None
 _courses = None
 
 
+@app.before_request
+def start_query_count():
+    """开启查询统计时，从请求开始计数本次请求执行的 SQL 语句。"""
+    if storage.db.metrics is not None:
+        storage.db.metrics.start_scope()
+
+
+@app.after_request
+def add_query_count(response):
+    """开启查询统计时，在响应头中返回本次请求的查询数与数据库耗时。"""
+    if storage.db.metrics is not None:
+        scope = storage.db.metrics.end_scope()
+        if scope is not None:
+            response.headers["X-Query-Count"] = str(scope["queries"])
+            response.headers["X-Query-Time-Ms"] = f"{scope['time_ms']:.3f}"
+    return response
+
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    """请求结束时把当前线程持有的数据库连接归还给连接池。"""
+    storage.close_connection()
+
+
 def get_session(id, password):
     """懒加载：第一次用到时才登录，后面复用同一个 session。"""
     global _session
@@ -46,29 +115,184 @@ def get_session(id, password):
     return _session
 
 
-@app.route("/userdata", methods=["GET"])
-def userdata():
-    user_id = request.args.get("id", 1)
+def _not_modified(etag):
+    """客户端 If-None-Match 与当前 ETag 一致时返回 304 响应，否则返回 None。"""
+    if request.if_none_match and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        return _with_revalidation(response, etag)
+    return None
+
+
+def _with_revalidation(response, etag):
+    """设置 ETag，并要求浏览器每次使用缓存前先向服务端确认。"""
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 200
+
+
+def _is_paginated():
+    return "limit" in request.args or "cursor" in request.args
+
+
+def _page_response(key, fetch, *args):
+    """
+    按请求中的 limit / cursor 调用键集分页查询 fetch(*args, limit, cursor)，
+    返回 {"success", key: 本页数据, "nextCursor"}；参数非法时返回 400。
+    """
+    limit = request.args.get("limit", PAGE_DEFAULT_LIMIT, type=int)
+    if limit < 1:
+        return jsonify({"success": False, "error": "limit 参数非法"}), 400
+    try:
+        page = fetch(*args, min(limit, PAGE_MAX_LIMIT), request.args.get("cursor"))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, key: page["items"], "nextCursor": page["nextCursor"]}), 200
+
+
+def _build_userdata_json(user_id):
+    """构建完整的 /userdata 响应体（已序列化的 JSON 字节串），用户不存在时返回 None。"""
     user = storage.get_user(user_id)
     if not user:
-        return jsonify({"error": "user not found"}), 404
-    
+        return None
+
     # 从数据库获取用户的 deadlines（任务列表）
-    deadlines = storage.get_tasks(user_id)
-    
+    user["deadlines"] = storage.get_tasks(user_id)
     # 获取用户的 linkCategories
-    linkCategories = storage.get_useful_links_by_category(user_id)
-    
+    user["linkCategories"] = storage.get_useful_links_by_category(user_id)
     # 获取用户的 courseTable
-    courseTable = storage.get_course_schedules(user_id)
-    if not courseTable:
-        courseTable = []
-    print(courseTable)
-    user["deadlines"] = deadlines
-    user["linkCategories"] = linkCategories
-    user["courseTable"] = courseTable
-    
-    return jsonify({"data": user})
+    user["courseTable"] = storage.get_course_schedules(user_id) or []
+
+    return f"{app.json.dumps({'data': user})}\n".encode("utf-8")
+
+
+@app.route("/userdata", methods=["GET"])
+def userdata():
+    user_id = request.args.get("id", 1)
+    # 先读版本号再读数据：并发修改时最多缓存一份“比版本号更新”的数据，不会缓存旧数据
+    revision = storage.get_revision(user_id)
+    etag = storage.get_etag(user_id, "userdata", revision)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    # 以 ETag 作为缓存版本：恢复备份后版本号会回退、可能与缓存中的重复，ETag 中的数据库实例标识不会
+    body = USERDATA_CACHE.get_or_build(
+        user_id, etag, lambda: _build_userdata_json(user_id)
+    )
+    if body is None:
+        return jsonify({"error": "user not found"}), 404
+
+    return _with_revalidation(app.response_class(body, mimetype=app.json.mimetype), etag)
+
+
+SEARCH_MAX_LIMIT = 100
+
+
+@app.route("/search", methods=["GET"])
+def search():
+    """
+    在用户的课程、笔记、任务和链接中全文检索
+    需要参数：userId, q；可选参数：limit（默认 20，最大 100）, offset（默认 0）
+    """
+    userId = request.args.get("userId", type=int)
+    q = (request.args.get("q") or "").strip()
+    limit = request.args.get("limit", 20, type=int)
+    offset = request.args.get("offset", 0, type=int)
+
+    if not userId or not q:
+        return jsonify({"success": False, "error": "userId 和 q 均为必填"}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({"success": False, "error": "limit 或 offset 参数非法"}), 400
+    limit = min(limit, SEARCH_MAX_LIMIT)
+
+    # 多取一条用于判断是否还有下一页
+    results = storage.search(userId, q, limit + 1, offset)
+    next_offset = offset + limit if len(results) > limit else None
+
+    return jsonify(
+        {"success": True, "results": results[:limit], "nextOffset": next_offset}
+    ), 200
+
+
+@app.route("/export", methods=["GET"])
+def export_user_data():
+    """
+    流式导出用户的全部数据（NDJSON，每行一条记录）
+    需要参数：userId；可选参数：files=1 时连同上传文件一起打成 tar
+    """
+    userId = request.args.get("userId", type=int)
+    with_files = request.args.get("files", "").lower() in ("1", "true", "yes")
+
+    if not userId:
+        return jsonify({"success": False, "error": "userId 为必填"}), 400
+
+    records = storage.export_user(userId)
+    if records is None:
+        return jsonify({"error": "user not found"}), 404
+
+    if with_files:
+        body = tar_stream(records, BASE_STORAGE_DIR / str(userId), BLOB_STORE)
+        mimetype, filename = "application/x-tar", f"user-{userId}.tar"
+    else:
+        body = ndjson_lines(records)
+        mimetype, filename = "application/x-ndjson", f"user-{userId}.ndjson"
+    return Response(
+        body,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.route("/import", methods=["POST"])
+def import_user_data():
+    """
+    导入 /export 导出的数据，请求体为 NDJSON 或 tar（Content-Type: application/x-tar）
+    可选参数：userId（导入到已有用户名下；不传时按导出的用户信息新建用户）
+    """
+    userId = request.args.get("userId", type=int)
+    if userId is not None and storage.get_user(userId) is None:
+        return jsonify({"error": "user not found"}), 404
+
+    def import_records(records, blobs=None):
+        # 只有随本次请求上传的文件才能被导入的笔记引用
+        return storage.import_user(records, userId, blobs)
+
+    try:
+        if request.mimetype == "application/x-tar":
+            result = read_archive(request.stream, import_records, BASE_STORAGE_DIR, BLOB_STORE)
+            if result is not None and result["files"]:
+                # 旧版本导出的 files/ 成员按 用户/课程/笔记 目录写入，导入后移到内容寻址存储
+                migrate_legacy_files(storage.db, BLOB_STORE, BASE_STORAGE_DIR, user_id=result["userId"])
+        else:
+            result = import_records(parse_ndjson(request.stream))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    if result is None:
+        return jsonify({"success": False, "error": "导入数据与现有数据冲突（用户名、邮箱或课程名重复）"}), 409
+
+    return jsonify({"success": True, "imported": result}), 201
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    运行状态统计：连接池、写队列、/userdata 缓存、定时备份与维护，以及（开启 db_instrument 时的）SQL 语句统计
+    """
+    return jsonify(
+        {
+            "pool": storage.pool_stats(),
+            "writer": storage.write_stats(),
+            "userdataCache": USERDATA_CACHE.stats(),
+            "backup": [scheduler.stats() for scheduler in BACKUP_SCHEDULERS] or None,
+            "maintenance": [scheduler.stats() for scheduler in MAINTENANCE_SCHEDULERS] or None,
+            "queries": storage.query_stats(),
+        }
+    ), 200
 
 
 @app.route("/courses/create", methods=["POST"])
@@ -110,6 +334,13 @@ def create_course():
     return jsonify({"success": True, "course": course})
 
 
+def _quota_exceeded(used):
+    return (
+        jsonify({"error": "超出存储配额", "quota": USER_QUOTA_BYTES, "used": used}),
+        413,
+    )
+
+
 @app.route("/notes/upload", methods=["POST"])
 def upload_note():
     title = request.form.get("title") or request.values.get("title")
@@ -127,7 +358,12 @@ def upload_note():
     except Exception:
         tags = []
 
-    files = request.files.getlist("files") or []
+    raw = request.mimetype == "application/octet-stream"
+    if raw:
+        # 请求体就是文件内容（参数放在 query string 中），边接收边写入存储，不经过 multipart 解析
+        files = [(request.args.get("filename"), request.stream)]
+    else:
+        files = [(f.filename, f.stream) for f in request.files.getlist("files")]
     # enforce at most one file per note
     if len(files) > 1:
         return jsonify({"error": "每个笔记只允许上传一个文件"}), 400
@@ -137,34 +373,181 @@ def upload_note():
     if not user_id:
         return jsonify({"error": "userId is required"}), 400
 
-    # Save file (0 or 1) under BASE_STORAGE_DIR/<userId>/<lessonName>/<noteTitle>/<filename>
+    # 剩余配额：超出时在读取过程中中止，不会把整个文件写完
+    limit = None
+    if USER_QUOTA_BYTES:
+        used = storage.get_storage_usage(user_id)
+        limit = max(0, USER_QUOTA_BYTES - used)
+        if raw and request.content_length is not None and request.content_length > limit:
+            return _quota_exceeded(used)
+
+    # Save file (0 or 1) into the blob store; the note references it by SHA-256
     saved_filenames = []
-    if files:
-        for f in files:
-            filename = secure_filename(f.filename)
-            if not filename:
-                continue
-            note_dir = (
-                BASE_STORAGE_DIR
-                / str(user_id)
-                / str(lessonName)
-                / str(title or "Untitled")
-            )
-            note_dir.mkdir(parents=True, exist_ok=True)
-            file_path = note_dir / filename
-            f.save(str(file_path))
-            saved_filenames.append(filename)
+    blob = None
+    for name, stream in files:
+        filename = secure_filename(name or "")
+        if not filename:
+            continue
+        try:
+            blob = BLOB_STORE.put_stream(stream, limit=limit)
+        except QuotaExceeded:
+            return _quota_exceeded(used)
+        saved_filenames.append(filename)
 
     # Record note with sanitized filenames
-    note = storage.add_note(
-        title or "Untitled",
-        lessonName,
-        tags=tags,
-        files=saved_filenames,
-        user_id=user_id,
+    try:
+        note = storage.add_note(
+            title or "Untitled",
+            lessonName,
+            tags=tags,
+            files=saved_filenames,
+            user_id=user_id,
+            blob=blob,
+            # 上面的剩余配额是开始前算的，并发上传可能已经用掉；写入笔记的事务中再按实际用量检查
+            quota=USER_QUOTA_BYTES or None,
+        )
+    except QuotaExceeded as e:
+        # 文件已在存储中但无人引用，由回收清理
+        return _quota_exceeded(e.used)
+
+    return jsonify(
+        {
+            "success": True,
+            "note": note,
+            "saved_files": saved_filenames,
+            "sha256": blob["sha256"] if blob else None,
+        }
+    )
+
+
+# 可续传上传：创建会话 -> 按偏移 PUT 分块（顺序任意，可并发）-> 查询已收到的区间 -> 完成
+@app.route("/notes/uploads", methods=["POST"])
+def create_note_upload():
+    data = request.get_json(silent=True) or {}
+    user_id = data.get("userId")
+    lessonName = data.get("lessonName")
+    filename = secure_filename(data.get("filename") or "")
+    size = data.get("size")
+    sha256 = data.get("sha256")
+    if not lessonName:
+        return jsonify({"error": "lessonName (课程名) is required"}), 400
+    if not user_id:
+        return jsonify({"error": "userId is required"}), 400
+    if not filename:
+        return jsonify({"error": "filename is required"}), 400
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return jsonify({"error": "size 必须是非负整数"}), 400
+    if sha256 is not None and not is_digest(sha256):
+        return jsonify({"error": "sha256 必须是 64 位小写十六进制摘要"}), 400
+
+    # 配额在创建会话时按声明的大小检查，避免传完才被拒绝
+    if USER_QUOTA_BYTES:
+        used = storage.get_storage_usage(user_id)
+        if size > USER_QUOTA_BYTES - used:
+            return _quota_exceeded(used)
+
+    upload = storage.create_upload(
+        user_id, data.get("title") or "Untitled", lessonName, filename, size, data.get("tags"), sha256
+    )
+    if upload is None:
+        return jsonify({"error": "user not found"}), 404
+    return jsonify({"success": True, "upload": upload}), 201
+
+
+def _get_upload(upload_id):
+    """按 query string 中的 userId 查找上传会话，返回 (user_id, upload, 错误响应)"""
+    user_id = request.args.get("userId")
+    if not user_id:
+        return None, None, (jsonify({"error": "userId is required"}), 400)
+    upload = storage.get_upload(user_id, upload_id)
+    if upload is None:
+        return user_id, None, (jsonify({"error": "upload not found"}), 404)
+    return user_id, upload, None
+
+
+@app.route("/notes/uploads/<upload_id>", methods=["GET"])
+def get_note_upload(upload_id):
+    _, upload, error = _get_upload(upload_id)
+    if error:
+        return error
+    return jsonify({"success": True, "upload": upload})
+
+
+@app.route("/notes/uploads/<upload_id>", methods=["PUT"])
+def put_note_upload_chunk(upload_id):
+    user_id, upload, error = _get_upload(upload_id)
+    if error:
+        return error
+    try:
+        offset = int(request.args.get("offset", ""))
+    except ValueError:
+        return jsonify({"error": "offset 必须是整数"}), 400
+    length = request.content_length
+    if length is None:
+        return jsonify({"error": "Content-Length is required"}), 411
+    if offset < 0 or offset + length > upload["size"]:
+        return jsonify({"error": "分块超出文件范围", "size": upload["size"]}), 416
+
+    written = BLOB_STORE.write_chunk(upload_id, offset, request.stream, length)
+    if written < length:
+        # 连接中断：已写入的部分不记录，客户端重传该分块
+        return jsonify({"error": "分块不完整", "received": upload["received"]}), 400
+    if written and not storage.add_upload_chunk(user_id, upload_id, offset, offset + written):
+        # 写入期间会话被取消或回收
+        BLOB_STORE.discard_upload(upload_id)
+        return jsonify({"error": "upload not found"}), 404
+    upload = storage.get_upload(user_id, upload_id)
+    return jsonify({"success": True, "received": upload["received"], "complete": upload["complete"]})
+
+
+@app.route("/notes/uploads/<upload_id>/complete", methods=["POST"])
+def complete_note_upload(upload_id):
+    user_id, upload, error = _get_upload(upload_id)
+    if error:
+        return error
+    if not upload["complete"]:
+        return jsonify({"error": "还有分块未上传", "received": upload["received"]}), 409
+    # 创建会话时只按声明的大小检查过配额，期间其他上传可能已用掉剩余空间
+    if USER_QUOTA_BYTES:
+        used = storage.get_storage_usage(user_id)
+        if used + upload["size"] > USER_QUOTA_BYTES:
+            return _quota_exceeded(used)
+    try:
+        blob = BLOB_STORE.hash_upload(upload_id, upload["size"], upload["sha256"])
+    except FileNotFoundError:
+        # 并发的完成请求已经把临时文件移走
+        return jsonify({"error": "上传已完成或已取消"}), 409
+    except ValueError as e:
+        # 内容与声明不符，临时文件已删除，客户端需要重新上传
+        storage.delete_upload(user_id, upload_id)
+        return jsonify({"error": str(e)}), 422
+
+    # 删除会话与创建笔记在同一事务中：重复的完成请求不会创建两条笔记；
+    # 上面的检查之后并发的上传仍可能用掉配额，事务中按实际用量再检查一次
+    try:
+        note = storage.complete_upload(user_id, upload_id, blob, quota=USER_QUOTA_BYTES or None)
+    except QuotaExceeded as e:
+        # 会话和临时文件都保留，腾出空间后可以重试
+        return _quota_exceeded(e.used)
+    if note is None:
+        return jsonify({"error": "上传已完成或已取消"}), 409
+    if note is False:
+        # 会话和临时文件都保留，课程恢复后可以重试
+        return jsonify({"error": "课程不存在，无法创建笔记"}), 404
+    BLOB_STORE.commit_upload(upload_id, blob)
+    return jsonify(
+        {"success": True, "note": note, "saved_files": [upload["filename"]], "sha256": blob["sha256"]}
     )
 
-    return jsonify({"success": True, "note": note, "saved_files": saved_filenames})
+
+@app.route("/notes/uploads/<upload_id>", methods=["DELETE"])
+def cancel_note_upload(upload_id):
+    user_id, _, error = _get_upload(upload_id)
+    if error:
+        return error
+    storage.delete_upload(user_id, upload_id)
+    BLOB_STORE.discard_upload(upload_id)
+    return jsonify({"success": True})
 
 
 @app.route("/auth/login", methods=["POST"])
@@ -209,6 +592,39 @@ def auth_register():
     return jsonify({"success": True, "user": created}), 201
 
 
+@app.route("/notes", methods=["GET"])
+def list_notes():
+    """
+    分页获取用户的笔记
+    需要参数：userId；可选参数：lessonName（课程名）, limit（默认 50，最大 200）, cursor
+    """
+    userId = request.args.get("userId")
+
+    if not userId:
+        return jsonify({"success": False, "error": "userId 为必填"}), 400
+
+    return _page_response(
+        "notes",
+        functools.partial(storage.get_notes_page, course_title=request.args.get("lessonName")),
+        userId,
+    )
+
+
+def _find_note(user_id, lessonName, noteName):
+    """
+    定位用户某门课程下的笔记（一次索引查询），返回 (note, None)；
+    用户、课程或笔记不存在时返回 (None, 404 响应)
+    """
+    found = storage.find_note(user_id, lessonName, noteName)
+    if found is None:
+        return None, (jsonify({"error": "user not found"}), 404)
+    if found["courseId"] is None:
+        return None, (jsonify({"error": "course not found for user"}), 404)
+    if found["note"] is None:
+        return None, (jsonify({"error": "note not found in this course for user"}), 404)
+    return found["note"], None
+
+
 @app.route("/notes/files", methods=["GET"])
 def get_note_files():
     # Parameters: userId, lessonName (course name), noteName
@@ -219,28 +635,9 @@ def get_note_files():
     if not user_id or not lessonName or not noteName:
         return jsonify({"error": "userId, lessonName and noteName are required"}), 400
 
-    # verify user exists
-    user = storage.get_user(user_id)
-    if not user:
-        return jsonify({"error": "user not found"}), 404
-
-    # find course in user's courses
-    course = None
-    for c in user.get("courses", []):
-        if c.get("name") == lessonName:
-            course = c
-            break
-    if course is None:
-        return jsonify({"error": "course not found for user"}), 404
-
-    # find note in course.myNotes
-    note_entry = None
-    for n in course.get("myNotes", []):
-        if n.get("name") == noteName:
-            note_entry = n
-            break
-    if note_entry is None:
-        return jsonify({"error": "note not found in this course for user"}), 404
+    note_entry, error = _find_note(user_id, lessonName, noteName)
+    if error:
+        return error
 
     # 收集已保存的文件列表：兼容 file 为字符串、列表或 None
     saved_files = []
@@ -259,11 +656,50 @@ def get_note_files():
             + url_for("download_note_file", _external=False)
             + f"?userId={user_id}&lessonName={lessonName}&noteName={noteName}&filename={fname}"
         )
+        if note_entry.get("sha256"):
+            # 带上内容版本，链接对应的内容不会改变，可以长期缓存
+            file_url += f"&v={note_entry['sha256']}"
         files_info.append({"name": fname, "url": file_url})
 
     return jsonify({"success": True, "files": files_info})
 
 
+def _send_blob(digest, filename):
+    """
+    发送内容寻址存储中的文件。ETag 为内容摘要（强校验），支持 If-None-Match / If-Modified-Since 返回 304，
+    Flask 发送时支持 Range / If-Range 返回 206；前置代理模式下 Python 只校验条件请求，文件和 Range 交给代理处理。
+    """
+    path = BLOB_STORE.path(digest)
+    if not path.is_file():
+        return jsonify({"error": "file not found on server"}), 404
+    # 链接中的版本与文件一致时内容不可变，否则每次用 ETag 重新验证
+    max_age = FILE_CACHE_MAX_AGE if request.args.get("v") == digest else 0
+    rv = send_file(
+        str(path),
+        request.environ,
+        download_name=filename,
+        etag=digest,
+        conditional=not FILE_SENDFILE,
+        max_age=max_age,
+        use_x_sendfile=bool(FILE_SENDFILE),
+        response_class=app.response_class,
+    )
+    # 笔记文件属于个人数据，只允许浏览器缓存
+    rv.cache_control.public = None
+    rv.cache_control.private = True
+    if max_age:
+        rv.cache_control.immutable = True
+    if FILE_SENDFILE:
+        if FILE_SENDFILE == "x-accel-redirect":
+            del rv.headers["X-Sendfile"]
+            rv.headers["X-Accel-Redirect"] = FILE_ACCEL_PREFIX + path.relative_to(BLOB_STORE.root).as_posix()
+        rv = rv.make_conditional(request.environ)
+        if rv.status_code == 304:
+            rv.headers.pop("X-Sendfile", None)
+            rv.headers.pop("X-Accel-Redirect", None)
+    return rv
+
+
 @app.route("/notes/file", methods=["GET"])
 def download_note_file():
     # Parameters: userId, lessonName, noteName, filename
@@ -281,28 +717,10 @@ def download_note_file():
             400,
         )
 
-    # verify user exists
-    user = storage.get_user(user_id)
-    if not user:
-        return jsonify({"error": "user not found"}), 404
-
-    print(user_id, lessonName, noteName, filename)
     # verify note belongs to user/course
-    course = None
-    for c in user.get("courses", []):
-        if c.get("name") == lessonName:
-            course = c
-            break
-    if course is None:
-        return jsonify({"error": "course not found for user"}), 404
-
-    note_entry = None
-    for n in course.get("myNotes", []):
-        if n.get("name") == noteName:
-            note_entry = n
-            break
-    if note_entry is None:
-        return jsonify({"error": "note not found in this course for user"}), 404
+    note_entry, error = _find_note(user_id, lessonName, noteName)
+    if error:
+        return error
 
     # check that filename is among saved files
     saved_files = []
@@ -315,8 +733,11 @@ def download_note_file():
     if filename not in saved_files:
         return jsonify({"error": "file not associated with specified note"}), 404
 
-    # serve file from uploads directory
+    if note_entry.get("sha256"):
+        # 内容寻址存储中的文件，以笔记记录的文件名返回
+        return _send_blob(note_entry["sha256"], filename)
 
+    # serve file from uploads directory (notes not yet moved by `python -m database.blobstore migrate`)
     directory = BASE_STORAGE_DIR / str(user_id) / str(lessonName) / str(noteName)
     try:
         return send_from_directory(str(directory), filename, as_attachment=False)
@@ -424,79 +845,77 @@ def cloud_status():
     if not created_course:
         print(f"课程 '{course_title}' 可能已存在")
 
-    results = []
+    # 先把文件放进内容寻址存储（同一份讲义只存一次），数据库记录最后一次性写入
+    note_items = []
     for file_path in downloaded_files:
-        # downloaded_files 的元素是 str（本地路径）
-        file_path = str(file_path)
+        # 爬虫返回 {"path", "name"}，兼容直接返回本地路径 str 的情况
+        file_path = str(file_path["path"] if isinstance(file_path, dict) else file_path)
         file_name = os.path.basename(file_path)
-
         # 原来用 info.get("name") 做 note_title，现在没有了；用文件名（去扩展名）替代
         note_title = Path(file_name).stem or "Untitled"
 
-        note_dir = BASE_STORAGE_DIR / str(userId) / course_title / note_title
-        note_dir.mkdir(parents=True, exist_ok=True)
-
-        dest_path = note_dir / file_name
+        blob = None
         try:
-            shutil.copy2(file_path, dest_path)
-        except Exception as e:
-            print(f"复制文件失败 {file_path} -> {dest_path}: {e}")
-
-        note = storage.add_note(
-            title=note_title,
-            lessonName=course_title,
-            tags=["软工"],
-            files=[file_name],
-            user_id=userId,
+            blob = BLOB_STORE.put_file(file_path)
+            # 下载目录只是暂存，入库后删除
+            os.unlink(file_path)
+        except OSError as e:
+            print(f"保存文件失败 {file_path}: {e}")
+
+        note_items.append(
+            {
+                "title": note_title,
+                "lessonName": course_title,
+                "tags": ["软工"],
+                "files": [file_name],
+                "blob": blob,
+            }
         )
 
-        if note:
-            results.append(
-                {
-                    "note_name": note_title,
-                    "file_name": file_name,
-                    "course_title": course_title,
-                    "status": "success",
-                    "note_id": note.get("id"),
-                }
-            )
-            print(f"✓ 成功创建笔记: {note_title}, 文件: {file_name}")
-        else:
-            results.append(
-                {
-                    "note_name": note_title,
-                    "file_name": file_name,
-                    "course_title": course_title,
-                    "status": "failed",
-                }
-            )
-            print(f"✗ 创建笔记失败: {note_title}")
-
-    # --- 2) 写入 DDL tasks（保持你现在“可跑”的处理方式；deadline None -> 'None'） ---
+    # --- 2) 整理 DDL tasks ---
     deadlines = payload.get("deadlines", [])
-    created_tasks = []
+    task_items = []
 
     for item in deadlines:
-        name = item.get("name")
-        deadline_str = item.get("deadline")
-        message = item.get("message", "")
         status = item.get("status", 1)  # 0/1
 
-        if deadline_str is None:
-            deadline_str = "None"  # 你当前数据库 NOT NULL 的“临时兜底”
-
         # 数据库存字符串：0/1
         if isinstance(status, int):
             status_str = "0" if status == 0 else "1"
         else:
             status_str = status or "1"
 
-        new_task = storage.add_task(userId, name, message, deadline_str, status_str)
+        task_items.append(
+            {
+                "name": item.get("name"),
+                # 没有截止时间时为 None，数据库里记为“无截止时间”而不是字符串 "None"
+                "deadline": item.get("deadline"),
+                "message": item.get("message", ""),
+                "status": status_str,
+            }
+        )
+
+    # 笔记和任务在同一个事务里写入，整次同步只提交一次
+    written = storage.add_cloud_results(userId, note_items, task_items)
+    created_notes = written["notes"] if written else [None] * len(note_items)
+    created_tasks = written["tasks"] if written else []
+    if not written and task_items:
+        print(f"创建任务失败: {len(task_items)} 个任务未写入")
 
-        if new_task:
-            created_tasks.append(new_task)
+    results = []
+    for item, note in zip(note_items, created_notes):
+        result = {
+            "note_name": item["title"],
+            "file_name": item["files"][0],
+            "course_title": course_title,
+            "status": "success" if note else "failed",
+        }
+        if note:
+            result["note_id"] = note.get("id")
+            print(f"✓ 成功创建笔记: {item['title']}, 文件: {item['files'][0]}")
         else:
-            print(f"创建任务失败: {name} - {deadline_str}")
+            print(f"✗ 创建笔记失败: {item['title']}")
+        results.append(result)
 
     return jsonify(
         {
@@ -636,9 +1055,24 @@ def get_links():
     if not userId:
         return jsonify({"success": False, "error": "userId 为必填"}), 400
 
+    if _is_paginated():
+        return _page_response(
+            "links",
+            functools.partial(
+                storage.get_useful_links_page,
+                category_id=request.args.get("categoryId", type=int),
+            ),
+            userId,
+        )
+
+    etag = storage.get_etag(userId, "links")
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
     categories = storage.get_useful_links_by_category(userId)
     
-    return jsonify({"success": True, "categories": categories}), 200
+    return _with_revalidation(jsonify({"success": True, "categories": categories}), etag), 200
 
 @app.route("/links/categories/<int:category_id>", methods=["DELETE"])
 def delete_link_category(category_id):
@@ -678,6 +1112,42 @@ def delete_link(link_id):
     return jsonify({"success": True, "message": "链接删除成功"}), 200
 
 
+@app.route("/tasks", methods=["GET"])
+def list_tasks():
+    """
+    按截止时间分页获取任务
+    需要参数：userId；可选参数：limit（默认 50，最大 200）, cursor（上一页返回的 nextCursor）
+    """
+    userId = request.args.get("userId")
+
+    if not userId:
+        return jsonify({"success": False, "error": "userId 为必填"}), 400
+
+    return _page_response("tasks", storage.get_tasks_page, userId)
+
+
+UPCOMING_MAX_DAYS = 366
+
+
+@app.route("/tasks/upcoming", methods=["GET"])
+def upcoming_tasks():
+    """
+    获取接下来若干天内到期的任务（按截止时间排序）
+    需要参数：userId；可选参数：days（默认 7，最大 366）
+    """
+    userId = request.args.get("userId")
+    days = request.args.get("days", 7, type=float)
+
+    if not userId:
+        return jsonify({"success": False, "error": "userId 为必填"}), 400
+    if not 0 < days <= UPCOMING_MAX_DAYS:
+        return jsonify({"success": False, "error": "days 参数非法"}), 400
+
+    tasks = storage.get_upcoming_tasks(userId, days)
+
+    return jsonify({"success": True, "tasks": tasks}), 200
+
+
 @app.route("/edit/deadline", methods=["POST"])
 def updateDeadline():
     """
@@ -697,12 +1167,15 @@ def updateDeadline():
     if not userId or not deadlines:
         return jsonify({"success": False, "error": "userId 和 deadlines 均为必填"}), 400
 
-    success = storage.update_deadlines(userId, deadlines)
+    try:
+        changes = storage.update_deadlines(userId, deadlines)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     
-    if not success:
+    if changes is False:
         return jsonify({"success": False, "error": "更新DDL列表失败"}), 500
     
-    return jsonify({"success": True, "message": "DDL列表更新成功"}), 200
+    return jsonify({"success": True, "message": "DDL列表更新成功", "changes": changes}), 200
 
 @app.route("/edit/linkcategory", methods=["POST"])
 def updateLinkCategory():
@@ -722,44 +1195,12 @@ def updateLinkCategory():
     if not userId or not linkCategories:
         return jsonify({"success": False, "error": "userId 和 linkCategories 均为必填"}), 400
     
-    try:
-        # 删除用户现有的所有链接分类和链接
-        conn = storage.get_db_connection()
-        cursor = conn.cursor()
-        
-        # 注意：这里使用级联删除，会同时删除该分类下的链接
-        cursor.execute("DELETE FROM link_categories WHERE user_id = ?", (userId,))
-        
-        # 插入新的链接分类和链接
-        for category in linkCategories:
-            # 插入分类
-            cursor.execute(
-                "INSERT INTO link_categories (category, icon, user_id, sort_order) VALUES (?, ?, ?, ?)",
-                (category['category'], category['icon'], userId, category.get('sort_order', 0))
-            )
-            category_id = cursor.lastrowid
-            
-            # 插入该分类下的链接
-            for link in category.get('links', []):
-                cursor.execute(
-                    "INSERT INTO useful_links (name, url, description, is_trusted, category_id, user_id, sort_order) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (
-                        link['name'],
-                        link['url'],
-                        link.get('desc', ''),
-                        link.get('isTrusted', False),
-                        category_id,
-                        userId,
-                        link.get('sort_order', 0)
-                    )
-                )
-        
-        conn.commit()
-        return jsonify({"success": True, "message": "Link categories updated"}), 200
-        
-    except Exception as e:
-        print(f"更新链接分类时出错: {e}")
+    success = storage.replace_link_categories(userId, linkCategories)
+
+    if not success:
         return jsonify({"success": False, "error": "更新链接分类失败"}), 500
+
+    return jsonify({"success": True, "message": "Link categories updated"}), 200
     
 
 @app.route("/sync", methods=["POST"])
@@ -776,6 +1217,13 @@ def sync_route():
     return jsonify(success=True, schedule=data["grid"], course_list=data["course_list"])
 
 # 课表相关接口
+def _valid_times(times):
+    """times 必须是 0-83 的整数列表（一周 84 个时间段）"""
+    return isinstance(times, list) and all(
+        isinstance(t, int) and not isinstance(t, bool) and 0 <= t < SLOT_COUNT for t in times
+    )
+
+
 @app.route("/course-table", methods=["POST"])
 def create_course_schedule():
     """
@@ -798,9 +1246,8 @@ def create_course_schedule():
     if not userId or not name or not times:
         return jsonify({"success": False, "error": "userId, name, times 均为必填"}), 400
     
-    # 验证 times 是整数列表
-    if not isinstance(times, list) or not all(isinstance(t, int) for t in times):
-        return jsonify({"success": False, "error": "times 必须是整数列表"}), 400
+    if not _valid_times(times):
+        return jsonify({"success": False, "error": f"times 必须是 0-{SLOT_COUNT - 1} 的整数列表"}), 400
     
     new_schedule = storage.add_course_schedule(userId, name, teacher, location, week_type, times)
     
@@ -819,10 +1266,68 @@ def get_course_table():
     
     if not userId:
         return jsonify({"success": False, "error": "userId 为必填"}), 400
+
+    if _is_paginated():
+        return _page_response("courseTable", storage.get_course_schedules_page, userId)
+
+    etag = storage.get_etag(userId, "schedule")
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
     
     course_table = storage.get_course_schedules(userId)
     
-    return jsonify({"success": True, "courseTable": course_table}), 200
+    return _with_revalidation(jsonify({"success": True, "courseTable": course_table}), etag), 200
+
+FREE_SLOTS_MAX_USERS = 500
+
+
+@app.route("/schedule/free-slots", methods=["GET"])
+def schedule_free_slots():
+    """
+    求多个用户的共同空闲时间段
+    需要参数：userIds（逗号分隔，或重复传参；最多 500 个）
+    返回的时间索引与课表 times 相同（节次 * 7 + 星期）
+    """
+    try:
+        user_ids = list(dict.fromkeys(
+            int(part)
+            for value in request.args.getlist("userIds")
+            for part in value.split(",")
+            if part.strip()
+        ))
+    except ValueError:
+        return jsonify({"success": False, "error": "userIds 必须是整数列表"}), 400
+
+    if not user_ids:
+        return jsonify({"success": False, "error": "userIds 为必填"}), 400
+    if len(user_ids) > FREE_SLOTS_MAX_USERS:
+        return jsonify({"success": False, "error": f"userIds 最多 {FREE_SLOTS_MAX_USERS} 个"}), 400
+
+    result = storage.find_free_slots(user_ids)
+    if result is None:
+        return jsonify({"success": False, "error": "查询空闲时间失败"}), 500
+
+    return jsonify({"success": True, "userIds": user_ids, **result}), 200
+
+
+@app.route("/schedule/conflicts", methods=["GET"])
+def schedule_conflicts():
+    """
+    检查用户课表中的时间冲突
+    需要参数：userId
+    """
+    userId = request.args.get("userId")
+
+    if not userId:
+        return jsonify({"success": False, "error": "userId 为必填"}), 400
+
+    conflicts = storage.get_schedule_conflicts(userId)
+    if conflicts is None:
+        return jsonify({"success": False, "error": "查询课表冲突失败"}), 500
+
+    return jsonify({"success": True, "conflicts": conflicts}), 200
+
 
 @app.route("/course-table/<int:schedule_id>", methods=["PUT"])
 def update_course_schedule_route(schedule_id):
@@ -853,6 +1358,9 @@ def update_course_schedule_route(schedule_id):
     
     if not updates:
         return jsonify({"success": False, "error": "没有提供要更新的字段"}), 400
+
+    if 'times' in updates and not _valid_times(updates['times']):
+        return jsonify({"success": False, "error": f"times 必须是 0-{SLOT_COUNT - 1} 的整数列表"}), 400
     
     success = storage.update_course_schedule(userId, schedule_id, **updates)
     
@@ -897,12 +1405,12 @@ def update_course_table():
     if not userId or not course_table:
         return jsonify({"success": False, "error": "userId 和 courseTable 均为必填"}), 400
     
-    success = storage.update_course_table(userId, course_table)
+    changes = storage.update_course_table(userId, course_table)
     
-    if not success:
+    if changes is False:
         return jsonify({"success": False, "error": "更新课表失败"}), 500
     
-    return jsonify({"success": True, "message": "课表更新成功"}), 200
+    return jsonify({"success": True, "message": "课表更新成功", "changes": changes}), 200
 
 if __name__ == "__main__":
     # Run on port 4000
@@ -7,12 +7,16 @@ dbPath = Path(__file__).parent / "database" / "database.db"
 uploadsDir = Path(__file__).parent / "uploads"
 
 def clear_database():
-    """Delete the database file."""
+    """Delete the database file (and its WAL/shared-memory files)."""
     if dbPath.exists():
         os.remove(dbPath)
         print("Database cleared.")
     else:
         print("No database file found to clear.")
+    for suffix in ("-wal", "-shm"):
+        sidecar = dbPath.with_name(dbPath.name + suffix)
+        if sidecar.exists():
+            os.remove(sidecar)
     
 def clear_uploads():
     if uploadsDir.exists():
@@ -1,7 +1,12 @@
+from .cache import VersionedLRUCache
 from .database import Database
+from .sharding import ShardedDatabase
 from .storage import (
     add_course,
     add_note,
+    add_notes_bulk,
+    add_tasks_bulk,
+    add_cloud_results,
     add_user,
     find_user_by_credentials,
     find_user_by_username_or_email,
@@ -24,16 +29,45 @@ from .storage import (
     update_course_schedule,
     delete_course_schedule,
     update_course_table,
+    close_connection,
+    pool_stats,
+    query_stats,
+    write_stats,
+    get_revision,
+    get_etag,
+    replace_link_categories,
+    search,
+    find_note,
+    get_storage_usage,
+    create_upload,
+    get_upload,
+    add_upload_chunk,
+    complete_upload,
+    delete_upload,
+    get_notes_page,
+    get_useful_links_page,
+    get_tasks_page,
+    get_upcoming_tasks,
+    get_course_schedules_page,
+    find_free_slots,
+    get_schedule_conflicts,
+    export_user,
+    import_user,
 )
 
 __all__ = [
     "Database",
+    "ShardedDatabase",
+    "VersionedLRUCache",
     "get_user",
     "find_user_by_credentials",
     "find_user_by_username_or_email",
     "add_user",
     "add_course",
     "add_note",
+    "add_notes_bulk",
+    "add_tasks_bulk",
+    "add_cloud_results",
     # 新增的导出
     "edit_course",
     "edit_note",
@@ -53,5 +87,29 @@ __all__ = [
     update_course_schedule,
     delete_course_schedule,
     update_course_table,
+    "close_connection",
+    "pool_stats",
+    "query_stats",
+    "write_stats",
+    "get_revision",
+    "get_etag",
+    "replace_link_categories",
+    "search",
+    "find_note",
+    "get_storage_usage",
+    "create_upload",
+    "get_upload",
+    "add_upload_chunk",
+    "complete_upload",
+    "delete_upload",
+    "get_notes_page",
+    "get_useful_links_page",
+    "get_tasks_page",
+    "get_upcoming_tasks",
+    "get_course_schedules_page",
+    "find_free_slots",
+    "get_schedule_conflicts",
+    "export_user",
+    "import_user",
     "seed",
 ]
\ No newline at end of file
@@ -0,0 +1,270 @@
+"""
+SQLite 在线备份与恢复。
+用 backup API 每步复制少量页，备份期间应用照常读写；快照先经 integrity_check 校验再改名保存，
+按 keep 保留最新的若干个。命令行：python -m database.backup backup|list|verify|restore
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# database 模块加载 .env，这里的环境变量同样可以写在 .env 中
+from .database import DB_FILE
+
+# 每一步复制的页数；步与步之间释放源库的读锁
+BACKUP_PAGES = int(os.getenv("db_backup_pages", "256"))
+# 每一步之后的停顿（毫秒），给写操作让出时间
+BACKUP_STEP_SLEEP_MS = float(os.getenv("db_backup_step_sleep_ms", "0"))
+BACKUP_KEEP = int(os.getenv("db_backup_keep", "7"))
+# 定时备份的间隔（秒），0 表示不开启
+BACKUP_INTERVAL_S = float(os.getenv("db_backup_interval_s", "0"))
+BACKUP_DIR = os.getenv("db_backup_dir", "")
+
+
+class BackupError(Exception):
+    """快照校验失败或备份文件不可用。"""
+
+
+def default_backup_dir(db_path):
+    """未配置 db_backup_dir 时，快照放在数据库文件旁边的 backups/ 目录。"""
+    return Path(BACKUP_DIR) if BACKUP_DIR else Path(db_path).resolve().parent / "backups"
+
+
+def list_backups(db_path, backup_dir=None):
+    """按时间从旧到新返回 db_path 的全部快照路径。"""
+    backup_dir = Path(backup_dir) if backup_dir else default_backup_dir(db_path)
+    stem = Path(db_path).stem
+    # 分片库 database-shard0.db 的快照也以 "database-" 开头，要求名字恰好是 stem 加时间戳
+    pattern = re.compile(rf"{re.escape(stem)}-\d{{8}}-\d{{6}}-\d{{6}}\.db")
+    # 文件名中的时间戳定长，按名字排序即按时间排序
+    return sorted(path for path in backup_dir.glob(f"{stem}-*.db") if pattern.fullmatch(path.name))
+
+
+def verify_backup(path):
+    """对快照执行 PRAGMA integrity_check，返回发现的问题列表（空列表表示完好）。"""
+    path = Path(path)
+    if not path.is_file():
+        raise BackupError(f"备份文件不存在: {path}")
+    conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        conn.close()
+    return [] if rows == ["ok"] else rows
+
+
+def backup_database(db_path, dest_path, pages=None, step_sleep_ms=None, verify=True):
+    """
+    把 db_path 在线复制到 dest_path。
+    先写到同目录的临时文件，校验通过后再原子地改名，dest_path 不会出现写了一半的快照。
+    返回 {"path", "bytes", "pages", "steps", "seconds", "integrity"}；校验失败时抛出 BackupError。
+    """
+    pages = BACKUP_PAGES if pages is None else pages
+    step_sleep = (BACKUP_STEP_SLEEP_MS if step_sleep_ms is None else step_sleep_ms) / 1000
+    dest_path = Path(dest_path)
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest_path.with_name(dest_path.name + ".tmp")
+    steps = 0
+    total_pages = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps, total_pages
+        steps += 1
+        total_pages = total
+        if step_sleep and remaining:
+            time.sleep(step_sleep)
+
+    start = time.perf_counter()
+    source = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=pages, progress=progress)
+        # 源库是 WAL 模式，快照改回 DELETE 模式，成为不依赖 -wal 文件的单个文件
+        target.execute("PRAGMA journal_mode = DELETE")
+    except BaseException:
+        target.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        source.close()
+    target.close()
+
+    integrity = "skipped"
+    if verify:
+        problems = verify_backup(tmp_path)
+        if problems:
+            tmp_path.unlink(missing_ok=True)
+            raise BackupError(f"快照校验失败: {'; '.join(problems[:5])}")
+        integrity = "ok"
+    os.replace(tmp_path, dest_path)
+    return {
+        "path": str(dest_path),
+        "bytes": dest_path.stat().st_size,
+        "pages": total_pages,
+        "steps": steps,
+        "seconds": round(time.perf_counter() - start, 3),
+        "integrity": integrity,
+    }
+
+
+def prune_backups(db_path, backup_dir=None, keep=None):
+    """只保留最新的 keep 个快照，返回被删除的路径。"""
+    keep = BACKUP_KEEP if keep is None else keep
+    snapshots = list_backups(db_path, backup_dir)
+    expired = snapshots[:-keep] if keep > 0 else snapshots
+    for path in expired:
+        path.unlink(missing_ok=True)
+    return expired
+
+
+def snapshot(db_path, backup_dir=None, keep=None, pages=None, step_sleep_ms=None):
+    """生成一个带时间戳的快照并按 keep 清理旧快照，返回 backup_database 的结果及 "pruned"。"""
+    backup_dir = Path(backup_dir) if backup_dir else default_backup_dir(db_path)
+    name = f"{Path(db_path).stem}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+    result = backup_database(db_path, backup_dir / name, pages=pages, step_sleep_ms=step_sleep_ms)
+    result["pruned"] = [str(path) for path in prune_backups(db_path, backup_dir, keep)]
+    return result
+
+
+def restore_backup(backup_path, db_path, pages=-1):
+    """
+    用快照覆盖 db_path 的内容。
+    先校验快照，再通过 backup API 写入目标库：写入期间持有目标库的写锁，
+    已打开的连接在下一次读取时看到恢复后的数据，不需要删除 -wal/-shm 文件。
+    恢复后 schema 可能比代码旧，重启应用时会自动执行迁移。
+    恢复后重新生成数据库实例标识（db_meta.epoch）：版本号回到了快照时的值，
+    旧的 ETag 和 /userdata 缓存不能因为版本号碰巧相同而被当作有效。
+    """
+    problems = verify_backup(backup_path)
+    if problems:
+        raise BackupError(f"快照校验失败，未恢复: {'; '.join(problems[:5])}")
+    start = time.perf_counter()
+    source = sqlite3.connect(f"{Path(backup_path).resolve().as_uri()}?mode=ro", uri=True)
+    target = sqlite3.connect(db_path, timeout=30)
+    try:
+        source.backup(target, pages=pages)
+        with target:
+            # 旧版本的快照可能还没有 db_meta 表，由迁移创建
+            if target.execute("SELECT 1 FROM sqlite_master WHERE name = 'db_meta'").fetchone():
+                target.execute("UPDATE db_meta SET value = lower(hex(randomblob(8))) WHERE key = 'epoch'")
+    finally:
+        source.close()
+        target.close()
+    return {"path": str(db_path), "seconds": round(time.perf_counter() - start, 3)}
+
+
+class BackupScheduler:
+    """
+    后台定时快照线程：每 interval 秒执行一次 snapshot，保留最新 keep 个。
+    最近一次的结果、耗时和失败信息通过 stats() 查看。
+    """
+
+    def __init__(self, db_path, interval, backup_dir=None, keep=None, pages=None, step_sleep_ms=None):
+        self.db_path = Path(db_path)
+        self.interval = float(interval)
+        self.backup_dir = Path(backup_dir) if backup_dir else default_backup_dir(db_path)
+        self.keep = BACKUP_KEEP if keep is None else keep
+        self.pages = pages
+        self.step_sleep_ms = step_sleep_ms
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "failures": 0, "last": None, "last_error": None}
+        self._thread = threading.Thread(target=self._run, name="sqlite-backup", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def run_once(self):
+        """立即执行一次快照，返回结果；失败时记录错误并返回 None。"""
+        try:
+            result = snapshot(
+                self.db_path, self.backup_dir, self.keep, self.pages, self.step_sleep_ms
+            )
+        except (sqlite3.Error, OSError, BackupError) as e:
+            print(f"数据库备份失败: {e}")
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["failures"] += 1
+                self._stats["last_error"] = {"error": str(e), "at": time.time()}
+            return None
+        print(f"数据库备份完成: {result['path']}（{result['pages']} 页，{result['seconds']}s）")
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last"] = {**result, "at": time.time()}
+        return result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "interval_s": self.interval,
+                "dir": str(self.backup_dir),
+                "keep": self.keep,
+                "snapshots": len(list_backups(self.db_path, self.backup_dir)),
+                **self._stats,
+            }
+
+
+def start_scheduler(db_path, interval=None):
+    """按环境变量 db_backup_interval_s 启动定时备份；未开启时返回 None。"""
+    interval = BACKUP_INTERVAL_S if interval is None else interval
+    if interval <= 0:
+        return None
+    return BackupScheduler(db_path, interval).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup_cmd = commands.add_parser("backup", help="生成一个快照并清理旧快照")
+    list_cmd = commands.add_parser("list", help="列出快照")
+    verify_cmd = commands.add_parser("verify", help="校验快照")
+    restore_cmd = commands.add_parser("restore", help="用快照覆盖数据库")
+    for cmd in (backup_cmd, list_cmd, restore_cmd):
+        cmd.add_argument("--db", default=DB_FILE)
+    for cmd in (backup_cmd, list_cmd):
+        cmd.add_argument("--dir", default=None)
+    backup_cmd.add_argument("--keep", type=int, default=None)
+    backup_cmd.add_argument("--pages", type=int, default=None)
+    for cmd in (verify_cmd, restore_cmd):
+        cmd.add_argument("snapshot")
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        result = snapshot(args.db, args.dir, args.keep, args.pages)
+        print(
+            f"{result['path']}: {result['bytes']} bytes, {result['pages']} pages "
+            f"in {result['steps']} steps, {result['seconds']}s, integrity {result['integrity']}"
+        )
+        for path in result["pruned"]:
+            print(f"pruned {path}")
+    elif args.command == "list":
+        for path in list_backups(args.db, args.dir):
+            print(f"{path}  {path.stat().st_size} bytes")
+    elif args.command == "verify":
+        problems = verify_backup(args.snapshot)
+        print("ok" if not problems else "\n".join(problems))
+        raise SystemExit(1 if problems else 0)
+    elif args.command == "restore":
+        result = restore_backup(args.snapshot, args.db)
+        print(f"restored {args.snapshot} -> {result['path']} in {result['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Benchmark the /userdata aggregate loaders.
+
+Usage (from backend/):
+  python -m database.bench_aggregates [--sizes 1,10,30,100] [--repeat 20]
+
+For every size N a throw-away database is seeded with one user owning
+N courses, 3 notes per course, N link categories with 3 links each and
+N course schedules with 4 time slots each. Then, for every aggregate
+loader, it reports:
+- the number of SQL statements issued per call
+- the average latency per call
+- whether the JSON output is byte-identical to the legacy N+1 version
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from .database import Database
+from .slots import unpack_slots
+
+
+# --- 旧版（逐条查询）实现，仅用于对比输出与查询次数 ---
+def legacy_get_user_with_courses_and_notes(db: Database, user_id):
+    cursor = db.get_db_connection().cursor()
+    user = db.get_user(user_id)
+    if not user:
+        return None
+    cursor.execute("SELECT c.* FROM courses c WHERE c.user_id = ?", (user_id,))
+    user_dict = dict(user)
+    user_dict["courses"] = [dict(c) for c in cursor.fetchall()]
+    for course in user_dict["courses"]:
+        course["tags"] = json.loads(course["tags"]) if course["tags"] else []
+        cursor.execute(
+            "SELECT n.id, n.name, n.file FROM notes n WHERE n.user_id = ? AND n.course_id = ?",
+            (user_id, course["id"]),
+        )
+        course["myNotes"] = [dict(n) for n in cursor.fetchall()]
+        course["name"] = course.pop("title")
+        for note in course["myNotes"]:
+            note["lessonName"] = course["name"]
+    return user_dict
+
+
+def legacy_get_useful_links_by_category(db: Database, user_id):
+    cursor = db.get_db_connection().cursor()
+    result = []
+    for category in db.get_link_categories(user_id):
+        cursor.execute(
+            "SELECT * FROM useful_links WHERE user_id = ? AND category_id = ? ORDER BY sort_order, created_at",
+            (user_id, category["id"]),
+        )
+        links = [
+            {
+                "name": link["name"],
+                "url": link["url"],
+                "desc": link["description"] or "",
+                "isTrusted": bool(link["is_trusted"]),
+            }
+            for link in cursor.fetchall()
+        ]
+        result.append(
+            {"category": category["category"], "icon": category["icon"], "links": links}
+        )
+    return result
+
+
+def legacy_get_course_schedules(db: Database, user_id):
+    cursor = db.get_db_connection().cursor()
+    cursor.execute(
+        "SELECT * FROM course_schedules WHERE user_id = ? ORDER BY name", (user_id,)
+    )
+    result = []
+    for schedule in cursor.fetchall():
+        cursor.execute(
+            "SELECT slots_lo, slots_hi FROM course_schedules WHERE id = ?",
+            (schedule["id"],),
+        )
+        slots = cursor.fetchone()
+        result.append(
+            {
+                "id": schedule["id"],
+                "name": schedule["name"],
+                "teacher": schedule["teacher"] or "",
+                "location": schedule["location"] or "",
+                "weekType": schedule["week_type"],
+                "times": unpack_slots(slots["slots_lo"], slots["slots_hi"]),
+            }
+        )
+    return result
+
+
+def seed_user(db: Database, n: int) -> int:
+    """Create one user with n courses / categories / schedules. Returns user id."""
+    user = db.add_user(f"bench{n}", f"bench{n}@example.com", "pw")
+    user_id = user["id"]
+    for i in range(n):
+        title = f"课程{i:03d}"
+        db.add_course_to_user(user_id, title, ["基准", str(i)])
+        for j in range(3):
+            db.add_note(f"笔记{j}", title, [], [f"file{j}.pdf"], user_id)
+        category = db.add_link_category(user_id, f"分类{i}", "🔗", i % 3)
+        for j in range(3):
+            db.add_useful_link(
+                user_id, category["id"], f"链接{j}", f"https://example.com/{i}/{j}", "", j % 2 == 0, j
+            )
+        db.add_course_schedule(
+            user_id, f"课表{i:03d}", "老师", "教室", i % 3, [(i * 4 + k) % 84 for k in range(4)]
+        )
+    return user_id
+
+
+def count_queries(db: Database, fn, *args):
+    """Run fn once and return (result, number of SQL statements executed)."""
+    conn = db.get_db_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        result = fn(*args)
+    finally:
+        conn.set_trace_callback(None)
+    return result, len(statements)
+
+
+def measure(db: Database, fn, *args, repeat=20):
+    """Return the average latency of fn in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def run(sizes, repeat=20):
+    rows = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(str(Path(tmp) / "bench.db"))
+            user_id = seed_user(db, n)
+            loaders = [
+                (
+                    "get_user_with_courses_and_notes",
+                    db.get_user_with_courses_and_notes,
+                    legacy_get_user_with_courses_and_notes,
+                ),
+                (
+                    "get_useful_links_by_category",
+                    db.get_useful_links_by_category,
+                    legacy_get_useful_links_by_category,
+                ),
+                (
+                    "get_course_schedules",
+                    db.get_course_schedules,
+                    legacy_get_course_schedules,
+                ),
+            ]
+            for name, new_fn, legacy_fn in loaders:
+                new_result, new_queries = count_queries(db, new_fn, user_id)
+                old_result, old_queries = count_queries(db, legacy_fn, db, user_id)
+                identical = json.dumps(new_result, ensure_ascii=False) == json.dumps(
+                    old_result, ensure_ascii=False
+                )
+                rows.append(
+                    (
+                        n,
+                        name,
+                        old_queries,
+                        new_queries,
+                        measure(db, legacy_fn, db, user_id, repeat=repeat),
+                        measure(db, new_fn, user_id, repeat=repeat),
+                        identical,
+                    )
+                )
+            db.close_connection()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,10,30,100")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    header = f"{'N':>5}  {'loader':<34}{'queries old/new':>16}{'ms old':>10}{'ms new':>10}  identical"
+    print(header)
+    print("-" * len(header))
+    for n, name, old_q, new_q, old_ms, new_ms, identical in run(sizes, args.repeat):
+        print(
+            f"{n:>5}  {name:<34}{f'{old_q}/{new_q}':>16}{old_ms:>10.3f}{new_ms:>10.3f}  {identical}"
+        )
+
+
+if __name__ == "__main__":
+    main()
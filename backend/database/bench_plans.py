@@ -0,0 +1,421 @@
+"""
+Query-plan regression check and latency report for every Database statement.
+
+Usage (from backend/):
+  python -m database.bench_plans [--users 2000] [--per-user 20] [--repeat 20]
+
+A throw-away database is seeded with --users users, each owning
+--per-user courses (3 notes each), tasks and schedules, and --per-user / 4
+link categories with 4 links each. Then every Database method is called
+--repeat times while each SQL statement it issues is recorded. app.py
+issues no SQL of its own, so this covers every statement the backend runs.
+
+For every statement the report shows the methods that issue it, its
+p50/p99 latency and its EXPLAIN QUERY PLAN. The exit status is 1 when a
+statement scans a table (a plan line "SCAN <table>") without an entry in
+ALLOWED_SCANS, or when a method listed in EXPECTED_INDEXES stops using
+its index. database/test_database.py runs the same check on a small seed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import inspect
+import re
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from . import database as database_module
+from .database import Database
+from .deadlines import deadline_columns
+from .metrics import InstrumentedCursor, QueryMetrics
+from .slots import split_mask, slots_to_mask
+
+# 不执行 SQL 的方法，不需要出现在 WORKLOAD 中
+NO_SQL_METHODS = frozenset(
+    {"close", "close_connection", "get_db_connection", "pool_stats", "query_stats", "write_stats", "setup_database"}
+)
+
+# 允许全表扫描的语句：(语句中的一段文本, 被扫描的表或别名) -> 原因。目前没有
+ALLOWED_SCANS = {}
+
+# 方法 -> 其语句的执行计划中必须出现的索引
+EXPECTED_INDEXES = {
+    "find_note": {"ux_courses_user_title", "ix_notes_user_course_name"},
+    "find_user_by_username_or_email": {"sqlite_autoindex_users_1", "sqlite_autoindex_users_2"},
+    "get_user_with_courses_and_notes": {"ix_courses_user_id", "ix_notes_user_id"},
+    "get_notes_page": {"ix_notes_user_id"},
+    "unreferenced_blobs": {"ix_blobs_refcount"},
+    "purge_uploads": {"ix_upload_sessions_updated"},
+    "legacy_note_files": {"ix_notes_legacy_files"},
+    "get_storage_usage": {"ix_notes_user_id"},
+    "get_tasks_page": {"ix_tasks_user_due"},
+    "get_upcoming_tasks": {"ix_tasks_user_due"},
+    "get_useful_links_page": {"ix_useful_links_user_order", "ix_useful_links_category_order"},
+    "get_course_schedules": {"ix_course_schedules_user_name"},
+    "get_course_schedules_page": {"ix_course_schedules_user_name"},
+    "edit_note": {"ix_notes_user_course_name"},
+}
+
+_SCAN = re.compile(r"^SCAN (\w+)")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+class PlanCursor(InstrumentedCursor):
+    """executemany 时记下第一组参数，之后用它对语句做 EXPLAIN QUERY PLAN。"""
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        if seq_of_parameters:
+            self.connection._pool.metrics.note_parameters(sql, seq_of_parameters[0])
+        return super().executemany(sql, seq_of_parameters)
+
+
+class PlanRecorder(QueryMetrics):
+    """
+    按语句记录每次执行的耗时、发出该语句的方法（label）和第一组参数。
+    只在单线程的基准中使用，label 由调用方在调用每个方法前设置。
+    """
+
+    cursor_factory = PlanCursor
+
+    def __init__(self):
+        super().__init__(slow_ms=float("inf"))
+        self.label = None
+        self.recorded = {}
+
+    def _entry(self, sql):
+        key = " ".join(sql.split())
+        entry = self.recorded.get(key)
+        if entry is None:
+            entry = self.recorded[key] = {"sql": sql, "methods": set(), "parameters": None, "ms": []}
+        return entry
+
+    def note_parameters(self, sql, parameters):
+        entry = self._entry(sql)
+        if entry["parameters"] is None:
+            entry["parameters"] = parameters
+
+    def observe(self, conn, sql, parameters, elapsed, rowcount):
+        key = super().observe(conn, sql, parameters, elapsed, rowcount)
+        if self.label is not None:
+            entry = self._entry(sql)
+            entry["methods"].add(self.label)
+            entry["ms"].append(elapsed * 1000)
+            if entry["parameters"] is None and parameters is not None:
+                entry["parameters"] = parameters
+        return key
+
+
+def seed(db: Database, users: int, per_user: int) -> dict:
+    """直接写表生成测试数据，返回 WORKLOAD 使用的上下文（用户、课程、笔记等的 id 和名称）。"""
+    conn = db.get_db_connection()
+    categories = max(1, per_user // 4)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+            [(f"user{u}", f"user{u}@example.com", "pw") for u in range(users)],
+        )
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        conn.executemany(
+            "INSERT INTO courses (title, tags, user_id) VALUES (?, ?, ?)",
+            [(f"课程{c:03d}", '["基准"]', uid) for uid in user_ids for c in range(per_user)],
+        )
+        conn.executemany(
+            "INSERT INTO notes (name, file, user_id, course_id) VALUES (?, ?, ?, ?)",
+            [
+                (f"笔记{n}", f"file{n}.pdf", row[1], row[0])
+                for row in conn.execute("SELECT id, user_id FROM courses").fetchall()
+                for n in range(3)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO tasks (name, deadline, deadline_at, has_deadline, message, status, user_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (f"作业{t}", *deadline_columns(f"2025-{t % 12 + 1:02d}-15 23:59" if t % 5 else ""), "", 1, uid)
+                for uid in user_ids
+                for t in range(per_user)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO link_categories (category, icon, sort_order, user_id) VALUES (?, ?, ?, ?)",
+            [(f"分类{c}", "🔗", c, uid) for uid in user_ids for c in range(categories)],
+        )
+        conn.executemany(
+            "INSERT INTO useful_links (name, url, description, is_trusted, sort_order, category_id, user_id) "
+            "VALUES (?, ?, '', 0, ?, ?, ?)",
+            [
+                (f"链接{k}", f"https://example.com/{row[0]}/{k}", k, row[0], row[1])
+                for row in conn.execute("SELECT id, user_id FROM link_categories").fetchall()
+                for k in range(4)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO course_schedules (name, teacher, location, week_type, slots_lo, slots_hi, user_id) "
+            "VALUES (?, '老师', '教室', ?, ?, ?, ?)",
+            [
+                (f"课表{s:03d}", s % 3, *split_mask(slots_to_mask([(uid + s * 4 + k) % 84 for k in range(2)])), uid)
+                for uid in user_ids
+                for s in range(per_user)
+            ],
+        )
+    user_id = user_ids[len(user_ids) // 2]
+    row = conn.execute(
+        "SELECT (SELECT id FROM link_categories WHERE user_id = ?1 LIMIT 1), "
+        "(SELECT id FROM course_schedules WHERE user_id = ?1 LIMIT 1)",
+        (user_id,),
+    ).fetchone()
+    return {
+        "user_id": user_id,
+        "username": f"user{user_ids.index(user_id)}",
+        "group": user_ids[:50],
+        "course": "课程001",
+        "note": "笔记1",
+        "category_id": row[0],
+        "schedule_id": row[1],
+        "small_user": user_ids[0],
+    }
+
+
+def _second_page(page_fn):
+    first = page_fn(None)
+    return page_fn(first["nextCursor"])
+
+
+def _scratch_user(db, i, name):
+    return db.add_user(f"{name}{i}", f"{name}{i}@example.com", "pw")["id"]
+
+
+# 方法名 -> 调用一次该方法的函数 (db, ctx, i)；i 为第几次调用，写操作用它生成不重复的名称。
+# 写操作在读操作之后执行，需要先准备数据的调用在准备时不计入统计（见 run_workload）
+WORKLOAD = {
+    "get_user": lambda db, c, i: db.get_user(c["user_id"]),
+    "get_user_with_courses_and_notes": lambda db, c, i: db.get_user_with_courses_and_notes(c["user_id"]),
+    "get_notes_page": lambda db, c, i: (
+        _second_page(lambda cursor: db.get_notes_page(c["user_id"], 20, cursor)),
+        db.get_notes_page(c["user_id"], 20, None, c["course"]),
+    ),
+    "find_note": lambda db, c, i: db.find_note(c["user_id"], c["course"], c["note"]),
+    "find_user_by_credentials": lambda db, c, i: db.find_user_by_credentials(c["username"], "pw"),
+    "find_user_by_username_or_email": lambda db, c, i: db.find_user_by_username_or_email(c["username"]),
+    "get_link_categories": lambda db, c, i: db.get_link_categories(c["user_id"]),
+    "get_useful_links_by_category": lambda db, c, i: db.get_useful_links_by_category(c["user_id"]),
+    "get_useful_links_page": lambda db, c, i: (
+        _second_page(lambda cursor: db.get_useful_links_page(c["user_id"], 2, cursor)),
+        _second_page(lambda cursor: db.get_useful_links_page(c["user_id"], 2, cursor, c["category_id"])),
+    ),
+    "get_tasks": lambda db, c, i: db.get_tasks(c["user_id"]),
+    "get_tasks_page": lambda db, c, i: _second_page(lambda cursor: db.get_tasks_page(c["user_id"], 5, cursor)),
+    "get_upcoming_tasks": lambda db, c, i: db.get_upcoming_tasks(c["user_id"], 30, now=1735660800),
+    "get_course_schedules": lambda db, c, i: db.get_course_schedules(c["user_id"]),
+    "get_course_schedules_page": lambda db, c, i: _second_page(
+        lambda cursor: db.get_course_schedules_page(c["user_id"], 5, cursor)
+    ),
+    "get_week_occupancy": lambda db, c, i: db.get_week_occupancy(c["group"]),
+    "find_free_slots": lambda db, c, i: db.find_free_slots(c["group"]),
+    "get_schedule_conflicts": lambda db, c, i: db.get_schedule_conflicts(c["user_id"]),
+    "search": lambda db, c, i: db.search(c["user_id"], "课程"),
+    "get_revision": lambda db, c, i: db.get_revision(c["user_id"]),
+    "get_epoch": lambda db, c, i: db.get_epoch(),
+    "export_user": lambda db, c, i: list(db.export_user(c["small_user"])),
+    "_get_user_shard": lambda db, c, i: db._get_user_shard(c["user_id"]),
+    "unreferenced_blobs": lambda db, c, i: db.unreferenced_blobs(100),
+    "get_storage_usage": lambda db, c, i: db.get_storage_usage(c["user_id"]),
+    "get_upload": lambda db, c, i: db.get_upload(c["user_id"], c["upload_id"]),
+    "legacy_note_files": lambda db, c, i: (db.legacy_note_files(0, 100), db.legacy_note_files(0, 100, c["user_id"])),
+    "known_blobs": lambda db, c, i: db.known_blobs(["0" * 64, "f" * 64]),
+    # 以下为写操作
+    "add_user": lambda db, c, i: db.add_user(f"new{i}", f"new{i}@example.com", "pw"),
+    "add_course_to_user": lambda db, c, i: db.add_course_to_user(c["user_id"], f"新课程{i}"),
+    "edit_course": lambda db, c, i: db.edit_course(c["user_id"], f"新课程{i}", f"改名课程{i}"),
+    "add_note": lambda db, c, i: db.add_note(f"新笔记{i}", c["course"], [], ["x.pdf"], c["user_id"]),
+    "edit_note": lambda db, c, i: db.edit_note(c["user_id"], c["course"], f"新笔记{i}", f"改名笔记{i}"),
+    "add_notes_bulk": lambda db, c, i: db.add_notes_bulk(
+        c["user_id"], [{"title": f"批量笔记{i}", "lessonName": c["course"], "files": []}]
+    ),
+    "add_link_category": lambda db, c, i: db.add_link_category(c["user_id"], f"新分类{i}", "i"),
+    "add_useful_link": lambda db, c, i: db.add_useful_link(
+        c["user_id"], c["category_id"], f"新链接{i}", "https://example.com"
+    ),
+    "add_task": lambda db, c, i: db.add_task(c["user_id"], f"新任务{i}", "2025-06-01 12:00"),
+    "add_tasks_bulk": lambda db, c, i: db.add_tasks_bulk(c["user_id"], [{"name": f"批量任务{i}", "deadline": ""}]),
+    "add_cloud_results": lambda db, c, i: db.add_cloud_results(
+        c["user_id"],
+        [{"title": f"云笔记{i}", "lessonName": c["course"], "files": []}],
+        [{"name": f"云任务{i}", "deadline": ""}],
+    ),
+    "update_task": lambda db, c, i: db.update_task(c["user_id"], c["task_id"], status=i % 2),
+    "add_course_schedule": lambda db, c, i: db.add_course_schedule(c["user_id"], f"新课表{i}", "", "", 0, [i % 84]),
+    "update_course_schedule": lambda db, c, i: db.update_course_schedule(
+        c["user_id"], c["schedule_id"], times=[i % 84]
+    ),
+    "update_deadlines": lambda db, c, i: db.update_deadlines(
+        c["scratch"], [{"name": "作业", "deadline": f"2025-01-{i % 28 + 1:02d}"}, {"name": "报告", "deadline": ""}]
+    ),
+    "update_course_table": lambda db, c, i: db.update_course_table(
+        c["scratch"], [{"name": "课表", "weekType": 0, "times": [i % 84]}, {"name": "实验", "times": [1]}]
+    ),
+    "replace_link_categories": lambda db, c, i: db.replace_link_categories(
+        c["scratch"], [{"category": "分类", "icon": "i", "links": [{"name": "n", "url": "u", "desc": "", "isTrusted": False}]}]
+    ),
+    "import_user": lambda db, c, i: db.import_user(c["export"], _scratch_user(db, i, "imported")),
+    "_replicate_user": lambda db, c, i: db._replicate_user(c["scratch"], "scratch", "scratch@example.com", "pw"),
+    "_set_user_shard": lambda db, c, i: db._set_user_shard(c["scratch"], 0),
+    "forget_blob": lambda db, c, i: db.forget_blob(f"{i:064x}"),
+    "set_note_blob": lambda db, c, i: db.set_note_blob(
+        c["user_id"], db.legacy_note_files(0, 1, c["user_id"])[0]["id"], {"sha256": f"{i:064x}", "size": 1}
+    ),
+    "create_upload": lambda db, c, i: db.create_upload(c["user_id"], f"上传{i}", c["course"], "f.bin", 100),
+    "add_upload_chunk": lambda db, c, i: db.add_upload_chunk(c["user_id"], c["upload_id"], i * 10, i * 10 + 10),
+    "complete_upload": lambda db, c, i: db.complete_upload(
+        c["user_id"],
+        db.create_upload(c["user_id"], f"完成上传{i}", c["course"], "f.bin", 1)["id"],
+        {"sha256": f"{i:064x}", "size": 1},
+    ),
+    "delete_upload": lambda db, c, i: db.delete_upload(
+        c["user_id"], db.create_upload(c["user_id"], f"待删上传{i}", c["course"], "f.bin", 1)["id"]
+    ),
+    "purge_uploads": lambda db, c, i: db.purge_uploads(0),
+    "delete_useful_link": lambda db, c, i: db.delete_useful_link(
+        c["user_id"], db.add_useful_link(c["user_id"], c["category_id"], f"待删链接{i}", "u")["id"]
+    ),
+    "delete_link_category": lambda db, c, i: db.delete_link_category(
+        c["user_id"], db.add_link_category(c["user_id"], f"待删分类{i}", "i")["id"]
+    ),
+    "delete_task": lambda db, c, i: db.delete_task(c["user_id"], db.add_task(c["user_id"], f"待删{i}", "")["id"]),
+    "delete_course_schedule": lambda db, c, i: db.delete_course_schedule(
+        c["user_id"], db.add_course_schedule(c["user_id"], f"待删课表{i}", "", "", 0, [])["id"]
+    ),
+    "delete_user": lambda db, c, i: db.delete_user(_scratch_user(db, i, "deleted")),
+}
+
+
+def required_methods():
+    """需要被 WORKLOAD 覆盖的方法：Database 上所有公开方法（NO_SQL_METHODS 除外）。"""
+    return {
+        name
+        for name, member in inspect.getmembers(Database, inspect.isfunction)
+        if not name.startswith("_") and name not in NO_SQL_METHODS
+    }
+
+
+def run_workload(db: Database, recorder: PlanRecorder, ctx: dict, repeat: int):
+    """每个方法调用 repeat 次；调用期间 recorder.label 为方法名。"""
+    recorder.label = None
+    ctx["scratch"] = _scratch_user(db, 0, "scratch")
+    ctx["task_id"] = db.add_task(ctx["user_id"], "更新用", "")["id"]
+    ctx["export"] = list(db.export_user(ctx["small_user"]))
+    ctx["upload_id"] = db.create_upload(ctx["user_id"], "续传用", ctx["course"], "f.bin", 100)["id"]
+    for name, call in WORKLOAD.items():
+        for i in range(repeat):
+            recorder.label = name
+            call(db, ctx, i)
+    recorder.label = None
+
+
+def explain(conn, sql, parameters):
+    # 直接调用 sqlite3.Connection.execute，EXPLAIN 本身不计入统计
+    rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters or ()).fetchall()
+    return [row[-1] for row in rows]
+
+
+def scanned_tables(plan):
+    """执行计划中被全表（或整个索引）扫描的表/别名；虚拟表（FTS5、json_each）和多行 VALUES 的常量行不算。"""
+    tables = []
+    for line in plan:
+        match = _SCAN.match(line)
+        if match and "VIRTUAL TABLE" not in line and "CONSTANT ROW" not in line:
+            tables.append(match.group(1))
+    return tables
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def analyze(db: Database, recorder: PlanRecorder):
+    """
+    对记录到的每条语句做 EXPLAIN QUERY PLAN，返回 (statements, problems)。
+    statements 按 p99 降序：[{"sql", "methods", "count", "p50_ms", "p99_ms", "plan"}]；
+    problems 为未允许的全表扫描、缺失的预期索引、未被覆盖的方法。
+    """
+    conn = db.get_db_connection()
+    statements, problems = [], []
+    used_indexes = {}
+    for key, entry in recorder.recorded.items():
+        if not entry["ms"]:
+            continue
+        plan = []
+        # 只以空参数列表执行过的 executemany 语句没有可用的参数，不做 EXPLAIN
+        if key.upper().startswith(_EXPLAINABLE) and (entry["parameters"] is not None or "?" not in key):
+            plan = explain(conn, entry["sql"], entry["parameters"])
+        for method in entry["methods"]:
+            used_indexes.setdefault(method, set()).update(
+                index for line in plan for index in re.findall(r"INDEX (\w+)", line)
+            )
+        for table in scanned_tables(plan):
+            if not any(fragment in key and table == name for fragment, name in ALLOWED_SCANS):
+                problems.append(f"SCAN {table}: {key}  (from {', '.join(sorted(entry['methods']))})")
+        statements.append(
+            {
+                "sql": key,
+                "methods": sorted(entry["methods"]),
+                "count": len(entry["ms"]),
+                "p50_ms": round(_percentile(entry["ms"], 0.5), 3),
+                "p99_ms": round(_percentile(entry["ms"], 0.99), 3),
+                "plan": plan,
+            }
+        )
+    for method, indexes in EXPECTED_INDEXES.items():
+        missing = indexes - used_indexes.get(method, set())
+        if missing:
+            problems.append(f"{method} no longer uses {', '.join(sorted(missing))}")
+    for method in sorted(required_methods() - set(WORKLOAD)):
+        problems.append(f"{method} is not covered by WORKLOAD")
+    statements.sort(key=lambda s: s["p99_ms"], reverse=True)
+    return statements, problems
+
+
+def run(users, per_user, repeat, workdir):
+    """在 workdir 中建库、生成数据并执行全部方法，返回 analyze 的结果。"""
+    recorder = PlanRecorder()
+    db = Database(str(Path(workdir) / "plans.db"), write_mode="direct", metrics=recorder)
+    # 建课程、笔记时创建的上传目录也放在临时目录中
+    storebase_dir = database_module.STOREBASE_DIR
+    database_module.STOREBASE_DIR = str(Path(workdir) / "uploads")
+    try:
+        ctx = seed(db, users, per_user)
+        run_workload(db, recorder, ctx, repeat)
+        return analyze(db, recorder)
+    finally:
+        database_module.STOREBASE_DIR = storebase_dir
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        statements, problems = run(args.users, args.per_user, args.repeat, tmp)
+    print(f"{'p50 ms':>8}{'p99 ms':>9}{'count':>7}  statement")
+    for s in statements:
+        print(f"{s['p50_ms']:>8.3f}{s['p99_ms']:>9.3f}{s['count']:>7}  {s['sql'][:100]}")
+        print(f"{'':>26}methods: {', '.join(s['methods'])}")
+        for line in s["plan"]:
+            print(f"{'':>26}{line}")
+    print()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print(f"{len(statements)} statements, {len(problems)} problems")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
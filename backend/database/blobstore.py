@@ -0,0 +1,356 @@
+"""
+笔记文件的内容寻址存储。
+文件按 SHA-256 摘要存放在 ab/cd/<摘要> 下，相同内容只存一份，笔记按摘要引用，改名不动磁盘；
+引用计数在数据库的 blobs 表中。命令行 gc 回收无人引用的文件和过期的上传，
+migrate 把旧的 <用户>/<课程>/<笔记>/ 目录迁入存储。
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from .database import STOREBASE_DIR, QuotaExceeded
+
+# 内容寻址存储的根目录，默认在上传目录下的 blobs/
+BLOB_DIR = os.getenv("blob_dir", "")
+# 未被引用的文件至少保留这么久（秒）才会被回收，覆盖"文件已写入、笔记尚未提交"的窗口
+BLOB_GC_GRACE_S = float(os.getenv("blob_gc_grace_s", "3600"))
+# 可续传上传超过这么久（秒）没有收到分块即视为放弃，会话和临时文件被回收
+UPLOAD_SESSION_TTL_S = float(os.getenv("upload_session_ttl_s", "86400"))
+# 每个用户引用的文件总大小上限（字节），0 表示不限制
+USER_QUOTA_BYTES = int(os.getenv("user_quota_bytes", "0"))
+CHUNK_SIZE = 1024 * 1024
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def is_digest(value):
+    return isinstance(value, str) and _DIGEST.match(value) is not None
+
+
+def default_blob_dir():
+    return Path(BLOB_DIR) if BLOB_DIR else Path(STOREBASE_DIR).resolve() / "blobs"
+
+
+class BlobStore:
+    """
+    按 SHA-256 存放文件：root/ab/cd/abcd…。
+    写入先落到 root/tmp/ 下的临时文件，边写边算摘要，完成后原子地改名到最终位置；
+    同样内容的文件已存在时丢弃临时文件，只更新已有文件的修改时间（回收时据此判断是否刚被使用）。
+    引用计数保存在数据库的 blobs 表中，由 notes 表上的触发器维护。
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else default_blob_dir()
+        self.tmp_dir = self.root / "tmp"
+        # 可续传上传的临时文件 uploads/<会话 id>，各分块按偏移直接写入
+        self.uploads_dir = self.root / "uploads"
+        # 回收时先把文件改名到 gc/<摘要>，确认仍无人引用后再删除
+        self.gc_dir = self.root / "gc"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest):
+        if not is_digest(digest):
+            raise ValueError(f"不是合法的 SHA-256 摘要: {digest!r}")
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def exists(self, digest):
+        return is_digest(digest) and self.path(digest).is_file()
+
+    def put_stream(self, stream, expected=None, limit=None):
+        """
+        把可读的二进制流按 CHUNK_SIZE 分块写入存储，返回 {"sha256", "size"}，内存占用与文件大小无关。
+        给出 expected 时校验摘要，不一致则丢弃并抛出 ValueError；
+        给出 limit 时读到的字节数一旦超过 limit 就停止读取、丢弃临时文件并抛出 QuotaExceeded。
+        """
+        digest = hashlib.sha256()
+        size = 0
+        # 上传目录可能被整体清理过，临时目录随用随建
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if limit is not None and size > limit:
+                        raise QuotaExceeded(limit)
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            sha256 = digest.hexdigest()
+            if expected is not None and sha256 != expected:
+                raise ValueError(f"内容摘要不符: 期望 {expected}，实际 {sha256}")
+            self._commit(tmp_name, sha256)
+        finally:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+        return {"sha256": sha256, "size": size}
+
+    def put_file(self, path):
+        """把本地文件复制进存储，返回 {"sha256", "size"}。"""
+        with open(path, "rb") as f:
+            return self.put_stream(f)
+
+    def _commit(self, tmp_name, sha256):
+        target = self.path(sha256)
+        if target.exists():
+            # 已有同样内容：刷新修改时间，避免被正在进行的回收删除
+            try:
+                os.utime(target)
+                return
+            except FileNotFoundError:
+                # 回收恰好在检查之后把文件移走了：照常放入新文件
+                pass
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_name, target)
+
+    def upload_path(self, upload_id):
+        if not (isinstance(upload_id, str) and _UPLOAD_ID.match(upload_id)):
+            raise ValueError(f"不是合法的上传会话 id: {upload_id!r}")
+        return self.uploads_dir / upload_id
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        """
+        从 stream 读取 length 字节，用 os.pwrite 写到上传临时文件的 offset 处，返回实际写入的字节数
+        （连接中断时小于 length）。各分块写入互不重叠的位置，可以并发执行。
+        """
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.upload_path(upload_id), os.O_WRONLY | os.O_CREAT, 0o644)
+        written = 0
+        try:
+            while written < length:
+                chunk = stream.read(min(CHUNK_SIZE, length - written))
+                if not chunk:
+                    break
+                view = memoryview(chunk)
+                while view:
+                    n = os.pwrite(fd, view, offset + written)
+                    view = view[n:]
+                    written += n
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return written
+
+    def hash_upload(self, upload_id, size, expected=None):
+        """
+        全部分块写完后计算临时文件的摘要，返回 {"sha256", "size"}，临时文件保持不动。
+        临时文件不存在（已被完成或取消）时抛出 FileNotFoundError；
+        长度或摘要不符时删除临时文件并抛出 ValueError。
+        """
+        path = self.upload_path(upload_id)
+        if size == 0:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        try:
+            if path.stat().st_size != size:
+                raise ValueError(f"文件长度不符: 期望 {size}，实际 {path.stat().st_size}")
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+            if expected is not None and sha256 != expected:
+                raise ValueError(f"内容摘要不符: 期望 {expected}，实际 {sha256}")
+        except ValueError:
+            path.unlink(missing_ok=True)
+            raise
+        return {"sha256": sha256, "size": size}
+
+    def commit_upload(self, upload_id, blob):
+        """把 hash_upload 校验过的临时文件改名进存储（不再复制一次）。"""
+        path = self.upload_path(upload_id)
+        try:
+            self._commit(str(path), blob["sha256"])
+        finally:
+            path.unlink(missing_ok=True)
+
+    def discard_upload(self, upload_id):
+        self.upload_path(upload_id).unlink(missing_ok=True)
+
+    def collect_uploads(self, db, ttl_s=None, now=None):
+        """
+        回收超过 ttl_s 秒没有收到分块的上传会话及其临时文件，返回 {"removed"}。
+        会话已不存在（例如用户被删除）的临时文件按修改时间回收。
+        """
+        ttl_s = UPLOAD_SESSION_TTL_S if ttl_s is None else ttl_s
+        now = time.time() if now is None else now
+        expired = db.purge_uploads(now - ttl_s)
+        for upload_id in expired:
+            self.discard_upload(upload_id)
+        removed = len(expired)
+        if self.uploads_dir.is_dir():
+            for path in self.uploads_dir.iterdir():
+                try:
+                    if now - path.stat().st_mtime >= ttl_s:
+                        path.unlink()
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return {"removed": removed}
+
+    def open(self, digest):
+        return open(self.path(digest), "rb")
+
+    def delete(self, digest):
+        self.path(digest).unlink(missing_ok=True)
+
+    def iter_digests(self):
+        """遍历存储中的全部摘要。"""
+        for first in sorted(self.root.glob("[0-9a-f][0-9a-f]")):
+            for second in sorted(first.glob("[0-9a-f][0-9a-f]")):
+                for path in sorted(second.iterdir()):
+                    if is_digest(path.name):
+                        yield path.name
+
+    def _age(self, digest):
+        try:
+            return time.time() - self.path(digest).stat().st_mtime
+        except FileNotFoundError:
+            return float("inf")
+
+    def collect_garbage(self, db, grace_s=None, batch_size=500):
+        """
+        删除不再被引用的文件，返回 {"removed", "bytes", "seconds"}。
+        - blobs 表中引用计数为 0 的摘要
+        - 存储中存在、但数据库从未记录的文件（例如上传后笔记写入失败）
+        两类都只回收修改时间早于 grace_s 秒之前的文件。
+        """
+        grace_s = BLOB_GC_GRACE_S if grace_s is None else grace_s
+        start = time.perf_counter()
+        removed = 0
+        freed = 0
+
+        def remove(digest):
+            # 判断可以删除之后，同样内容可能又被上传（put_stream 只刷新已有文件的修改时间）并被新笔记引用。
+            # 先把文件移出存储，再确认修改时间和数据库记录；仍在使用就放回原处，否则才删除。
+            nonlocal removed, freed
+            path = self.path(digest)
+            grave = self.gc_dir / digest
+            try:
+                os.replace(path, grave)
+            except FileNotFoundError:
+                return
+            stat = grave.stat()
+            if time.time() - stat.st_mtime < grace_s or db.known_blobs([digest]):
+                os.replace(grave, path)
+                return
+            grave.unlink()
+            freed += stat.st_size
+            removed += 1
+
+        # 上次回收中断时留在 gc/ 中的文件先放回原处，由下面的流程重新判断
+        self.gc_dir.mkdir(parents=True, exist_ok=True)
+        for grave in self.gc_dir.iterdir():
+            if is_digest(grave.name):
+                target = self.path(grave.name)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(grave, target)
+
+        for digest in db.unreferenced_blobs(batch_size):
+            if self._age(digest) >= grace_s and db.forget_blob(digest):
+                remove(digest)
+
+        batch = []
+        for digest in self.iter_digests():
+            if self._age(digest) >= grace_s:
+                batch.append(digest)
+            if len(batch) >= batch_size:
+                for unknown in set(batch) - db.known_blobs(batch):
+                    remove(unknown)
+                batch = []
+        if batch:
+            for unknown in set(batch) - db.known_blobs(batch):
+                remove(unknown)
+
+        # 清理中断的写入留下的临时文件
+        for tmp in self.tmp_dir.iterdir():
+            try:
+                if time.time() - tmp.stat().st_mtime >= grace_s:
+                    tmp.unlink()
+            except FileNotFoundError:
+                pass
+        return {"removed": removed, "bytes": freed, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def migrate_legacy_files(db, store, files_root=None, batch_size=500, user_id=None):
+    """
+    把旧布局 files_root/<用户>/<课程>/<笔记>/<文件> 中的文件移入内容寻址存储，并让笔记按摘要引用它们。
+    可以重复执行：已迁移的笔记不会再被处理；找不到文件的笔记保持原样，计入 missing。
+    全部笔记处理完后再删除旧文件和空目录（同名笔记可能共用同一个目录）。
+    给出 user_id 时只迁移该用户。返回 {"migrated", "missing", "bytes"}。
+    """
+    files_root = Path(files_root if files_root is not None else STOREBASE_DIR).resolve()
+    if user_id is not None and hasattr(db, "shard_for"):
+        parts = [db.shard_for(user_id)]
+    else:
+        # 分片模式下笔记 id 各分片独立，逐个分片按 id 翻页
+        parts = getattr(db, "shards", None) or [db]
+    migrated = missing = size = 0
+    moved = set()
+    for part in parts:
+        after = 0
+        while True:
+            rows = part.legacy_note_files(after, batch_size, user_id)
+            if not rows:
+                break
+            for row in rows:
+                after = row["id"]
+                path = files_root / str(row["user_id"]) / str(row["course"]) / str(row["name"]) / str(row["file"])
+                # 名称中含 .. 等时路径可能越出用户目录，不处理
+                if not path.resolve().is_relative_to(files_root / str(row["user_id"])) or not path.is_file():
+                    missing += 1
+                    continue
+                blob = store.put_file(path)
+                if part.set_note_blob(row["user_id"], row["id"], blob):
+                    migrated += 1
+                    size += blob["size"]
+                    moved.add(path)
+
+    for path in moved:
+        path.unlink(missing_ok=True)
+        # 自下而上删除变空的 笔记/课程/用户 目录
+        for directory in list(path.parents)[:3]:
+            try:
+                directory.rmdir()
+            except OSError:
+                break
+    return {"migrated": migrated, "missing": missing, "bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    gc_cmd = commands.add_parser("gc", help="回收不再被引用的文件")
+    gc_cmd.add_argument("--grace", type=float, default=None)
+    gc_cmd.add_argument("--upload-ttl", type=float, default=None)
+    gc_cmd.add_argument("--dir", default=None)
+    migrate_cmd = commands.add_parser("migrate", help="把旧的 用户/课程/笔记 目录迁移到内容寻址存储")
+    migrate_cmd.add_argument("--files-root", default=None)
+    migrate_cmd.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    from .storage import db
+
+    if args.command == "gc":
+        store = BlobStore(args.dir)
+        uploads = store.collect_uploads(db, args.upload_ttl)
+        print(f"removed {uploads['removed']} abandoned uploads")
+        result = store.collect_garbage(db, args.grace)
+        print(f"removed {result['removed']} blobs ({result['bytes']} bytes) in {result['seconds']}s")
+    elif args.command == "migrate":
+        result = migrate_legacy_files(db, BlobStore(args.dir), args.files_root)
+        print(f"migrated {result['migrated']} files ({result['bytes']} bytes), {result['missing']} missing")
+
+
+if __name__ == "__main__":
+    main()
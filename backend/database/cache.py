@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionedLRUCache:
+    """
+    以 (user_id, revision) 为键的进程内 LRU 缓存。
+    revision 由数据库触发器在每次修改用户数据时加一，因此版本号变化即意味着
+    旧条目失效；同一用户只保留最新版本的一条记录。
+    恢复备份或重建数据库后版本号会重复，调用方应把数据库实例标识（get_epoch）一并放进 revision，例如用 ETag。
+    条目数超过 max_entries 时淘汰最久未使用的条目，超过 ttl 秒的条目视为过期。
+    """
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()  # (user_id, revision) -> (expires_at, value)
+        self._latest = {}  # user_id -> 当前缓存的 revision
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, user_id, revision):
+        key = (str(user_id), revision)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                self._remove(key)
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, user_id, revision, value):
+        user_key = str(user_id)
+        key = (user_key, revision)
+        with self._lock:
+            # 同一用户的旧版本不会再被命中，直接移除
+            previous = self._latest.get(user_key)
+            if previous is not None and previous != revision:
+                self._remove((user_key, previous))
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._latest[user_key] = revision
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def get_or_build(self, user_id, revision, builder):
+        """
+        命中则直接返回缓存值；否则调用 builder() 生成并缓存。
+        builder 返回 None（例如用户不存在）时不缓存。
+        """
+        value = self.get(user_id, revision)
+        if value is None:
+            value = builder()
+            if value is not None:
+                self.put(user_id, revision, value)
+        return value
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        if self._latest.get(key[0]) == key[1]:
+            del self._latest[key[0]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+
+    def stats(self):
+        """命中/未命中/淘汰/过期计数以及当前条目数。"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._entries)
+            snapshot["max_entries"] = self.max_entries
+        return snapshot
@@ -27,12 +27,13 @@ def setup_test_environment():
     
     yield
     
-    # 清理
-    if TEST_DB_PATH.exists():
-        try:
-            TEST_DB_PATH.unlink()
-        except:
-            pass
+    # 清理（包括 WAL 模式下的 -wal/-shm 文件）
+    for path in (TEST_DB_PATH, Path(f"{TEST_DB_PATH}-wal"), Path(f"{TEST_DB_PATH}-shm")):
+        if path.exists():
+            try:
+                path.unlink()
+            except:
+                pass
     
     # 恢复环境变量
     if original_dbfile:
@@ -51,8 +52,9 @@ def mock_db():
     # 导入必须在设置环境变量之后
     from database import Database
     
-    # 创建数据库实例
-    db = Database()
+    # 创建数据库实例；显式传入路径：与 backend/tests 一起运行时，
+    # database 模块可能已按 tests 的 dbfile 导入，默认路径会指向应用测试的库
+    db = Database(str(TEST_DB_PATH))
     
     # 清除可能存在的旧数据
     conn = db.get_db_connection()
@@ -60,7 +62,7 @@ def mock_db():
     
     # 清空所有表（保持表结构）
     tables = ['users', 'courses', 'notes', 'link_categories', 
-              'useful_links', 'tasks', 'course_schedules', 'course_schedule_times']
+              'useful_links', 'tasks', 'course_schedules']
     for table in tables:
         try:
             cursor.execute(f"DELETE FROM {table}")
@@ -71,9 +73,9 @@ def mock_db():
     
     yield db
     
-    # 测试后关闭连接
+    # 测试后关闭连接池
     try:
-        db.close_connection()
+        db.close()
     except:
         pass
 
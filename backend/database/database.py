@@ -1,10 +1,29 @@
+import base64
+import functools
 import json
 import os
 import sqlite3
 import threading
+import time
 from pathlib import Path
 from typing import Optional
 
+from .deadlines import deadline_columns
+from .metrics import QueryMetrics
+from .slots import (
+    FULL_MASK,
+    busy_counts,
+    join_mask,
+    mask_to_slots,
+    pack_slots,
+    unpack_slots,
+    week_masks,
+)
+from .migrations import SEARCH_SOURCES, latest_version, migrate, schema_version
+from .pool import close_pool, get_pool
+from .transfer import EXPORT_COLUMNS, EXPORT_FORMAT, EXPORT_VERSION, PARENT_COLUMNS, REQUIRED_COLUMNS
+from .writer import WriteQueue
+
 # --- 配置 ---
 try:
     import dotenv  # type: ignore
@@ -16,19 +35,301 @@ except Exception:
 
 DB_FILE = os.getenv("dbfile", "./database/database.db")
 STOREBASE_DIR = os.getenv("storage_dir", "./uploads/")
+# 连接池配置
+POOL_SIZE = int(os.getenv("db_pool_size", "8"))
+POOL_TIMEOUT = float(os.getenv("db_pool_timeout", "10"))
+BUSY_TIMEOUT_MS = int(os.getenv("db_busy_timeout_ms", "5000"))
+CACHE_SIZE_KIB = int(os.getenv("db_cache_size_kib", "8192"))
+MMAP_SIZE = int(os.getenv("db_mmap_size", str(64 * 1024 * 1024)))
+# 写入模式：direct（默认，各线程直接写）或 queue（单写线程 + 只读连接池）
+WRITE_MODE = os.getenv("db_write_mode", "direct")
+WRITE_BATCH_SIZE = int(os.getenv("db_write_batch_size", "64"))
+WRITE_BATCH_MS = float(os.getenv("db_write_batch_ms", "2"))
+# 查询统计（默认关闭）：每条语句的耗时直方图、行数，超过阈值的慢查询打印执行计划
+INSTRUMENT = os.getenv("db_instrument", "0").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("db_slow_query_ms", "100"))
 
 
-class Database:
+# 索引 rowid 中的编号 -> kind
+SEARCH_KINDS = {code: kind for kind, (code, *_rest) in SEARCH_SOURCES.items()}
+# trigram 分词只能匹配不少于 3 个字符的词，更短的词退化为 LIKE 过滤
+SEARCH_MIN_TERM = 3
+
+
+def _search_owner(user_id):
+    # 用户归属也作为一列写入索引，这样按用户过滤走倒排索引而不是逐行比较；
+    # 两侧加 # 保证 "#1#" 不会是 "#12#" 的子串
+    return f"#{int(user_id)}#"
+
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _with_connection(method):
+    """
+    方法执行期间从连接池取出一个连接并绑定到当前线程，结束后归还。
+    如果当前线程已经持有连接（嵌套调用或显式 get_db_connection），则直接复用。
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self._local, "connection", None) is not None:
+            return method(self, *args, **kwargs)
+        self._local.connection = self._pool.acquire()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            conn = self._local.connection
+            self._local.connection = None
+            self._pool.release(conn)
+
+    return wrapper
+
+
+def _writes(method):
+    """
+    写操作。queue 模式下整个方法被投递到写线程执行，
+    与其他排队的写操作合并提交；direct 模式下等同于 _with_connection。
+    """
+    method = _with_connection(method)
 
-    _local = threading.local()
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._writer is None:
+            return method(self, *args, **kwargs)
+        return self._writer.submit(method, self, *args, **kwargs)
 
-    def __init__(self, db_path: Optional[str] = None):
+    return wrapper
+
+
+# 多行 INSERT / IN (...) 每批的行数，避免超过 SQLite 的参数个数上限
+BULK_CHUNK_SIZE = 200
+
+
+class QuotaExceeded(ValueError):
+    """写入的内容超过了允许的大小。used 为写入前用户已用的字节数（已知时）。"""
+
+    def __init__(self, limit, used=None):
+        super().__init__(f"文件大小超过剩余配额 {limit} 字节")
+        self.limit = limit
+        self.used = used
+
+
+class _AbortWrite(Exception):
+    """
+    在 `with conn:` 中抛出以放弃当前写操作。
+    queue 模式下只回滚本操作的 SAVEPOINT；直接调用 conn.rollback() 会回滚整批合并提交的写入。
+    """
+
+
+def _storage_usage(cursor, user_id):
+    """用户笔记引用的文件总大小（字节），同一文件只计一次。"""
+    return cursor.execute(
+        """
+        SELECT COALESCE(SUM(size), 0) AS used FROM blobs
+        WHERE sha256 IN (SELECT blob_sha256 FROM notes WHERE user_id = ? AND blob_sha256 IS NOT NULL)
+    """,
+        (user_id,),
+    ).fetchone()["used"]
+
+
+def _check_quota(cursor, user_id, quota, used):
+    """
+    在写入笔记的事务中、插入之后调用：用量超过 quota 时抛出 QuotaExceeded，由 `with conn:` 回滚本次写入。
+    并发的上传各自只在开始前看到同样的剩余配额，只有这里能保证合计不超出。
+    """
+    if quota and _storage_usage(cursor, user_id) > quota:
+        raise QuotaExceeded(max(0, quota - used), used)
+
+
+def _chunks(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _record_blob_sizes(cursor, blobs):
+    """笔记插入后，blobs 行由触发器创建；这里补上文件大小（blobs 中为 None 的项跳过）。"""
+    cursor.executemany(
+        "UPDATE blobs SET size = ? WHERE sha256 = ? AND size IS NULL",
+        [(blob["size"], blob["sha256"]) for blob in blobs if blob],
+    )
+
+
+def _insert_returning(cursor, table, columns, rows):
+    """
+    多行 INSERT ... RETURNING *，返回新插入的行（字典）。
+    同一条语句内 rowid 按 VALUES 顺序递增分配，按 id 排序即与 rows 顺序一致。
+    """
+    created = []
+    row_placeholder = "(" + ", ".join("?" * len(columns)) + ")"
+    for chunk in _chunks(rows):
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ", ".join([row_placeholder] * len(chunk))
+            + " RETURNING *",
+            [value for row in chunk for value in row],
+        )
+        created += sorted((dict(row) for row in cursor.fetchall()), key=lambda r: r["id"])
+    return created
+
+
+def _as_text(value):
+    """按 SQLite TEXT 亲和性把值转换成数据库中实际存储的形式，用于比较。"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+def _as_int(value):
+    """按 SQLite INTEGER 亲和性转换，无法转换时原样返回。"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _reconcile(existing, incoming, key):
+    """
+    按自然键对齐现有行与新行。
+    返回 (matched, to_insert, to_delete)：matched 为 [(现有行, 新行)]，
+    同一自然键出现多次时按出现顺序一一对应。
+    """
+    buckets = {}
+    for row in existing:
+        buckets.setdefault(key(row), []).append(row)
+    matched, to_insert = [], []
+    for row in incoming:
+        candidates = buckets.get(key(row))
+        if candidates:
+            matched.append((candidates.pop(0), row))
+        else:
+            to_insert.append(row)
+    to_delete = [row for rows in buckets.values() for row in rows]
+    return matched, to_insert, to_delete
+
+
+def _encode_cursor(key):
+    """把排序键编码成不透明的分页游标（URL 安全的 base64）。"""
+    raw = json.dumps(key, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token, size):
+    """解析分页游标，格式不对时抛出 ValueError。"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("cursor 参数非法") from e
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError("cursor 参数非法")
+    return key
+
+
+def _keyset_rows(cursor, select, params, order_by, limit, after_key=None):
+    """
+    键集分页：按 order_by 各列排序（最后一列必须唯一，一般是 id），
+    从排序键 after_key 之后取 limit 行。
+    select 为带 WHERE 的查询（不含 ORDER BY），结果里须包含 order_by 中的各列。
+    翻到第 N 页和第 1 页一样只需在复合索引上定位一次，插入新行也不会导致重复或遗漏。
+    返回 (rows, next_key)，没有下一页时 next_key 为 None。
+    """
+    columns = ", ".join(order_by)
+    if after_key is not None:
+        select += f" AND ({columns}) > ({', '.join('?' * len(order_by))})"
+        params = (*params, *after_key)
+    cursor.execute(f"{select} ORDER BY {columns} LIMIT ?", (*params, limit + 1))
+    rows = cursor.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, [last[column.split(".")[-1]] for column in order_by]
+
+
+def _keyset_page(cursor, select, params, order_by, limit, after=None):
+    """同 _keyset_rows，但游标是 _encode_cursor 编码后的字符串。返回 (rows, next_cursor)。"""
+    key = _decode_cursor(after, len(order_by)) if after is not None else None
+    rows, next_key = _keyset_rows(cursor, select, params, order_by, limit, key)
+    return rows, _encode_cursor(next_key) if next_key is not None else None
+
+
+def _schedule_item(row):
+    """course_schedules 行 -> 与前端 Course 类一致的结构。"""
+    return {
+        "id": row['id'],
+        "name": row['name'],
+        "teacher": row['teacher'] or "",
+        "location": row['location'] or "",
+        "weekType": row['week_type'],
+        "times": unpack_slots(row['slots_lo'], row['slots_hi']),
+    }
+
+
+def _import_row(table, record, id_maps, now):
+    """导出记录 -> (原 id, 要插入的列字典)；缺少必填列或引用了未导入的父记录时抛出 ValueError。"""
+    row = {column: record.get(column) for column in EXPORT_COLUMNS[table]}
+    missing = [column for column in REQUIRED_COLUMNS[table] if row[column] is None]
+    if missing:
+        raise ValueError(f"{table} 记录缺少字段: {', '.join(missing)}")
+    for column, parent in PARENT_COLUMNS.items():
+        if column in row:
+            try:
+                row[column] = id_maps[parent][row[column]]
+            except KeyError:
+                raise ValueError(f"{table} 记录引用了不存在的 {parent} id: {row[column]}") from None
+    if "created_at" in row and row["created_at"] is None:
+        row["created_at"] = now
+    if table == "tasks":
+        row["deadline"], row["deadline_at"], row["has_deadline"] = deadline_columns(row["deadline"])
+    elif table == "course_schedules":
+        row["slots_lo"], row["slots_hi"] = pack_slots(record.get("times") or [])
+    return record.get("id"), row
+
+
+def _task_item(row):
+    return {
+        "id": row['id'],
+        "name": row['name'],
+        "deadline": row['deadline'],
+        "deadlineAt": row['deadline_at'],
+        "message": row['message'] or "",
+        "status": row['status'],
+    }
+
+
+class Database:
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+        cache_size_kib: Optional[int] = None,
+        mmap_size: Optional[int] = None,
+        write_mode: Optional[str] = None,
+        instrument: Optional[bool] = None,
+        slow_query_ms: Optional[float] = None,
+        metrics: Optional[QueryMetrics] = None,
+    ):
         """
         初始化数据库对象。
         db_path 优先级：
         1) 传入的 db_path 参数（若提供）
         2) 环境变量 dbfile（dotenv 支持）
         3) 默认 ./database/database.db
+        write_mode 为 "queue" 时，所有写操作经由单独的写线程分批提交，
+        读操作使用只读连接池；默认 "direct"（环境变量 db_write_mode）。
+        instrument 为 True 时记录每条语句的耗时与行数（环境变量 db_instrument），
+        超过 slow_query_ms 毫秒的语句会连同执行计划一起打印；
+        传入 metrics 时直接使用该统计对象（分片模式下多个实例共用一份统计）。
         """
         # 选择数据库路径
         effective_path = db_path if db_path else DB_FILE
@@ -40,227 +341,180 @@ class Database:
         except Exception:
             # 目录创建失败时忽略，让后续连接抛出更明确的异常
             pass
-        self.setup_database()
+        # 每个实例单独的线程局部存储，不同 db_path 的实例不会共用连接
+        self._local = threading.local()
+        pool_options = dict(
+            busy_timeout_ms=BUSY_TIMEOUT_MS,
+            cache_size_kib=cache_size_kib or CACHE_SIZE_KIB,
+            mmap_size=MMAP_SIZE if mmap_size is None else mmap_size,
+        )
+        if metrics is not None:
+            pool_options["metrics"] = metrics
+        elif INSTRUMENT if instrument is None else instrument:
+            pool_options["metrics"] = QueryMetrics(
+                SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms
+            )
+        self.write_mode = write_mode or WRITE_MODE
+        self._writer = None
+        if self.write_mode == "queue":
+            # 写线程独占一个读写连接；建表也经由写线程完成
+            self._writer = WriteQueue(
+                self.db_path,
+                bind=self._bind_connection,
+                batch_size=WRITE_BATCH_SIZE,
+                batch_ms=WRITE_BATCH_MS,
+                **pool_options,
+            )
+            self.setup_database()
+        elif self.write_mode != "direct":
+            raise ValueError(f"未知的写入模式: {self.write_mode}")
+        # 同一数据库文件的所有实例共用一个连接池（queue 模式下为只读池）
+        self._pool = get_pool(
+            self.db_path,
+            readonly=self._writer is not None,
+            max_size=pool_size or POOL_SIZE,
+            timeout=pool_timeout or POOL_TIMEOUT,
+            **pool_options,
+        )
+        if self._writer is None:
+            self.setup_database()
+
+    def _bind_connection(self, conn):
+        """将连接绑定到当前线程（写线程启动/退出时使用）。"""
+        self._local.connection = conn
 
     def get_db_connection(self):
         """
         获取当前线程的数据库连接。
-        如果当前线程还没有连接，则创建一个新的并存储起来。
+        如果当前线程还没有连接，则从连接池取出一个并绑定到当前线程，
+        直到调用 close_connection 归还。
         """
         # 检查当前线程是否已经有连接
-        if not hasattr(self._local, "connection"):
-            # 使用实例的 db_path 创建连接
-            self._local.connection = sqlite3.connect(self.db_path)
-            # 设置行工厂，方便通过列名访问数据
-            self._local.connection.row_factory = sqlite3.Row
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = self._pool.acquire()
         return self._local.connection
 
     def close_connection(self):
-        """关闭当前线程的数据库连接。"""
-        if hasattr(self._local, "connection"):
-            self._local.connection.close()
-            del self._local.connection
-
+        """将当前线程持有的数据库连接归还给连接池。"""
+        conn = getattr(self._local, "connection", None)
+        if conn is not None:
+            self._local.connection = None
+            self._pool.release(conn)
+
+    def pool_stats(self):
+        """连接池统计：checkouts、waits、busy_retries 等。"""
+        return self._pool.stats()
+
+    @property
+    def metrics(self):
+        """查询统计对象（QueryMetrics）；未开启统计时为 None。"""
+        return self._pool.metrics
+
+    def query_stats(self):
+        """各语句的执行次数、耗时直方图、行数以及最近的慢查询；未开启统计时返回 None。"""
+        return self.metrics.snapshot() if self.metrics else None
+
+    def write_stats(self):
+        """queue 模式下写队列的统计信息；direct 模式返回 None。"""
+        return self._writer.stats() if self._writer else None
+
+    @property
+    def db_paths(self):
+        """实例使用的全部数据库文件（与分片模式的 ShardedDatabase 接口一致）。"""
+        return [self.db_path]
+
+    def close(self):
+        """停止写线程并释放连接池；同一路径的其他实例仍在使用时连接池保持打开。"""
+        self.close_connection()
+        if self._writer is not None:
+            self._writer.close()
+        # 重复调用 close 不会多释放一次
+        if not getattr(self, "_pool_released", False):
+            self._pool_released = True
+            close_pool(self.db_path, readonly=self._writer is not None)
+
+    @_writes
     def setup_database(self):
         """
-        初始化数据库，创建所有表。
-        如果表已存在，则什么也不做。
+        初始化数据库：按顺序应用 migrations.py 中尚未执行的迁移。
+        已是最新版本的数据库只需一次查询（读取 schema_version）。
         """
         conn = self.get_db_connection()
-        cursor = conn.cursor()
-
-        # 创建用户表
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL
-            )
-        """
-        )
-
-        # 创建课程表
-        # cursor.execute('''
-        # CREATE TABLE IF NOT EXISTS courses (
-        #    id INTEGER PRIMARY KEY AUTOINCREMENT,
-        #    title TEXT NOT NULL
-        #    )
-        #''')
-
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS courses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                tags TEXT, -- 存储JSON格式的标签列表，例如: '["基础", "必修"]'
-                user_id INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        """
-        )
-        # 索引
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_courses_title ON courses(title)
-        """
-        )
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_courses_user_id ON courses(user_id)
-        """
-        )
-        cursor.execute(
-            """
-            CREATE UNIQUE INDEX IF NOT EXISTS ux_courses_user_title ON courses(user_id, title)
-        """
-        )
-
-        # 创建笔记表
-        # cursor.execute('''
-        #    CREATE TABLE IF NOT EXISTS notes (
-        #        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        #        content TEXT,
-        #        user_id INTEGER NOT NULL,
-        #        course_id INTEGER,
-        #        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
-        #        FOREIGN KEY (course_id) REFERENCES courses (id) ON DELETE SET NULL
-        #    )
-        #''')
-
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS notes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,      -- 对应 myNotes 中的 "name"
-                file TEXT,          -- 对应 myNotes 中的 "file"，允许为NULL
-                user_id INTEGER NOT NULL,
-                course_id INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
-                FOREIGN KEY (course_id) REFERENCES courses (id) ON DELETE CASCADE
-            )
-        """
-        )
+        if schema_version(conn) >= latest_version():
+            # 已是最新版本：只需这一次查询
+            return
+        applied = migrate(conn)
+        if applied:
+            print(f"数据库迁移完成，应用版本: {applied}")
 
-        # 创建链接分类表
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS link_categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                category TEXT NOT NULL,
-                icon TEXT NOT NULL,
-                user_id INTEGER NOT NULL,
-                sort_order INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
+    @_with_connection
+    def get_revision(self, user_id):
         """
-        )
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_link_categories_user_id ON link_categories(user_id)
+        获取用户当前的数据版本号（从未修改过则为 0）。
         """
-        )
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT revision FROM user_revisions WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        return row["revision"] if row else 0
 
-        # 创建链接表
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS useful_links (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                url TEXT NOT NULL,
-                description TEXT,
-                is_trusted BOOLEAN DEFAULT FALSE,
-                category_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                sort_order INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (category_id) REFERENCES link_categories (id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        """
-        )
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_useful_links_user_id ON useful_links(user_id)
+    @_with_connection
+    def get_epoch(self):
         """
-        )
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_useful_links_category_id ON useful_links(category_id)
+        获取数据库实例标识（建库时随机生成）。
         """
-        )
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM db_meta WHERE key = 'epoch'")
+        row = cursor.fetchone()
+        return row["value"] if row else ""
 
-        # 创建任务管理表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,           -- 对应 deadlines 列表中的 name
-                deadline TEXT NOT NULL,       -- 截止日期时间字符串
-                message TEXT,                 -- 对应 message，允许为空
-                status TEXT DEFAULT 'pending', -- 状态: pending, completed, overdue 等
-                user_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_tasks_user_id ON tasks(user_id)
+    @_with_connection
+    def search(self, user_id, query, limit=20, offset=0):
         """
-        )
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS ix_tasks_deadline ON tasks(deadline)
+        在用户的课程、笔记、任务和链接中全文检索。
+        query 按空白切分，所有词都要命中（标题或正文）；结果按 bm25 排序，标题权重更高。
+        返回 [{"kind", "id", "title", "snippet", "rank"}, ...]，命中部分用 <mark></mark> 标出。
         """
-        )
+        terms = query.split()
+        if not terms:
+            return []
+        match = [f"owner : {_fts_phrase(_search_owner(user_id))}"]
+        like_clauses, params = [], []
+        for term in terms:
+            if len(term) >= SEARCH_MIN_TERM:
+                match.append(f"{{title body}} : {_fts_phrase(term)}")
+            else:
+                like_clauses.append(" AND (title LIKE ? ESCAPE '\\' OR body LIKE ? ESCAPE '\\')")
+                params += [_like_pattern(term)] * 2
 
-        # 初始化一个默认管理员用户（如果不存在）
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
         cursor.execute(
-            "INSERT OR IGNORE INTO users (id, username, email, password) VALUES (1, 'admin', 'admin@example.com', 'adminpass')"
+            f"""
+            SELECT rowid,
+                   highlight(search_index, 1, '<mark>', '</mark>') AS title,
+                   snippet(search_index, 2, '<mark>', '</mark>', '…', 16) AS snippet,
+                   rank
+            FROM search_index
+            WHERE search_index MATCH ?{''.join(like_clauses)}
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+            """,
+            (" AND ".join(match), *params, limit, offset),
         )
-        # 创建课表表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS course_schedules (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,               -- 课程名称
-                teacher TEXT,                     -- 教师姓名
-                location TEXT,                    -- 上课地点
-                week_type INTEGER DEFAULT 0,      -- 周次类型：0-每周，1-单周，2-双周
-                user_id INTEGER NOT NULL,         -- 用户ID
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        """)
-
-        # 创建上课时间表（多对多关系，因为一门课可能有多个上课时间）
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS course_schedule_times (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                course_schedule_id INTEGER NOT NULL,  -- 课程表ID
-                time_index INTEGER NOT NULL,          -- 时间索引（0-83，对应一周的课程时间段）
-                FOREIGN KEY (course_schedule_id) REFERENCES course_schedules (id) ON DELETE CASCADE,
-                UNIQUE(course_schedule_id, time_index)  -- 确保同一门课同一时间不重复
-            )
-        """)
-
-        # 创建索引
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS ix_course_schedules_user_id ON course_schedules(user_id)
-        """)
-
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS ix_course_schedule_times_course_id ON course_schedule_times(course_schedule_id)
-        """)
-
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS ix_course_schedule_times_time_index ON course_schedule_times(time_index)
-        """)
-
-        conn.commit()
-        # 注意：这里不关闭连接，因为它被线程局部存储管理了
-
+        return [
+            {
+                "kind": SEARCH_KINDS[row["rowid"] % 4],
+                "id": row["rowid"] // 4,
+                "title": row["title"],
+                "snippet": row["snippet"],
+                "rank": row["rank"],
+            }
+            for row in cursor.fetchall()
+        ]
+
+    @_with_connection
     def get_user(self, user_id=1):
         """
         根据ID获取用户信息。
@@ -272,6 +526,7 @@ class Database:
         user = cursor.fetchone()
         return user
 
+    @_writes
     def add_course_to_user(self, user_id, course_title, tags=[]):
         """
         为指定用户添加一门新课程。
@@ -300,14 +555,6 @@ class Database:
                         (course_title, tags, user_id),
                     )
                     course_id = cursor.lastrowid
-                    # 为该课程创建存储目录
-                    try:
-                        course_storage_path = (
-                            Path(STOREBASE_DIR) / str(user_id) / str(course_title)
-                        )
-                        course_storage_path.mkdir(parents=True, exist_ok=True)
-                    except Exception as e:
-                        print(f"创建课程存储目录时出错: {e}")
 
                 # print(f"成功为用户 {user_id} 添加课程 '{course_title}' (课程ID: {course_id})")
                 # 查询并返回课程信息
@@ -318,6 +565,7 @@ class Database:
             print(f"数据库错误: {e}")
             return False
 
+    @_with_connection
     def get_user_with_courses_and_notes(self, user_id=1):
         """
         获取用户信息，以及该用户拥有的所有课程。
@@ -344,6 +592,20 @@ class Database:
 
         courses = cursor.fetchall()
 
+        # 一次性获取该用户的全部笔记，再在内存中按课程分组，避免逐课程查询（N+1）
+        cursor.execute(
+            """
+            SELECT n.id, n.name, n.file, n.course_id FROM notes n
+            WHERE n.user_id = ?
+            ORDER BY n.id
+        """,
+            (user_id,),
+        )
+        notes_by_course = {}
+        for n in cursor.fetchall():
+            note = dict(n)
+            notes_by_course.setdefault(note.pop("course_id"), []).append(note)
+
         # 将结果组装成类似原始JSON的结构
         user_dict = dict(user)
         user_dict["courses"] = [dict(c) for c in courses]
@@ -351,17 +613,8 @@ class Database:
         for course in user_dict["courses"]:
             course_id = course["id"]
             course["tags"] = json.loads(course["tags"]) if course["tags"] else []
-            # 获取该课程的所有笔记
-            cursor.execute(
-                """
-                SELECT n.id, n.name, n.file FROM notes n
-                WHERE n.user_id = ? AND n.course_id = ?
-            """,
-                (user_id, course_id),
-            )
-            notes = cursor.fetchall()
             # 组装 myNotes 列表
-            course["myNotes"] = [dict(n) for n in notes]
+            course["myNotes"] = notes_by_course.get(course_id, [])
             # 将 title 重命名为 name 以匹配目标JSON
             course["name"] = course.pop("title")
             # 为myNotes添加 lessonName 字段
@@ -370,6 +623,69 @@ class Database:
 
         return user_dict
 
+    @_with_connection
+    def get_notes_page(self, user_id, limit=50, cursor=None, course_title=None):
+        """
+        按笔记ID分页获取用户的笔记，可按课程名过滤
+        返回 {"items": [{"id", "name", "file", "lessonName"}], "nextCursor": ...}
+        """
+        conn = self.get_db_connection()
+        db_cursor = conn.cursor()
+        select = """
+            SELECT n.id, n.name, n.file, c.title AS lessonName FROM notes n
+            JOIN courses c ON c.id = n.course_id
+            WHERE n.user_id = ?"""
+        params = (user_id,)
+        if course_title is not None:
+            select += " AND n.course_id = (SELECT id FROM courses WHERE user_id = ? AND title = ?)"
+            params = (user_id, user_id, course_title)
+        try:
+            rows, next_cursor = _keyset_page(db_cursor, select, params, ("n.id",), limit, cursor)
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return {"items": [], "nextCursor": None}
+        return {"items": [dict(row) for row in rows], "nextCursor": next_cursor}
+
+    @_with_connection
+    def find_note(self, user_id, course_title, note_name):
+        """
+        按课程名和笔记名查找用户的一条笔记，一次索引查询完成（不加载整个用户数据）。
+        用户不存在时返回 None；否则返回 {"courseId", "note"}，note 的 sha256 为文件在内容寻址存储中的摘要（旧笔记为 None），
+        课程不存在时 courseId 为 None，笔记不存在时 note 为 None。
+        同一课程下有同名笔记时返回最早创建的一条。
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                SELECT c.id AS course_id, n.id, n.name, n.file, n.blob_sha256 FROM users u
+                LEFT JOIN courses c ON c.user_id = u.id AND c.title = ?
+                LEFT JOIN notes n ON n.user_id = u.id AND n.course_id = c.id AND n.name = ?
+                WHERE u.id = ?
+                ORDER BY n.id
+                LIMIT 1
+            """,
+                (course_title, note_name, user_id),
+            )
+            row = cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return None
+        if row is None:
+            return None
+        note = None
+        if row["id"] is not None:
+            note = {
+                "id": row["id"],
+                "name": row["name"],
+                "file": row["file"],
+                "lessonName": course_title,
+                "sha256": row["blob_sha256"],
+            }
+        return {"courseId": row["course_id"], "note": note}
+
+    @_with_connection
     def find_user_by_credentials(self, username_or_email, password):
         """
         通过用户名/邮箱和密码查找用户。
@@ -389,6 +705,7 @@ class Database:
             return user_dict
         return None
 
+    @_with_connection
     def find_user_by_username_or_email(self, value):
         """
         通过用户名或邮箱查找用户。
@@ -401,6 +718,7 @@ class Database:
         user = cursor.fetchone()
         return dict(user) if user else None
 
+    @_writes
     def add_user(self, username, email, password):
         """
         添加一个新用户。
@@ -428,13 +746,6 @@ class Database:
                 cursor.execute("SELECT * FROM users WHERE id = ?", (new_user_id,))
                 new_user = cursor.fetchone()
 
-                # 为新用户创建存储目录
-                try:
-                    user_storage_path = Path(STOREBASE_DIR) / str(new_user_id)
-                    user_storage_path.mkdir(parents=True, exist_ok=True)
-                except Exception as e:
-                    print(f"创建用户存储目录时出错: {e}")
-
                 # 返回不含密码的副本
                 user_dict = dict(new_user)
                 user_dict.pop("password", None)
@@ -448,9 +759,58 @@ class Database:
             print(f"数据库错误: {e}")
             return None
 
-    def add_note(self, title, lessonName, tags, files, user_id):
+    @_writes
+    def delete_user(self, user_id):
+        """
+        删除用户及其全部数据（级联删除）。上传目录不做处理。
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            with conn:
+                cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+                return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"删除用户时发生数据库错误: {e}")
+            return False
+
+    @_writes
+    def _replicate_user(self, user_id, username, email, password):
+        """分片模式：把用户目录中的用户写入分片，供分片内的外键引用（内部方法）"""
+        conn = self.get_db_connection()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    username = excluded.username, email = excluded.email, password = excluded.password
+            """,
+                (user_id, username, email, password),
+            )
+
+    @_writes
+    def _set_user_shard(self, user_id, shard):
+        """分片模式：在用户目录中记录用户所在的分片（内部方法）"""
+        conn = self.get_db_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_shards (user_id, shard) VALUES (?, ?)", (user_id, shard)
+            )
+
+    @_with_connection
+    def _get_user_shard(self, user_id):
+        """分片模式：用户所在的分片，没有记录时返回 None（内部方法）"""
+        row = self.get_db_connection().execute(
+            "SELECT shard FROM user_shards WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row["shard"] if row else None
+
+    @_writes
+    def add_note(self, title, lessonName, tags, files, user_id, blob=None, quota=None):
         """
         添加一条新笔记，并将其关联到指定用户和课程。
+        blob 为内容寻址存储中的文件 {"sha256", "size"}，笔记按摘要引用它。
+        给出 quota 时，写入后该用户引用的文件总大小超过 quota 则不写入并抛出 QuotaExceeded。
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
@@ -471,25 +831,17 @@ class Database:
                 course_id = (
                     course["id"] if isinstance(course, sqlite3.Row) else course[0]
                 )
+                used = _storage_usage(cursor, user_id) if quota and blob else None
                 # 插入新笔记
                 # print(f"已找到课程ID {course_id}，正在为用户 {user_id} 添加笔记 '{title}'")
                 cursor.execute(
-                    "INSERT INTO notes (name, file, user_id, course_id) VALUES (?, ?, ?, ?)",
-                    (title, files[0] if files else None, user_id, course_id),
+                    "INSERT INTO notes (name, file, user_id, course_id, blob_sha256) VALUES (?, ?, ?, ?, ?)",
+                    (title, files[0] if files else None, user_id, course_id, blob["sha256"] if blob else None),
                 )
                 new_note_id = cursor.lastrowid
-
-                # 为新笔记创建存储目录（如果需要）
-                try:
-                    note_storage_path = (
-                        Path(STOREBASE_DIR)
-                        / str(user_id)
-                        / str(lessonName)
-                        / str(title)
-                    )
-                    note_storage_path.mkdir(parents=True, exist_ok=True)
-                except Exception as e:
-                    print(f"创建笔记存储目录时出错: {e}")
+                _record_blob_sizes(cursor, [blob])
+                if used is not None:
+                    _check_quota(cursor, user_id, quota, used)
 
                 # 查询并返回新创建的笔记信息
                 cursor.execute("SELECT * FROM notes WHERE id = ?", (new_note_id,))
@@ -500,6 +852,7 @@ class Database:
             print(f"添加笔记时发生数据库错误: {e}")
             return None
         
+    @_writes
     def edit_course(self, user_id, old_title, new_title):
         """
         修改课程名称
@@ -531,30 +884,26 @@ class Database:
             print(f"数据库错误: {e}")
             return {"error": f"数据库错误: {e}"}
 
+    @_writes
     def edit_note(self, user_id, course_name, old_note_name, new_note_name):
         """
         修改笔记名称
+        文件按内容摘要存放，与课程名、笔记名无关，改名只更新这一行
         """
-        import os
-        from pathlib import Path
-        import shutil
-        
         conn = self.get_db_connection()
         cursor = conn.cursor()
         try:
             with conn:
                 # 获取课程ID
                 cursor.execute(
-                    "SELECT id, title FROM courses WHERE user_id = ? AND title = ?",
+                    "SELECT id FROM courses WHERE user_id = ? AND title = ?",
                     (user_id, course_name)
                 )
                 course = cursor.fetchone()
                 if not course:
                     return {"error": "课程不存在"}
-                
-                course_id = course["id"] if isinstance(course, sqlite3.Row) else course[0]
-                course_title = course["title"] if isinstance(course, sqlite3.Row) else course[1]
-                
+                course_id = course["id"]
+
                 # 检查新名称是否已存在
                 cursor.execute(
                     "SELECT id FROM notes WHERE user_id = ? AND course_id = ? AND name = ?",
@@ -563,54 +912,250 @@ class Database:
                 existing = cursor.fetchone()
                 if existing:
                     return {"error": "笔记名称已存在"}
-                
-                # 1. 获取原笔记信息
-                cursor.execute(
-                    "SELECT id, file FROM notes WHERE user_id = ? AND course_id = ? AND name = ?",
-                    (user_id, course_id, old_note_name)
-                )
-                note = cursor.fetchone()
-                if not note:
-                    return {"error": "笔记不存在或无权修改"}
-                
-                note_id = note["id"] if isinstance(note, sqlite3.Row) else note[0]
-                old_file_name = note["file"] if isinstance(note, sqlite3.Row) else note[1]
-                
-                # 2. 更新数据库中的笔记名称
+
                 cursor.execute(
                     "UPDATE notes SET name = ? WHERE user_id = ? AND course_id = ? AND name = ?",
                     (new_note_name, user_id, course_id, old_note_name)
                 )
-                
                 if cursor.rowcount == 0:
                     return {"error": "笔记不存在或无权修改"}
-                
-                # 3. 更新文件系统（如果存在对应的文件）
-                if old_file_name:
-                    # 构建旧的和新的文件路径
-                    old_dir = Path(STOREBASE_DIR) / str(user_id) / str(course_title) / str(old_note_name)
-                    new_dir = Path(STOREBASE_DIR) / str(user_id) / str(course_title) / str(new_note_name)
-                    
-                    # 如果旧目录存在，重命名目录
-                    if old_dir.exists() and old_dir.is_dir():
-                        try:
-                            # 如果新目录已存在，先删除
-                            if new_dir.exists():
-                                shutil.rmtree(new_dir)
-                            # 重命名目录
-                            shutil.move(str(old_dir), str(new_dir))
-                            print(f"✓ 重命名笔记目录: {old_dir} -> {new_dir}")
-                        except Exception as e:
-                            print(f"✗ 重命名笔记目录失败: {e}")
-                            # 这里可以决定是否回滚数据库操作
-                            # 为了数据一致性，我们继续执行，但记录错误
-                
+
                 return {"success": True, "message": "笔记名称修改成功"}
         except sqlite3.Error as e:
             print(f"数据库错误: {e}")
             return {"error": f"数据库错误: {e}"}
-        
+
+    # 内容寻址存储的引用计数（计数本身由 notes 上的触发器维护）
+    @_with_connection
+    def unreferenced_blobs(self, limit=500):
+        """引用计数已降为 0 的文件摘要，最多 limit 个"""
+        conn = self.get_db_connection()
+        rows = conn.execute(
+            "SELECT sha256 FROM blobs WHERE refcount <= 0 LIMIT ?", (limit,)
+        ).fetchall()
+        return [row["sha256"] for row in rows]
+
+    @_with_connection
+    def get_storage_usage(self, user_id):
+        """用户笔记引用的文件总大小（字节），同一文件只计一次"""
+        return _storage_usage(self.get_db_connection().cursor(), user_id)
+
+    @_with_connection
+    def known_blobs(self, digests):
+        """digests 中在 blobs 表里有记录的摘要（集合）"""
+        conn = self.get_db_connection()
+        known = set()
+        for chunk in _chunks(list(digests)):
+            rows = conn.execute(
+                f"SELECT sha256 FROM blobs WHERE sha256 IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            known.update(row["sha256"] for row in rows)
+        return known
+
+    @_writes
+    def forget_blob(self, digest):
+        """
+        删除引用计数为 0 的 blobs 记录，返回文件是否可以删除（不再有任何笔记引用）。
+        在删除文件之前调用：期间若有新笔记引用了该摘要，记录不会被删除，返回 False。
+        """
+        conn = self.get_db_connection()
+        try:
+            with conn:
+                conn.execute("DELETE FROM blobs WHERE sha256 = ? AND refcount <= 0", (digest,))
+                return conn.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (digest,)).fetchone() is None
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return False
+
+    @_with_connection
+    def legacy_note_files(self, after_id=0, limit=500, user_id=None):
+        """
+        文件仍在旧目录 <用户>/<课程>/<笔记>/<文件> 下的笔记（尚未迁移到内容寻址存储），按 id 升序，
+        返回 id 大于 after_id 的至多 limit 条 {"id", "user_id", "course", "name", "file"}。
+        给出 user_id 时只查该用户。
+        """
+        conn = self.get_db_connection()
+        sql = """
+            SELECT n.id, n.user_id, c.title AS course, n.name, n.file
+            FROM notes AS n JOIN courses AS c ON c.id = n.course_id
+            WHERE n.blob_sha256 IS NULL AND n.file IS NOT NULL AND n.id > ?
+        """
+        params = [after_id]
+        if user_id is not None:
+            sql += " AND n.user_id = ?"
+            params.append(user_id)
+        rows = conn.execute(sql + " ORDER BY n.id LIMIT ?", (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    @_writes
+    def set_note_blob(self, user_id, note_id, blob):
+        """把尚未迁移的笔记指向内容寻址存储中的文件，返回是否更新"""
+        conn = self.get_db_connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE notes SET blob_sha256 = ? WHERE id = ? AND user_id = ? AND blob_sha256 IS NULL",
+                    (blob["sha256"], note_id, user_id),
+                )
+                updated = cursor.rowcount > 0
+                _record_blob_sizes(conn.cursor(), [blob])
+                return updated
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return False
+
+    # 可续传上传相关方法
+    @_writes
+    def create_upload(self, user_id, title, lesson_name, filename, size, tags=None, sha256=None, now=None):
+        """
+        新建一次分块上传会话，返回会话（见 get_upload）；用户不存在时返回 None。
+        sha256 为客户端声明的文件摘要，完成时校验。
+        """
+        conn = self.get_db_connection()
+        now = int(time.time() if now is None else now)
+        upload_id = os.urandom(16).hex()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO upload_sessions "
+                    "(id, user_id, title, lesson_name, filename, tags, size, sha256, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (upload_id, user_id, title, lesson_name, filename, json.dumps(tags or []), size, sha256, now, now),
+                )
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return None
+        return self.get_upload(user_id, upload_id)
+
+    @_with_connection
+    def get_upload(self, user_id, upload_id):
+        """
+        用户的上传会话，不存在时返回 None。
+        received 为已收到的字节区间 [[start, end), ...]，相邻、重叠的分块已合并。
+        """
+        conn = self.get_db_connection()
+        row = conn.execute(
+            "SELECT * FROM upload_sessions WHERE id = ? AND user_id = ?", (upload_id, user_id)
+        ).fetchone()
+        if row is None:
+            return None
+        received = []
+        for chunk in conn.execute(
+            "SELECT start_offset, end_offset FROM upload_chunks WHERE session_id = ? ORDER BY start_offset",
+            (upload_id,),
+        ):
+            if received and chunk["start_offset"] <= received[-1][1]:
+                received[-1][1] = max(received[-1][1], chunk["end_offset"])
+            else:
+                received.append([chunk["start_offset"], chunk["end_offset"]])
+        return {
+            "id": row["id"],
+            "title": row["title"],
+            "lessonName": row["lesson_name"],
+            "filename": row["filename"],
+            "tags": json.loads(row["tags"] or "[]"),
+            "size": row["size"],
+            "sha256": row["sha256"],
+            "received": received,
+            "complete": received == ([[0, row["size"]]] if row["size"] else []),
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+        }
+
+    @_writes
+    def add_upload_chunk(self, user_id, upload_id, start, end, now=None):
+        """记录已写入 [start, end) 的分块，返回会话是否存在。"""
+        conn = self.get_db_connection()
+        now = int(time.time() if now is None else now)
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE upload_sessions SET updated_at = ? WHERE id = ? AND user_id = ?",
+                    (now, upload_id, user_id),
+                )
+                if cursor.rowcount == 0:
+                    return False
+                conn.execute(
+                    "INSERT INTO upload_chunks (session_id, start_offset, end_offset) VALUES (?, ?, ?) "
+                    "ON CONFLICT(session_id, start_offset) DO UPDATE SET end_offset = MAX(end_offset, excluded.end_offset)",
+                    (upload_id, start, end),
+                )
+                return True
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return False
+
+    @_writes
+    def delete_upload(self, user_id, upload_id):
+        """删除上传会话（完成或取消），返回是否存在。"""
+        conn = self.get_db_connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "DELETE FROM upload_sessions WHERE id = ? AND user_id = ?", (upload_id, user_id)
+                )
+                return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return False
+
+    @_writes
+    def complete_upload(self, user_id, upload_id, blob, quota=None):
+        """
+        在一个事务中删除上传会话并创建引用 blob 的笔记，返回新笔记。
+        会话已不存在（被其他请求完成或已取消）时返回 None；
+        课程不存在时回滚并返回 False，会话保留，客户端可以稍后重试；
+        给出 quota 且写入后超出时回滚并抛出 QuotaExceeded，会话同样保留。
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            with conn:
+                # 先删除会话：并发的完成请求中只有一个能删到这一行
+                session = cursor.execute(
+                    "DELETE FROM upload_sessions WHERE id = ? AND user_id = ? "
+                    "RETURNING title, lesson_name, filename",
+                    (upload_id, user_id),
+                ).fetchone()
+                if session is None:
+                    return None
+                used = _storage_usage(cursor, user_id) if quota else None
+                note = self._insert_notes(
+                    cursor,
+                    user_id,
+                    [{
+                        "title": session["title"],
+                        "lessonName": session["lesson_name"],
+                        "files": [session["filename"]],
+                        "blob": blob,
+                    }],
+                )[0]
+                if note is None:
+                    raise _AbortWrite
+                _check_quota(cursor, user_id, quota, used)
+                return note
+        except _AbortWrite:
+            return False
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return False
+
+    @_writes
+    def purge_uploads(self, before):
+        """删除 updated_at 早于 before 的会话，返回被删除会话的 id 列表（调用方删除对应的临时文件）。"""
+        conn = self.get_db_connection()
+        try:
+            with conn:
+                rows = conn.execute(
+                    "DELETE FROM upload_sessions WHERE updated_at < ? RETURNING id", (int(before),)
+                ).fetchall()
+                return [row["id"] for row in rows]
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return []
+
     # 常用链接相关方法
+    @_writes
     def add_link_category(self, user_id, category, icon, sort_order=0):
         """
         添加链接分类
@@ -632,6 +1177,7 @@ class Database:
             print(f"数据库错误: {e}")
             return None
 
+    @_with_connection
     def get_link_categories(self, user_id):
         """
         获取用户的所有链接分类
@@ -649,6 +1195,7 @@ class Database:
             print(f"数据库错误: {e}")
             return []
 
+    @_writes
     def add_useful_link(self, user_id, category_id, name, url, description="", is_trusted=False, sort_order=0):
         """
         添加常用链接
@@ -670,6 +1217,7 @@ class Database:
             print(f"数据库错误: {e}")
             return None
 
+    @_with_connection
     def get_useful_links_by_category(self, user_id):
         """
         获取用户的所有链接，按分类组织
@@ -680,29 +1228,28 @@ class Database:
         try:
             # 获取所有分类
             categories = self.get_link_categories(user_id)
-            
+
+            # 一次性取出该用户的全部链接，按分类分组
+            cursor.execute(
+                "SELECT * FROM useful_links WHERE user_id = ? ORDER BY sort_order, created_at, id",
+                (user_id,)
+            )
+            links_by_category = {}
+            for link in cursor.fetchall():
+                link_dict = dict(link)
+                links_by_category.setdefault(link_dict['category_id'], []).append({
+                    "name": link_dict['name'],
+                    "url": link_dict['url'],
+                    "desc": link_dict['description'] or "",
+                    "isTrusted": bool(link_dict['is_trusted'])
+                })
+
             result = []
             for category in categories:
-                cursor.execute(
-                    "SELECT * FROM useful_links WHERE user_id = ? AND category_id = ? ORDER BY sort_order, created_at",
-                    (user_id, category['id'])
-                )
-                links = cursor.fetchall()
-                
-                link_list = []
-                for link in links:
-                    link_dict = dict(link)
-                    link_list.append({
-                        "name": link_dict['name'],
-                        "url": link_dict['url'],
-                        "desc": link_dict['description'] or "",
-                        "isTrusted": bool(link_dict['is_trusted'])
-                    })
-                
                 result.append({
                     "category": category['category'],
                     "icon": category['icon'],
-                    "links": link_list
+                    "links": links_by_category.get(category['id'], [])
                 })
             
             return result
@@ -710,6 +1257,80 @@ class Database:
             print(f"数据库错误: {e}")
             return []
 
+    @_with_connection
+    def get_useful_links_page(self, user_id, limit=50, cursor=None, category_id=None):
+        """
+        分页获取用户的链接（顺序与 get_useful_links_by_category 中每个分类内的顺序一致），可按分类过滤
+        返回 {"items": [{"id", "categoryId", "name", "url", "desc", "isTrusted"}], "nextCursor": ...}
+        """
+        conn = self.get_db_connection()
+        db_cursor = conn.cursor()
+        select = "SELECT * FROM useful_links WHERE user_id = ?"
+        params = (user_id,)
+        if category_id is not None:
+            select += " AND category_id = ?"
+            params = (user_id, category_id)
+        try:
+            rows, next_cursor = _keyset_page(
+                db_cursor, select, params, ("sort_order", "created_at", "id"), limit, cursor
+            )
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return {"items": [], "nextCursor": None}
+        items = [
+            {
+                "id": row['id'],
+                "categoryId": row['category_id'],
+                "name": row['name'],
+                "url": row['url'],
+                "desc": row['description'] or "",
+                "isTrusted": bool(row['is_trusted']),
+            }
+            for row in rows
+        ]
+        return {"items": items, "nextCursor": next_cursor}
+
+    @_writes
+    def replace_link_categories(self, user_id, link_categories):
+        """
+        用新的列表整体替换用户的链接分类及链接
+        link_categories: [{"category": "...", "icon": "...", "links": [{"name", "url", "desc", "isTrusted"}]}]
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            with conn:
+                # 外键开启后，删除分类会级联删除该分类下的链接
+                cursor.execute("DELETE FROM link_categories WHERE user_id = ?", (user_id,))
+
+                for category in link_categories:
+                    cursor.execute(
+                        "INSERT INTO link_categories (category, icon, user_id, sort_order) VALUES (?, ?, ?, ?)",
+                        (category['category'], category['icon'], user_id, category.get('sort_order', 0))
+                    )
+                    category_id = cursor.lastrowid
+
+                    cursor.executemany(
+                        "INSERT INTO useful_links (name, url, description, is_trusted, category_id, user_id, sort_order) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (
+                                link['name'],
+                                link['url'],
+                                link.get('desc', ''),
+                                link.get('isTrusted', False),
+                                category_id,
+                                user_id,
+                                link.get('sort_order', 0)
+                            )
+                            for link in category.get('links', [])
+                        ]
+                    )
+                return True
+        except (sqlite3.Error, KeyError, TypeError) as e:
+            print(f"更新链接分类时出错: {e}")
+            return False
+
+    @_writes
     def delete_link_category(self, user_id, category_id):
         """
         删除链接分类（会级联删除该分类下的所有链接）
@@ -727,6 +1348,7 @@ class Database:
             print(f"数据库错误: {e}")
             return False
 
+    @_writes
     def delete_useful_link(self, user_id, link_id):
         """
         删除常用链接
@@ -745,17 +1367,24 @@ class Database:
             return False
 
     # 任务管理相关方法
+    @_writes
     def add_task(self, user_id, name, deadline, message="", status=1):
         """
-        添加任务
+        添加任务，截止时间为 NaN、Infinity 等非法数值时返回 None
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
+        try:
+            columns = deadline_columns(deadline)
+        except ValueError as e:
+            print(f"添加任务失败: {e}")
+            return None
         try:
             with conn:
                 cursor.execute(
-                    "INSERT INTO tasks (name, deadline, message, status, user_id) VALUES (?, ?, ?, ?, ?)",
-                    (name, deadline, message, status, user_id)
+                    "INSERT INTO tasks (name, deadline, deadline_at, has_deadline, message, status, user_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (name, *columns, message, status, user_id)
                 )
                 task_id = cursor.lastrowid
                 
@@ -766,6 +1395,119 @@ class Database:
             print(f"数据库错误: {e}")
             return None
 
+    def _insert_notes(self, cursor, user_id, notes):
+        """
+        批量插入笔记（调用方负责事务）。
+        课程ID一次性解析；返回与 notes 一一对应的列表，课程不存在的位置为 None。
+        """
+        titles = list(dict.fromkeys(note['lessonName'] for note in notes))
+        course_ids = {}
+        for chunk in _chunks(titles):
+            cursor.execute(
+                f"SELECT id, title FROM courses WHERE user_id = ? AND title IN ({', '.join('?' * len(chunk))})",
+                [user_id, *chunk],
+            )
+            course_ids.update((row['title'], row['id']) for row in cursor.fetchall())
+
+        rows, positions = [], []
+        for i, note in enumerate(notes):
+            course_id = course_ids.get(note['lessonName'])
+            if course_id is None:
+                print(f"错误：用户 {user_id} 下不存在课程 '{note['lessonName']}'，无法添加笔记。")
+                continue
+            files = note.get('files') or []
+            blob = note.get('blob')
+            rows.append((note['title'], files[0] if files else None, user_id, course_id, blob['sha256'] if blob else None))
+            positions.append(i)
+
+        result = [None] * len(notes)
+        created = _insert_returning(
+            cursor, "notes", ("name", "file", "user_id", "course_id", "blob_sha256"), rows
+        )
+        _record_blob_sizes(cursor, [notes[i].get('blob') for i in positions])
+        for i, new_note in zip(positions, created):
+            result[i] = new_note
+        return result
+
+    def _insert_tasks(self, cursor, user_id, tasks):
+        """批量插入任务（调用方负责事务），返回新插入的任务列表。缺少 name 或截止时间非法的任务被跳过。"""
+        rows = []
+        for task in tasks:
+            if task.get('name') is None:
+                print(f"跳过缺少 name 的任务: {task}")
+                continue
+            try:
+                columns = deadline_columns(task.get('deadline'))
+            except ValueError as e:
+                print(f"跳过截止时间非法的任务: {e}")
+                continue
+            rows.append(
+                (
+                    task['name'],
+                    *columns,
+                    task.get('message', ''),
+                    task.get('status', 1),
+                    user_id,
+                )
+            )
+        return _insert_returning(
+            cursor,
+            "tasks",
+            ("name", "deadline", "deadline_at", "has_deadline", "message", "status", "user_id"),
+            rows,
+        )
+
+    @_writes
+    def add_notes_bulk(self, user_id, notes):
+        """
+        在一个事务内批量添加笔记
+        notes: [{"title": "...", "lessonName": "...", "files": ["..."]}, ...]
+        返回与 notes 一一对应的新笔记列表（课程不存在的位置为 None），数据库错误返回 None
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            with conn:
+                return self._insert_notes(cursor, user_id, notes)
+        except sqlite3.Error as e:
+            print(f"批量添加笔记时发生数据库错误: {e}")
+            return None
+
+    @_writes
+    def add_tasks_bulk(self, user_id, tasks):
+        """
+        在一个事务内批量添加任务
+        tasks: [{"name": "...", "deadline": "...", "message": "...", "status": "..."}, ...]
+        返回新插入的任务列表，数据库错误返回 None
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            with conn:
+                return self._insert_tasks(cursor, user_id, tasks)
+        except sqlite3.Error as e:
+            print(f"批量添加任务时发生数据库错误: {e}")
+            return None
+
+    @_writes
+    def add_cloud_results(self, user_id, notes, tasks):
+        """
+        将一次 /cloud 同步得到的笔记和任务放在同一个事务里写入
+        返回 {"notes": [...], "tasks": [...]}，数据库错误返回 None
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            with conn:
+                return {
+                    "notes": self._insert_notes(cursor, user_id, notes),
+                    "tasks": self._insert_tasks(cursor, user_id, tasks),
+                }
+        except sqlite3.Error as e:
+            print(f"写入同步结果时发生数据库错误: {e}")
+            return None
+
+    @_with_connection
     def get_tasks(self, user_id):
         """
         获取用户的任务列表，返回格式与 deadlines 数据结构一致
@@ -774,7 +1516,8 @@ class Database:
         cursor = conn.cursor()
         try:
             cursor.execute(
-                "SELECT * FROM tasks WHERE user_id = ? ORDER BY deadline ASC",
+                # 按截止时间先后排序，没有截止时间的排在最后
+                "SELECT * FROM tasks WHERE user_id = ? ORDER BY has_deadline DESC, deadline_at, id",
                 (user_id,)
             )
             tasks = cursor.fetchall()
@@ -793,6 +1536,77 @@ class Database:
             print(f"数据库错误: {e}")
             return []
 
+    @_with_connection
+    def get_tasks_page(self, user_id, limit=50, cursor=None):
+        """
+        按截止时间分页获取任务，没有截止时间的任务排在最后
+        先在有截止时间的任务中按 (deadline_at, id) 翻页，翻完后再按 id 翻没有截止时间的任务，
+        两段都走索引 tasks(user_id, has_deadline, deadline_at)
+        cursor 为上一页返回的 nextCursor，非法时抛出 ValueError
+        返回 {"items": [{"id", "name", "deadline", "deadlineAt", "message", "status"}], "nextCursor": ...}
+        """
+        # 游标为 [has_deadline, deadline_at, id]
+        has_deadline, *key = _decode_cursor(cursor, 3) if cursor is not None else [1, None, None]
+        select = "SELECT * FROM tasks WHERE user_id = ? AND has_deadline = ?"
+        conn = self.get_db_connection()
+        db_cursor = conn.cursor()
+        try:
+            rows, next_key = [], None
+            if has_deadline:
+                rows, next_key = _keyset_rows(
+                    db_cursor, select, (user_id, 1), ("deadline_at", "id"), limit,
+                    key if key[1] is not None else None,
+                )
+                if next_key is not None:
+                    return {
+                        "items": [_task_item(row) for row in rows],
+                        "nextCursor": _encode_cursor([1, *next_key]),
+                    }
+                key = [None, None]
+            undated = []
+            if len(rows) < limit:
+                undated, next_key = _keyset_rows(
+                    db_cursor, select, (user_id, 0), ("id",), limit - len(rows),
+                    key[1:] if key[1] is not None else None,
+                )
+            else:
+                # 有截止时间的任务恰好填满本页：看看后面还有没有无截止时间的任务
+                db_cursor.execute(f"{select} LIMIT 1", (user_id, 0))
+                next_key = [None] if db_cursor.fetchone() else None
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return {"items": [], "nextCursor": None}
+        items = [_task_item(row) for row in rows + undated]
+        next_cursor = None
+        if next_key is not None:
+            next_cursor = _encode_cursor([0, None, next_key[0]])
+        return {"items": items, "nextCursor": next_cursor}
+
+    @_with_connection
+    def get_upcoming_tasks(self, user_id, days=7, now=None):
+        """
+        获取截止时间在 [now, now + days 天) 内的任务，按截止时间排序
+        只在索引 tasks(user_id, has_deadline, deadline_at) 上做一次范围扫描
+        """
+        start = int(time.time() if now is None else now)
+        end = start + int(days * 86400)
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                SELECT * FROM tasks
+                WHERE user_id = ? AND has_deadline = 1 AND deadline_at >= ? AND deadline_at < ?
+                ORDER BY deadline_at, id
+            """,
+                (user_id, start, end),
+            )
+            return [_task_item(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"数据库错误: {e}")
+            return []
+
+    @_writes
     def update_task(self, user_id, task_id, **updates):
         """
         更新任务信息
@@ -801,6 +1615,11 @@ class Database:
         cursor = conn.cursor()
         try:
             with conn:
+                if 'deadline' in updates:
+                    # 截止时间原文与时间戳同时更新
+                    updates['deadline'], updates['deadline_at'], updates['has_deadline'] = (
+                        deadline_columns(updates['deadline'])
+                    )
                 # 构建动态更新语句
                 set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
                 values = list(updates.values())
@@ -815,6 +1634,7 @@ class Database:
             print(f"数据库错误: {e}")
             return False
 
+    @_writes
     def delete_task(self, user_id, task_id):
         """
         删除任务
@@ -832,105 +1652,228 @@ class Database:
             print(f"数据库错误: {e}")
             return False
 
-    def update_deadlines(self, user_id, deadlines):
+    @_writes
+    def update_deadlines(self, user_id, deadlines, reconcile=True):
         """
         批量更新用户的DDL列表
         deadlines: 任务对象列表，格式为 [{"name": "...", "deadline": "...", "message": "...", "status": "..."}, ...]
+        reconcile=True 时按自然键 (name, deadline) 与现有任务比对，只执行必要的插入/更新/删除；
+        reconcile=False 时删除全部任务后重新插入。
+        返回 {"inserted", "updated", "deleted", "unchanged"} 计数，失败返回 False；
+        deadline 为 NaN、Infinity 等非法数值时抛出 ValueError，不做任何修改。
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
+        incoming = [
+            {
+                "name": task.get('name', ''),
+                "deadline": deadline_columns(task.get('deadline'))[0],
+                "message": task.get('message', ''),
+                "status": task.get('status', 'pending'),
+            }
+            for task in deadlines
+        ]
         try:
             with conn:
-                # 先删除用户的所有现有任务
-                cursor.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
-                
-                # 批量插入新任务
-                for task in deadlines:
+                if reconcile:
                     cursor.execute(
-                        "INSERT INTO tasks (name, deadline, message, status, user_id) VALUES (?, ?, ?, ?, ?)",
-                        (
-                            task.get('name', ''),
-                            task.get('deadline', ''),
-                            task.get('message', ''),
-                            task.get('status', 'pending'),
-                            user_id
-                        )
+                        "SELECT id, name, deadline, message, status FROM tasks WHERE user_id = ? ORDER BY id",
+                        (user_id,)
                     )
-                
-                return True
+                    existing = [dict(row) for row in cursor.fetchall()]
+                    matched, to_insert, to_delete = _reconcile(
+                        existing,
+                        incoming,
+                        key=lambda t: (_as_text(t['name']), _as_text(t['deadline'])),
+                    )
+                    to_update = [
+                        (new['message'], new['status'], old['id'])
+                        for old, new in matched
+                        if (old['message'], old['status']) != (_as_text(new['message']), _as_text(new['status']))
+                    ]
+                else:
+                    cursor.execute("SELECT id FROM tasks WHERE user_id = ?", (user_id,))
+                    to_delete = [dict(row) for row in cursor.fetchall()]
+                    matched, to_insert, to_update = [], incoming, []
+
+                cursor.executemany(
+                    "DELETE FROM tasks WHERE id = ?", [(row['id'],) for row in to_delete]
+                )
+                cursor.executemany(
+                    "UPDATE tasks SET message = ?, status = ? WHERE id = ?", to_update
+                )
+                cursor.executemany(
+                    "INSERT INTO tasks (name, deadline, deadline_at, has_deadline, message, status, user_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (task['name'], *deadline_columns(task['deadline']), task['message'], task['status'], user_id)
+                        for task in to_insert
+                    ]
+                )
+
+                return {
+                    "inserted": len(to_insert),
+                    "updated": len(to_update),
+                    "deleted": len(to_delete),
+                    "unchanged": len(matched) - len(to_update),
+                }
         except sqlite3.Error as e:
             print(f"数据库错误: {e}")
             return False
 
 
+    @_writes
     def add_course_schedule(self, user_id, name, teacher, location, week_type, times):
         """
         添加课程表
-        times: 时间索引列表 [14, 15, 40, 41] 等
+        times: 时间索引列表 [14, 15, 40, 41] 等，存为 84 位时间段掩码
+        时间索引不在 0-83 范围内时返回 None
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
+        try:
+            slots_lo, slots_hi = pack_slots(times)
+        except ValueError as e:
+            print(f"添加课程表失败: {e}")
+            return None
         try:
             with conn:
-                # 插入课程表基本信息
                 cursor.execute(
-                    "INSERT INTO course_schedules (name, teacher, location, week_type, user_id) VALUES (?, ?, ?, ?, ?)",
-                    (name, teacher, location, week_type, user_id)
+                    "INSERT INTO course_schedules (name, teacher, location, week_type, slots_lo, slots_hi, user_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (name, teacher, location, week_type, slots_lo, slots_hi, user_id)
                 )
                 schedule_id = cursor.lastrowid
-                
-                # 插入上课时间
-                for time_index in times:
-                    cursor.execute(
-                        "INSERT INTO course_schedule_times (course_schedule_id, time_index) VALUES (?, ?)",
-                        (schedule_id, time_index)
-                    )
-                
+
                 # 查询并返回完整的课程表信息
                 return self._get_course_schedule_by_id(schedule_id)
         except sqlite3.Error as e:
             print(f"添加课程表时发生数据库错误: {e}")
             return None
 
+    @_with_connection
     def get_course_schedules(self, user_id):
         """
-        获取用户的所有课程表
+        获取用户的所有课程表（上课时间存在同一行的时间段掩码里，一次查询）
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
         try:
-            # 获取所有课程表基本信息
             cursor.execute(
-                "SELECT * FROM course_schedules WHERE user_id = ? ORDER BY name",
+                "SELECT * FROM course_schedules WHERE user_id = ? ORDER BY name, id",
                 (user_id,)
             )
-            schedules = cursor.fetchall()
-            
-            result = []
-            for schedule in schedules:
-                schedule_dict = dict(schedule)
-                # 获取该课程的上课时间
+            return [_schedule_item(schedule) for schedule in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"获取课程表时发生数据库错误: {e}")
+            return []
+
+    @_with_connection
+    def get_course_schedules_page(self, user_id, limit=50, cursor=None):
+        """
+        按课程名分页获取课程表
+        返回 {"items": [与 get_course_schedules 相同结构], "nextCursor": ...}
+        """
+        conn = self.get_db_connection()
+        db_cursor = conn.cursor()
+        try:
+            schedules, next_cursor = _keyset_page(
+                db_cursor,
+                "SELECT * FROM course_schedules WHERE user_id = ?",
+                (user_id,),
+                ("name", "id"),
+                limit,
+                cursor,
+            )
+        except sqlite3.Error as e:
+            print(f"获取课程表时发生数据库错误: {e}")
+            return {"items": [], "nextCursor": None}
+        return {"items": [_schedule_item(schedule) for schedule in schedules], "nextCursor": next_cursor}
+
+    @_with_connection
+    def get_week_occupancy(self, user_ids):
+        """
+        批量读取多个用户（整数 id 列表）的课表占用，返回 {user_id: (单周掩码, 双周掩码)}
+        每个用户的所有课程按位或；没有课的用户两个掩码都是 0
+        """
+        occupancy = {user_id: (0, 0) for user_id in user_ids}
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            for chunk in _chunks(list(occupancy)):
                 cursor.execute(
-                    "SELECT time_index FROM course_schedule_times WHERE course_schedule_id = ? ORDER BY time_index",
-                    (schedule_dict['id'],)
+                    f"""
+                    SELECT user_id, week_type, slots_lo, slots_hi FROM course_schedules
+                    WHERE user_id IN ({', '.join('?' * len(chunk))})
+                """,
+                    chunk,
                 )
-                times = [row['time_index'] for row in cursor.fetchall()]
-                
-                # 组装成与前端 Course 类一致的结构
-                result.append({
-                    "id": schedule_dict['id'],
-                    "name": schedule_dict['name'],
-                    "teacher": schedule_dict['teacher'] or "",
-                    "location": schedule_dict['location'] or "",
-                    "weekType": schedule_dict['week_type'],
-                    "times": times
-                })
-            
-            return result
+                for row in cursor.fetchall():
+                    odd, even = week_masks(row['week_type'], join_mask(row['slots_lo'], row['slots_hi']))
+                    user_odd, user_even = occupancy[row['user_id']]
+                    occupancy[row['user_id']] = (user_odd | odd, user_even | even)
+        except sqlite3.Error as e:
+            print(f"获取课表占用时发生数据库错误: {e}")
+            return None
+        return occupancy
+
+    def find_free_slots(self, user_ids):
+        """
+        求多个用户的共同空闲时间段
+        返回 {"free": 每周都空闲, "freeOddWeeks": 单周空闲, "freeEvenWeeks": 双周空闲,
+              "busyCount": 每个时间段有课的人数（长度 84）}
+        """
+        occupancy = self.get_week_occupancy(user_ids)
+        if occupancy is None:
+            return None
+        busy_odd = busy_even = 0
+        for odd, even in occupancy.values():
+            busy_odd |= odd
+            busy_even |= even
+        return {
+            "free": mask_to_slots(FULL_MASK & ~(busy_odd | busy_even)),
+            "freeOddWeeks": mask_to_slots(FULL_MASK & ~busy_odd),
+            "freeEvenWeeks": mask_to_slots(FULL_MASK & ~busy_even),
+            "busyCount": busy_counts(odd | even for odd, even in occupancy.values()),
+        }
+
+    @_with_connection
+    def get_schedule_conflicts(self, user_id):
+        """
+        找出用户课表中时间重叠的课程
+        单周课与双周课占同一时间段不算冲突；weekType 表示冲突发生在每周(0)/单周(1)/双周(2)
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT id, name, week_type, slots_lo, slots_hi FROM course_schedules WHERE user_id = ? ORDER BY name, id",
+                (user_id,)
+            )
+            schedules = [
+                (row, week_masks(row['week_type'], join_mask(row['slots_lo'], row['slots_hi'])))
+                for row in cursor.fetchall()
+            ]
         except sqlite3.Error as e:
             print(f"获取课程表时发生数据库错误: {e}")
-            return []
+            return None
+
+        conflicts = []
+        for i, (a, (a_odd, a_even)) in enumerate(schedules):
+            for b, (b_odd, b_even) in schedules[i + 1:]:
+                odd, even = a_odd & b_odd, a_even & b_even
+                if not odd | even:
+                    continue
+                # 两门课各只有一个时间段掩码，重叠部分要么单双周相同，要么只落在其中一种周
+                conflicts.append({
+                    "courseIds": [a['id'], b['id']],
+                    "names": [a['name'], b['name']],
+                    "weekType": 0 if odd == even else (1 if odd else 2),
+                    "times": mask_to_slots(odd | even),
+                })
+        return conflicts
 
+    @_writes
     def update_course_schedule(self, user_id, schedule_id, **updates):
         """
         更新课程表信息
@@ -946,6 +1889,10 @@ class Database:
                 for field in allowed_fields:
                     if field in updates:
                         update_fields[field] = updates[field]
+
+                # 上课时间与基本信息在同一行，一条 UPDATE 完成
+                if 'times' in updates:
+                    update_fields['slots_lo'], update_fields['slots_hi'] = pack_slots(updates['times'])
                 
                 # 如果有基本信息需要更新
                 if update_fields:
@@ -957,30 +1904,19 @@ class Database:
                         f"UPDATE course_schedules SET {set_clause} WHERE id = ? AND user_id = ?",
                         values
                     )
-                
-                # 如果需要更新上课时间
-                if 'times' in updates:
-                    # 先删除原有时间
-                    cursor.execute(
-                        "DELETE FROM course_schedule_times WHERE course_schedule_id = ?",
-                        (schedule_id,)
-                    )
-                    
-                    # 插入新的时间
-                    for time_index in updates['times']:
-                        cursor.execute(
-                            "INSERT INTO course_schedule_times (course_schedule_id, time_index) VALUES (?, ?)",
-                            (schedule_id, time_index)
-                        )
-                
+
                 return True
+        except ValueError as e:
+            print(f"更新课程表失败: {e}")
+            return False
         except sqlite3.Error as e:
             print(f"更新课程表时发生数据库错误: {e}")
             return False
 
+    @_writes
     def delete_course_schedule(self, user_id, schedule_id):
         """
-        删除课程表（会级联删除上课时间）
+        删除课程表
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
@@ -995,74 +1931,223 @@ class Database:
             print(f"删除课程表时发生数据库错误: {e}")
             return False
 
-    def update_course_table(self, user_id, course_table):
+    @_writes
+    def update_course_table(self, user_id, course_table, reconcile=True):
         """
         批量更新用户的课表
         course_table: 课程对象列表，格式与前端 CourseTable 一致
+        reconcile=True 时按自然键 (name, weekType) 与现有课表比对，只执行必要的插入/更新/删除；
+        reconcile=False 时删除全部课表后重新插入。
+        返回 {"inserted", "updated", "deleted", "unchanged"} 计数，失败（包括时间索引不在 0-83）返回 False。
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
+        try:
+            incoming = [
+                {
+                    "name": course.get('name', ''),
+                    "teacher": course.get('teacher', ''),
+                    "location": course.get('location', ''),
+                    "week_type": course.get('weekType', 0),
+                    "slots": pack_slots([_as_int(t) for t in course.get('times', [])]),
+                }
+                for course in course_table
+            ]
+        except ValueError as e:
+            print(f"更新课表失败: {e}")
+            return False
         try:
             with conn:
-                # 先删除用户的所有现有课表（会级联删除上课时间）
-                cursor.execute("DELETE FROM course_schedules WHERE user_id = ?", (user_id,))
-                
-                # 批量插入新课表
-                for course in course_table:
-                    cursor.execute(
-                        "INSERT INTO course_schedules (name, teacher, location, week_type, user_id) VALUES (?, ?, ?, ?, ?)",
-                        (
-                            course.get('name', ''),
-                            course.get('teacher', ''),
-                            course.get('location', ''),
-                            course.get('weekType', 0),
-                            user_id
-                        )
+                cursor.execute(
+                    "SELECT id, name, teacher, location, week_type, slots_lo, slots_hi "
+                    "FROM course_schedules WHERE user_id = ? ORDER BY id",
+                    (user_id,)
+                )
+                existing = [dict(row) for row in cursor.fetchall()]
+
+                if reconcile:
+                    matched, to_insert, to_delete = _reconcile(
+                        existing,
+                        incoming,
+                        key=lambda c: (_as_text(c['name']), _as_int(c['week_type'])),
                     )
-                    schedule_id = cursor.lastrowid
-                    
-                    # 插入上课时间
-                    for time_index in course.get('times', []):
-                        cursor.execute(
-                            "INSERT INTO course_schedule_times (course_schedule_id, time_index) VALUES (?, ?)",
-                            (schedule_id, time_index)
-                        )
-                
-                return True
+                    # 上课时间是两个整数，直接和教师、地点一起比较
+                    to_update = [
+                        (new['teacher'], new['location'], *new['slots'], old['id'])
+                        for old, new in matched
+                        if (old['teacher'], old['location'], old['slots_lo'], old['slots_hi'])
+                        != (_as_text(new['teacher']), _as_text(new['location']), *new['slots'])
+                    ]
+                else:
+                    matched, to_insert, to_delete = [], incoming, existing
+                    to_update = []
+
+                cursor.executemany(
+                    "DELETE FROM course_schedules WHERE id = ?", [(row['id'],) for row in to_delete]
+                )
+                cursor.executemany(
+                    "UPDATE course_schedules SET teacher = ?, location = ?, slots_lo = ?, slots_hi = ? WHERE id = ?",
+                    to_update,
+                )
+                cursor.executemany(
+                    "INSERT INTO course_schedules (name, teacher, location, week_type, slots_lo, slots_hi, user_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (course['name'], course['teacher'], course['location'], course['week_type'], *course['slots'], user_id)
+                        for course in to_insert
+                    ],
+                )
+
+                return {
+                    "inserted": len(to_insert),
+                    "updated": len(to_update),
+                    "deleted": len(to_delete),
+                    "unchanged": len(matched) - len(to_update),
+                }
         except sqlite3.Error as e:
             print(f"更新课表时发生数据库错误: {e}")
             return False
 
+    @_with_connection
     def _get_course_schedule_by_id(self, schedule_id):
         """
         根据ID获取课程表信息（内部方法）
         """
         conn = self.get_db_connection()
         cursor = conn.cursor()
-        
-        # 获取课程表基本信息
         cursor.execute("SELECT * FROM course_schedules WHERE id = ?", (schedule_id,))
         schedule = cursor.fetchone()
-        
-        if not schedule:
+        return _schedule_item(schedule) if schedule else None
+
+    def export_user(self, user_id):
+        """
+        导出用户的全部数据，返回逐条产出记录（dict）的生成器；用户不存在时返回 None。
+        记录依次为 header、users、courses、notes、tasks、link_categories、useful_links、course_schedules，
+        子表通过原 id（course_id、category_id）引用父表。
+        """
+        if self.get_user(user_id) is None:
+            return None
+        return self._export_records(user_id)
+
+    def _export_records(self, user_id):
+        # 响应体在视图函数返回后才被消费，生成器单独占用一个连接直到结束（或被关闭）；
+        # 全部查询在同一个读事务内，导出的是同一时刻的快照。逐行迭代游标，内存占用与数据量无关
+        conn = self._pool.acquire()
+        try:
+            conn.execute("BEGIN")
+            yield {
+                "type": "header",
+                "format": EXPORT_FORMAT,
+                "version": EXPORT_VERSION,
+                "schemaVersion": schema_version(conn),
+                "exportedAt": int(time.time()),
+            }
+            user = conn.execute(
+                "SELECT id, username, email, password FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+            if user is None:
+                return
+            yield {"type": "users", **dict(user)}
+            for table, columns in EXPORT_COLUMNS.items():
+                extra = ", slots_lo, slots_hi" if table == "course_schedules" else ""
+                cursor = conn.execute(
+                    f"SELECT id, {', '.join(columns)}{extra} FROM {table} WHERE user_id = ? ORDER BY id",
+                    (user_id,),
+                )
+                for row in cursor:
+                    record = {"type": table, "id": row["id"], **{column: row[column] for column in columns}}
+                    if extra:
+                        record["times"] = unpack_slots(row["slots_lo"], row["slots_hi"])
+                    yield record
+        finally:
+            self._pool.release(conn)
+
+    @_writes
+    def import_user(self, records, user_id=None, blobs=None):
+        """
+        导入 export_user 产生的记录（可迭代对象，逐条消费，每 BULK_CHUNK_SIZE 条写入一次）
+        user_id 为 None 时按 users 记录新建用户，否则导入到已有用户名下（忽略 users 记录）
+        课程、链接分类分配新的 id，笔记、链接按原 id 映射到新 id
+        blobs 为随本次导入上传并已写入存储的文件 {sha256: size}；笔记的 blob_sha256 只有在其中，
+        或已被该用户的笔记引用时才保留，否则清空（计入 "missing_blobs"），不能借导入引用别人的文件
+        全部记录在一个事务内写入，记录应已读入本地（见 transfer.spool_records），
+        不要直接传入请求体的流式解析；返回 {"userId", 各表导入的行数, "missing_blobs"}，
+        用户名/邮箱或课程名与现有数据冲突时返回 None，记录格式错误时抛出 ValueError
+        """
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        blobs = blobs or {}
+        own_blobs = set()
+        if user_id is not None:
+            own_blobs = {
+                row["blob_sha256"]
+                for row in cursor.execute(
+                    "SELECT DISTINCT n.blob_sha256 FROM notes n JOIN blobs b ON b.sha256 = n.blob_sha256 "
+                    "WHERE n.user_id = ? AND b.size IS NOT NULL",
+                    (user_id,),
+                )
+            }
+        counts = {table: 0 for table in EXPORT_COLUMNS}
+        missing_blobs = 0
+        id_maps = {parent: {} for parent in PARENT_COLUMNS.values()}
+        now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        pending_table, pending = None, []
+
+        def flush():
+            if not pending:
+                return
+            columns = list(pending[0][1]) + ["user_id"]
+            values = [tuple(row.values()) + (user_id,) for _, row in pending]
+            if pending_table in id_maps:
+                # 父表需要新 id 来映射子表的引用
+                created = _insert_returning(cursor, pending_table, columns, values)
+                for (old_id, _), new_row in zip(pending, created):
+                    id_maps[pending_table][old_id] = new_row["id"]
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {pending_table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})",
+                    values,
+                )
+            counts[pending_table] += len(pending)
+            pending.clear()
+
+        try:
+            with conn:
+                for record in records:
+                    kind = record.get("type")
+                    if kind == "header":
+                        if record.get("format") != EXPORT_FORMAT or record.get("version") != EXPORT_VERSION:
+                            raise ValueError("不支持的导出格式或版本")
+                        continue
+                    if kind == "users":
+                        if user_id is None:
+                            if not all(record.get(field) for field in ("username", "email", "password")):
+                                raise ValueError("users 记录缺少 username、email 或 password")
+                            cursor.execute(
+                                "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                                (record.get("username"), record.get("email"), record.get("password")),
+                            )
+                            user_id = cursor.lastrowid
+                        continue
+                    if kind not in EXPORT_COLUMNS:
+                        raise ValueError(f"未知的记录类型: {kind}")
+                    if user_id is None:
+                        raise ValueError("users 记录必须在其他数据之前")
+                    if kind != pending_table or len(pending) >= BULK_CHUNK_SIZE:
+                        flush()
+                        pending_table = kind
+                    old_id, row = _import_row(kind, record, id_maps, now)
+                    digest = row.get("blob_sha256")
+                    if digest is not None and digest not in blobs and digest not in own_blobs:
+                        row["blob_sha256"] = None
+                        missing_blobs += 1
+                    pending.append((old_id, row))
+                flush()
+                if user_id is None:
+                    raise ValueError("缺少 users 记录")
+                _record_blob_sizes(cursor, [{"sha256": digest, "size": size} for digest, size in blobs.items()])
+                return {"userId": user_id, **counts, "missing_blobs": missing_blobs}
+        except sqlite3.IntegrityError as e:
+            print(f"导入数据与现有数据冲突: {e}")
             return None
-        
-        schedule_dict = dict(schedule)
-        
-        # 获取上课时间
-        cursor.execute(
-            "SELECT time_index FROM course_schedule_times WHERE course_schedule_id = ? ORDER BY time_index",
-            (schedule_id,)
-        )
-        times = [row['time_index'] for row in cursor.fetchall()]
-        
-        return {
-            "id": schedule_dict['id'],
-            "name": schedule_dict['name'],
-            "teacher": schedule_dict['teacher'] or "",
-            "location": schedule_dict['location'] or "",
-            "weekType": schedule_dict['week_type'],
-            "times": times
-        }
-    
-    
\ No newline at end of file
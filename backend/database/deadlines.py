@@ -0,0 +1,73 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+# 教学网上的时间都是北京时间，不带时区的字符串按 UTC+8 解析
+LOCAL_TZ = timezone(timedelta(hours=8))
+
+_DATETIME_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d %H:%M",
+    "%Y年%m月%d日 %H:%M:%S",
+    "%Y年%m月%d日 %H:%M",
+)
+_DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y年%m月%d日")
+# 表示“没有截止时间”的文本（LLM 清洗结果里常见 None/null）
+_EMPTY_VALUES = ("", "none", "null")
+# deadline_at 存为 SQLite INTEGER（64 位有符号）
+_MAX_TIMESTAMP = 2 ** 63 - 1
+
+
+def parse_deadline(value):
+    """
+    把截止时间解析为 Unix 时间戳（秒）。
+    支持 ISO 8601 以及常见的 "YYYY-MM-DD HH:MM[:SS]"、"YYYY/MM/DD"、"YYYY年MM月DD日" 写法；
+    只有日期时视为当天 23:59:59。空值、"None" 或无法识别的格式返回 None。
+    数值按时间戳处理，NaN、Infinity（JSON 中可以出现）或超出 SQLite 整数范围时抛出 ValueError。
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        if not (math.isfinite(value) and -_MAX_TIMESTAMP <= value <= _MAX_TIMESTAMP):
+            raise ValueError(f"截止时间不是合法的时间戳: {value!r}")
+        return int(value)
+    text = str(value).strip()
+    if text.lower() in _EMPTY_VALUES:
+        return None
+
+    parsed = None
+    for fmt in _DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(text, fmt).replace(hour=23, minute=59, second=59)
+            break
+        except ValueError:
+            continue
+    if parsed is None:
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            for fmt in _DATETIME_FORMATS:
+                try:
+                    parsed = datetime.strptime(text, fmt)
+                    break
+                except ValueError:
+                    continue
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=LOCAL_TZ)
+    return int(parsed.timestamp())
+
+
+def deadline_columns(value):
+    """
+    返回写入 tasks 表的 (deadline 原文, deadline_at, has_deadline)。
+    没有截止时间时原文存空字符串，deadline_at 为 NULL，has_deadline 为 0。
+    """
+    deadline_at = parse_deadline(value)
+    if value is None or (isinstance(value, str) and value.strip().lower() in _EMPTY_VALUES):
+        text = ""
+    else:
+        text = str(value)
+    return text, deadline_at, int(deadline_at is not None)
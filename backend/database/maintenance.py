@@ -0,0 +1,284 @@
+"""
+SQLite 定期维护。
+一轮维护依次执行 PRAGMA optimize、分批清理孤儿行和过期的上传会话、合并全文索引、
+WAL 检查点和增量 vacuum，每步都有耗时统计；应用内按 db_maintenance_interval_s 定时执行，
+命令行 python -m database.maintenance 立即执行一轮。
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .database import BUSY_TIMEOUT_MS, DB_FILE
+
+# 定时维护的间隔（秒），0 表示不开启
+MAINTENANCE_INTERVAL_S = float(os.getenv("db_maintenance_interval_s", "0"))
+# 每批删除的孤儿行数 / 每步 incremental_vacuum 释放的页数
+MAINTENANCE_BATCH = int(os.getenv("db_maintenance_batch", "500"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("db_maintenance_vacuum_pages", "256"))
+# 批与批之间的停顿（毫秒），让请求的写操作插进来
+MAINTENANCE_PAUSE_MS = float(os.getenv("db_maintenance_pause_ms", "20"))
+# 单次维护的时间预算（秒），超出后剩余的清理留到下一次
+MAINTENANCE_BUDGET_S = float(os.getenv("db_maintenance_budget_s", "5"))
+
+# (子表, 外键列, 父表)：子表中外键指向不存在的父行即为孤儿。
+# 旧版本的连接没有开启 foreign_keys，ON DELETE CASCADE 没有生效，留下了这些行；
+# 父表排在前面，删除孤儿课程/分类时级联删除其下的笔记/链接
+ORPHAN_CHECKS = (
+    ("courses", "user_id", "users"),
+    ("link_categories", "user_id", "users"),
+    ("notes", "user_id", "users"),
+    ("notes", "course_id", "courses"),
+    ("useful_links", "user_id", "users"),
+    ("useful_links", "category_id", "link_categories"),
+    ("tasks", "user_id", "users"),
+    ("course_schedules", "user_id", "users"),
+)
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _connect(db_path):
+    # 独立的自动提交连接：每条语句自成事务，持锁时间只有一批
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+class _UploadSessions:
+    """通过维护连接删除过期的上传会话，供 BlobStore.collect_uploads 使用（与 Database.purge_uploads 相同）。"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def purge_uploads(self, before):
+        rows = self.conn.execute(
+            "DELETE FROM upload_sessions WHERE updated_at < ? RETURNING id", (int(before),)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+class Maintenance:
+    """
+    对一个数据库文件执行一轮维护，run_once() 返回各步骤的结果与耗时。
+    写操作分成小批，批间停顿 pause_ms；超过 budget_s 后跳过剩余的孤儿清理和 vacuum。
+    给出 blob_store 时同时回收超过 upload_ttl_s 秒未活动的可续传上传会话及其临时文件。
+    """
+
+    def __init__(
+        self, db_path, batch_size=None, vacuum_pages=None, pause_ms=None, budget_s=None,
+        blob_store=None, upload_ttl_s=None,
+    ):
+        self.db_path = Path(db_path)
+        self.blob_store = blob_store
+        self.upload_ttl_s = upload_ttl_s
+        self.batch_size = MAINTENANCE_BATCH if batch_size is None else batch_size
+        self.vacuum_pages = MAINTENANCE_VACUUM_PAGES if vacuum_pages is None else vacuum_pages
+        self.pause = (MAINTENANCE_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+        self.budget_s = MAINTENANCE_BUDGET_S if budget_s is None else budget_s
+
+    def _pause(self):
+        if self.pause:
+            time.sleep(self.pause)
+
+    def optimize(self, conn):
+        """从未分析过时完整 ANALYZE 一次，之后由 PRAGMA optimize 按需更新统计信息。"""
+        analyzed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone() is not None
+        conn.execute("PRAGMA optimize" if analyzed else "ANALYZE")
+        return {"analyze": not analyzed}
+
+    def purge_orphans(self, conn, deadline):
+        """分批删除孤儿行，返回 {"deleted": {表: 行数}, "complete": 是否已全部清理}。"""
+        deleted = {}
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table, column, parent in ORPHAN_CHECKS:
+            # 尚未迁移的旧库可能缺少部分表
+            while table in tables and parent in tables:
+                if time.monotonic() >= deadline:
+                    return {"deleted": deleted, "complete": False}
+                cursor = conn.execute(
+                    f"""
+                    DELETE FROM {table} WHERE id IN (
+                        SELECT id FROM {table} AS child
+                        WHERE NOT EXISTS (SELECT 1 FROM {parent} WHERE id = child.{column})
+                        LIMIT ?
+                    )
+                """,
+                    (self.batch_size,),
+                )
+                if cursor.rowcount > 0:
+                    deleted[table] = deleted.get(table, 0) + cursor.rowcount
+                if cursor.rowcount < self.batch_size:
+                    break
+                self._pause()
+        return {"deleted": deleted, "complete": True}
+
+    def collect_uploads(self, conn):
+        """删除过期的上传会话及其临时文件；未配置 blob_store 或库中没有会话表时跳过。"""
+        if self.blob_store is None or conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'upload_sessions'"
+        ).fetchone() is None:
+            return {"skipped": True}
+        return {"skipped": False, **self.blob_store.collect_uploads(_UploadSessions(conn), self.upload_ttl_s)}
+
+    def optimize_search_index(self, conn):
+        """合并全文索引的 b-tree 段。"""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'").fetchone() is None:
+            return {"skipped": True}
+        conn.execute("INSERT INTO search_index(search_index) VALUES ('optimize')")
+        return {"skipped": False}
+
+    def checkpoint(self, conn):
+        """PASSIVE 检查点：不等待读写，把能写回的 WAL 帧写回主库。"""
+        busy, log, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        return {"busy": bool(busy), "log_frames": log, "checkpointed_frames": checkpointed}
+
+    def incremental_vacuum(self, conn, deadline):
+        """每次释放 vacuum_pages 个空闲页，直到没有空闲页或时间用完。"""
+        if _pragma(conn, "auto_vacuum") != AUTO_VACUUM_INCREMENTAL:
+            return {"enabled": False, "freelist": _pragma(conn, "freelist_count")}
+        before = _pragma(conn, "freelist_count")
+        free = before
+        while free and time.monotonic() < deadline:
+            conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+            free = _pragma(conn, "freelist_count")
+            if free:
+                self._pause()
+        return {"enabled": True, "pages_freed": before - free, "freelist": free}
+
+    def run_once(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.budget_s
+        conn = _connect(self.db_path)
+        try:
+            page_size = _pragma(conn, "page_size")
+            pages_before = _pragma(conn, "page_count")
+            tasks = {}
+            steps = (
+                ("optimize", lambda: self.optimize(conn)),
+                ("orphans", lambda: self.purge_orphans(conn, deadline)),
+                ("uploads", lambda: self.collect_uploads(conn)),
+                ("search_index", lambda: self.optimize_search_index(conn)),
+                ("checkpoint", lambda: self.checkpoint(conn)),
+                ("vacuum", lambda: self.incremental_vacuum(conn, deadline)),
+            )
+            for name, step in steps:
+                step_start = time.perf_counter()
+                tasks[name] = step()
+                tasks[name]["seconds"] = round(time.perf_counter() - step_start, 3)
+                self._pause()
+            # 首次 ANALYZE 新建的 sqlite_stat1 会让文件变大，不计为负数
+            pages_reclaimed = max(0, pages_before - _pragma(conn, "page_count"))
+        finally:
+            conn.close()
+        return {
+            "path": str(self.db_path),
+            "pages_reclaimed": pages_reclaimed,
+            "bytes_reclaimed": pages_reclaimed * page_size,
+            "seconds": round(time.perf_counter() - start, 3),
+            "tasks": tasks,
+        }
+
+
+def enable_incremental_vacuum(db_path):
+    """
+    把已有数据库切换到 auto_vacuum=INCREMENTAL。需要一次完整的 VACUUM，
+    期间独占数据库，只应在停机维护时执行；新建的数据库由连接池直接以该模式创建。
+    """
+    conn = _connect(db_path)
+    try:
+        if _pragma(conn, "auto_vacuum") == AUTO_VACUUM_INCREMENTAL:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+class MaintenanceScheduler:
+    """后台定时维护线程：每 interval 秒对 db_path 执行一轮 Maintenance，stats() 查看最近结果。"""
+
+    def __init__(self, db_path, interval, **options):
+        self.maintenance = Maintenance(db_path, **options)
+        self.interval = float(interval)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "failures": 0, "pages_reclaimed": 0, "seconds": 0.0, "last": None, "last_error": None}
+        self._thread = threading.Thread(target=self._run, name="sqlite-maintenance", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def run_once(self):
+        """立即执行一轮维护，返回结果；失败时记录错误并返回 None。"""
+        try:
+            report = self.maintenance.run_once()
+        except sqlite3.Error as e:
+            print(f"数据库维护失败: {e}")
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["failures"] += 1
+                self._stats["last_error"] = {"error": str(e), "at": time.time()}
+            return None
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["pages_reclaimed"] += report["pages_reclaimed"]
+            self._stats["seconds"] = round(self._stats["seconds"] + report["seconds"], 3)
+            self._stats["last"] = {**report, "at": time.time()}
+        return report
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {"path": str(self.maintenance.db_path), "interval_s": self.interval, **self._stats}
+
+
+def start_scheduler(db_path, interval=None, blob_store=None):
+    """按环境变量 db_maintenance_interval_s 启动定时维护；未开启时返回 None。"""
+    interval = MAINTENANCE_INTERVAL_S if interval is None else interval
+    if interval <= 0:
+        return None
+    return MaintenanceScheduler(db_path, interval, blob_store=blob_store).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="先执行一次完整 VACUUM，把数据库切换到 auto_vacuum=INCREMENTAL（需停机）",
+    )
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        print("auto_vacuum=INCREMENTAL " + ("enabled" if enable_incremental_vacuum(args.db) else "already enabled"))
+    report = Maintenance(args.db, pause_ms=0, budget_s=float("inf")).run_once()
+    for name, result in report["tasks"].items():
+        details = ", ".join(f"{k}={v}" for k, v in result.items() if k != "seconds")
+        print(f"{name:<13}{result['seconds']:>8.3f}s  {details}")
+    print(f"reclaimed {report['pages_reclaimed']} pages ({report['bytes_reclaimed']} bytes) in {report['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import bisect
+import collections
+import sqlite3
+import threading
+import time
+
+from .pool import RetryingCursor
+
+# 延迟直方图的桶上界（毫秒），最后一个桶收集所有更慢的语句
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _normalize(sql):
+    return " ".join(sql.split())
+
+
+class InstrumentedCursor(RetryingCursor):
+    """
+    记录每条语句耗时与行数的游标，仅在开启统计时使用。
+    耗时为 execute 本身（SQLite 执行到第一行结果）的时间；
+    SELECT 的行数在 fetchone/fetchmany/fetchall 时累加，逐行迭代游标不计入。
+    """
+
+    _metrics_key = None
+
+    def execute(self, sql, parameters=()):
+        metrics = self.connection._pool.metrics
+        start = time.perf_counter()
+        result = super().execute(sql, parameters)
+        self._metrics_key = metrics.observe(
+            self.connection, sql, parameters, time.perf_counter() - start, self.rowcount
+        )
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        metrics = self.connection._pool.metrics
+        start = time.perf_counter()
+        result = super().executemany(sql, seq_of_parameters)
+        self._metrics_key = metrics.observe(
+            self.connection, sql, None, time.perf_counter() - start, self.rowcount
+        )
+        return result
+
+    def _count_rows(self, rows):
+        if self._metrics_key is not None and rows:
+            self.connection._pool.metrics.add_rows(self._metrics_key, rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count_rows(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count_rows(len(rows))
+        return rows
+
+
+class QueryMetrics:
+    """
+    按语句（空白归一化后的 SQL 文本）聚合的查询统计。
+    - 每条语句：执行次数、总/最大耗时、行数、延迟直方图
+    - 超过 slow_ms 的语句连同 EXPLAIN QUERY PLAN 打印出来，并保留最近 max_slow 条
+    - start_scope/end_scope 统计当前线程在一个作用域（例如一次 HTTP 请求）内的查询数
+    """
+
+    cursor_factory = InstrumentedCursor
+
+    def __init__(self, slow_ms=100.0, max_slow=50):
+        self.slow_ms = float(slow_ms)
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._slow = collections.deque(maxlen=max_slow)
+        self._local = threading.local()
+
+    def observe(self, conn, sql, parameters, elapsed, rowcount):
+        """记录一次执行，返回该语句的统计键。"""
+        key = _normalize(sql)
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = {
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "rows": 0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                }
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            # INSERT/UPDATE/DELETE 的影响行数；SELECT 的 rowcount 为 -1，行数在 fetch 时累加
+            if rowcount > 0:
+                entry["rows"] += rowcount
+            entry["buckets"][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope["queries"] += 1
+            scope["time_ms"] += elapsed_ms
+        if elapsed_ms >= self.slow_ms:
+            self._log_slow(conn, key, sql, parameters, elapsed_ms)
+        return key
+
+    def add_rows(self, key, rows):
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is not None:
+                entry["rows"] += rows
+
+    def _log_slow(self, conn, key, sql, parameters, elapsed_ms):
+        plan = []
+        if parameters is not None:
+            try:
+                # 直接调用 sqlite3.Connection.execute，避免 EXPLAIN 本身再被统计
+                plan = [
+                    row[-1]
+                    for row in sqlite3.Connection.execute(
+                        conn, f"EXPLAIN QUERY PLAN {sql}", parameters
+                    ).fetchall()
+                ]
+            except sqlite3.Error:
+                pass
+        with self._lock:
+            self._slow.append(
+                {"sql": key, "ms": round(elapsed_ms, 3), "plan": plan, "at": time.time()}
+            )
+        print(f"慢查询 {elapsed_ms:.1f}ms: {key}")
+        for line in plan:
+            print(f"    {line}")
+
+    def start_scope(self):
+        """开始统计当前线程的查询数（例如在请求开始时调用）。"""
+        self._local.scope = {"queries": 0, "time_ms": 0.0}
+
+    def end_scope(self):
+        """结束当前线程的统计，返回 {"queries", "time_ms"}；未开始时返回 None。"""
+        scope = getattr(self._local, "scope", None)
+        self._local.scope = None
+        return scope
+
+    def snapshot(self):
+        """按总耗时降序返回各语句的统计，以及最近的慢查询。"""
+        bounds = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            statements = [
+                {
+                    "sql": sql,
+                    "count": entry["count"],
+                    "total_ms": round(entry["total_ms"], 3),
+                    "avg_ms": round(entry["total_ms"] / entry["count"], 3),
+                    "max_ms": round(entry["max_ms"], 3),
+                    "rows": entry["rows"],
+                    "histogram": dict(zip(bounds, entry["buckets"])),
+                }
+                for sql, entry in self._statements.items()
+            ]
+            slow = list(self._slow)
+        statements.sort(key=lambda s: s["total_ms"], reverse=True)
+        return {"slow_ms": self.slow_ms, "statements": statements, "slow_queries": slow}
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
@@ -0,0 +1,587 @@
+"""
+数据库 schema 迁移。
+修改表结构时在下面用 @migration(下一个版本号, "说明") 注册一个新函数，
+不要改动已经发布的迁移；已应用的版本记录在 schema_version 表中。
+"""
+
+import sqlite3
+
+from .deadlines import parse_deadline
+from .slots import HALF_BITS, SLOT_COUNT
+
+# 全文检索的数据来源：kind -> (编号, 表名, 标题表达式, 正文表达式)
+# 索引行的 rowid = 原表 id * 4 + 编号，触发器可以按 rowid 直接定位并删除旧条目
+SEARCH_SOURCES = {
+    "course": (
+        0,
+        "courses",
+        "{row}.title",
+        "coalesce((SELECT group_concat(value, ' ') FROM json_each("
+        "CASE WHEN json_valid({row}.tags) THEN {row}.tags ELSE '[]' END)), '')",
+    ),
+    "note": (1, "notes", "{row}.name", "coalesce({row}.file, '')"),
+    "task": (2, "tasks", "{row}.name", "coalesce({row}.message, '') || ' ' || {row}.deadline"),
+    "link": (3, "useful_links", "{row}.name", "coalesce({row}.description, '') || ' ' || {row}.url"),
+}
+
+# 已注册的迁移：[(版本号, 说明, 函数)]，按版本号递增
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """注册一个迁移步骤。版本号必须连续递增，步骤本身应当可以重复执行。"""
+
+    def register(step):
+        expected = len(MIGRATIONS) + 1
+        if version != expected:
+            raise ValueError(f"迁移版本号应为 {expected}，实际为 {version}")
+        MIGRATIONS.append((version, description, step))
+        return step
+
+    return register
+
+
+@migration(1, "基础表结构")
+def _base_schema(cursor):
+    # 创建用户表
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+    """
+    )
+
+    # 创建课程表
+    # cursor.execute('''
+    # CREATE TABLE IF NOT EXISTS courses (
+    #    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    #    title TEXT NOT NULL
+    #    )
+    #''')
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            tags TEXT, -- 存储JSON格式的标签列表，例如: '["基础", "必修"]'
+            user_id INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """
+    )
+    # 索引
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_courses_title ON courses(title)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_courses_user_id ON courses(user_id)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_courses_user_title ON courses(user_id, title)
+    """
+    )
+
+    # 创建笔记表
+    # cursor.execute('''
+    #    CREATE TABLE IF NOT EXISTS notes (
+    #        id INTEGER PRIMARY KEY AUTOINCREMENT,
+    #        content TEXT,
+    #        user_id INTEGER NOT NULL,
+    #        course_id INTEGER,
+    #        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+    #        FOREIGN KEY (course_id) REFERENCES courses (id) ON DELETE SET NULL
+    #    )
+    #''')
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,      -- 对应 myNotes 中的 "name"
+            file TEXT,          -- 对应 myNotes 中的 "file"，允许为NULL
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (course_id) REFERENCES courses (id) ON DELETE CASCADE
+        )
+    """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_notes_user_id ON notes(user_id)
+    """
+    )
+
+    # 创建链接分类表
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS link_categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            icon TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            sort_order INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_link_categories_user_id ON link_categories(user_id)
+    """
+    )
+
+    # 创建链接表
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS useful_links (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            url TEXT NOT NULL,
+            description TEXT,
+            is_trusted BOOLEAN DEFAULT FALSE,
+            category_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            sort_order INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (category_id) REFERENCES link_categories (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_useful_links_user_id ON useful_links(user_id)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_useful_links_category_id ON useful_links(category_id)
+    """
+    )
+
+    # 创建任务管理表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,           -- 对应 deadlines 列表中的 name
+            deadline TEXT NOT NULL,       -- 截止日期时间字符串
+            message TEXT,                 -- 对应 message，允许为空
+            status TEXT DEFAULT 'pending', -- 状态: pending, completed, overdue 等
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_tasks_user_id ON tasks(user_id)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_tasks_deadline ON tasks(deadline)
+    """
+    )
+
+    # 初始化一个默认管理员用户（如果不存在）
+    cursor.execute(
+        "INSERT OR IGNORE INTO users (id, username, email, password) VALUES (1, 'admin', 'admin@example.com', 'adminpass')"
+    )
+    # 创建课表表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS course_schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,               -- 课程名称
+            teacher TEXT,                     -- 教师姓名
+            location TEXT,                    -- 上课地点
+            week_type INTEGER DEFAULT 0,      -- 周次类型：0-每周，1-单周，2-双周
+            user_id INTEGER NOT NULL,         -- 用户ID
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """)
+
+    # 创建上课时间表（多对多关系，因为一门课可能有多个上课时间）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS course_schedule_times (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_schedule_id INTEGER NOT NULL,  -- 课程表ID
+            time_index INTEGER NOT NULL,          -- 时间索引（0-83，对应一周的课程时间段）
+            FOREIGN KEY (course_schedule_id) REFERENCES course_schedules (id) ON DELETE CASCADE,
+            UNIQUE(course_schedule_id, time_index)  -- 确保同一门课同一时间不重复
+        )
+    """)
+
+    # 创建索引
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_course_schedules_user_id ON course_schedules(user_id)
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_course_schedule_times_course_id ON course_schedule_times(course_schedule_id)
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_course_schedule_times_time_index ON course_schedule_times(time_index)
+    """)
+
+
+@migration(2, "数据库实例标识与用户数据版本号")
+def _revisions(cursor):
+    # 数据库实例标识：数据库被清空重建后随之改变，避免旧的 ETag 与新数据的版本号碰撞
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    cursor.execute(
+        "INSERT OR IGNORE INTO db_meta (key, value) VALUES ('epoch', lower(hex(randomblob(8))))"
+    )
+
+    # 每个用户的数据版本号：用户名下任意数据变化都会使其加一，用于缓存失效
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_revisions (
+            user_id INTEGER PRIMARY KEY,
+            revision INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # 由触发器在同一事务内维护版本号，直接执行的 SQL 和级联删除同样生效
+    bump = """
+            INSERT INTO user_revisions (user_id, revision) SELECT {user_id}, 1 WHERE {user_id} IS NOT NULL{extra}
+            ON CONFLICT(user_id) DO UPDATE SET revision = revision + 1;"""
+    schedule_owner = "(SELECT user_id FROM course_schedules WHERE id = {row}.course_schedule_id)"
+    owners = {
+        "users": "{row}.id",
+        "courses": "{row}.user_id",
+        "notes": "{row}.user_id",
+        "tasks": "{row}.user_id",
+        "link_categories": "{row}.user_id",
+        "useful_links": "{row}.user_id",
+        "course_schedules": "{row}.user_id",
+        "course_schedule_times": schedule_owner,
+    }
+    for table, owner in owners.items():
+        for event, rows in (("INSERT", ["NEW"]), ("UPDATE", ["NEW", "OLD"]), ("DELETE", ["OLD"])):
+            body = "".join(
+                bump.format(
+                    user_id=owner.format(row=row),
+                    # UPDATE 时只有归属用户发生变化才需要再给旧用户加一
+                    extra=(
+                        f" AND {owner.format(row='OLD')} IS NOT {owner.format(row='NEW')}"
+                        if event == "UPDATE" and row == "OLD"
+                        else ""
+                    ),
+                )
+                for row in rows
+            )
+            cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_revision
+                AFTER {event} ON {table}
+                BEGIN{body}
+                END
+            """
+            )
+
+
+@migration(3, "全文检索索引")
+def _search_index(cursor):
+    # 全文检索索引：课程、笔记、任务和链接，由触发器保持同步
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")
+    search_index_exists = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            owner, title, body, tokenize = 'trigram'
+        )
+    """)
+    if not search_index_exists:
+        # 默认排序：bm25，owner 列不参与打分，标题权重是正文的 10 倍
+        cursor.execute(
+            "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0)')"
+        )
+    for kind, (code, table, title, body) in SEARCH_SOURCES.items():
+        insert = (
+            "INSERT INTO search_index (rowid, owner, title, body) VALUES "
+            f"({{row}}.id * 4 + {code}, '#' || {{row}}.user_id || '#', {title}, {body});"
+        )
+        delete = f"DELETE FROM search_index WHERE rowid = OLD.id * 4 + {code};"
+        for event, statements in (
+            ("INSERT", [insert.format(row="NEW")]),
+            ("UPDATE", [delete, insert.format(row="NEW")]),
+            ("DELETE", [delete]),
+        ):
+            cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_search
+                AFTER {event} ON {table}
+                BEGIN
+                    {' '.join(statements)}
+                END
+            """
+            )
+        if not search_index_exists:
+            # 首次创建索引时，把已有数据补进去
+            cursor.execute(
+                "INSERT INTO search_index (rowid, owner, title, body) "
+                f"SELECT id * 4 + {code}, '#' || user_id || '#', "
+                f"{title.format(row=table)}, {body.format(row=table)} FROM {table}"
+            )
+
+
+@migration(4, "键集分页使用的复合索引")
+def _pagination_indexes(cursor):
+    # 普通表的索引末尾隐含 rowid（即 id），(user_id, deadline) 实际就是 (user_id, deadline, id)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_user_deadline ON tasks(user_id, deadline)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_notes_course_id ON notes(course_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_useful_links_user_order "
+        "ON useful_links(user_id, sort_order, created_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_useful_links_category_order "
+        "ON useful_links(category_id, sort_order, created_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_course_schedules_user_name "
+        "ON course_schedules(user_id, name)"
+    )
+    # 以下索引是上面新索引的前缀，不再需要
+    for index in (
+        "ix_tasks_user_id",
+        "ix_useful_links_user_id",
+        "ix_useful_links_category_id",
+        "ix_course_schedules_user_id",
+    ):
+        cursor.execute(f"DROP INDEX IF EXISTS {index}")
+
+
+@migration(5, "任务截止时间存为带索引的时间戳")
+def _typed_deadlines(cursor):
+    cursor.execute("PRAGMA table_info(tasks)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if "deadline_at" not in columns:
+        # Unix 时间戳（秒），没有截止时间时为 NULL
+        cursor.execute("ALTER TABLE tasks ADD COLUMN deadline_at INTEGER")
+    if "has_deadline" not in columns:
+        cursor.execute("ALTER TABLE tasks ADD COLUMN has_deadline INTEGER NOT NULL DEFAULT 0")
+
+    # 旧数据里 /cloud 写入的 "None" 字面量改为空字符串
+    cursor.execute("UPDATE tasks SET deadline = '' WHERE lower(trim(deadline)) IN ('none', 'null')")
+    cursor.execute("SELECT id, deadline FROM tasks")
+    parsed = [(parse_deadline(row[1]), row[0]) for row in cursor.fetchall()]
+    cursor.executemany(
+        "UPDATE tasks SET deadline_at = ?1, has_deadline = ?1 IS NOT NULL WHERE id = ?2",
+        parsed,
+    )
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_user_due ON tasks(user_id, has_deadline, deadline_at)"
+    )
+    # 文本 deadline 上的索引不再用于排序和范围查询
+    cursor.execute("DROP INDEX IF EXISTS ix_tasks_user_deadline")
+    cursor.execute("DROP INDEX IF EXISTS ix_tasks_deadline")
+
+
+@migration(6, "上课时间改为课程表上的 84 位时间段掩码")
+def _slot_masks(cursor):
+    cursor.execute("PRAGMA table_info(course_schedules)")
+    columns = {row[1] for row in cursor.fetchall()}
+    # 时间段 0-41 存在 slots_lo，42-83 存在 slots_hi（第 i 位表示 time_index = i 或 42 + i）
+    for column in ("slots_lo", "slots_hi"):
+        if column not in columns:
+            cursor.execute(
+                f"ALTER TABLE course_schedules ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"
+            )
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'course_schedule_times'")
+    if cursor.fetchone() is None:
+        return
+    # (course_schedule_id, time_index) 唯一，按位求和即按位或
+    cursor.execute(
+        f"""
+        UPDATE course_schedules SET
+            slots_lo = (
+                SELECT coalesce(sum(1 << time_index), 0) FROM course_schedule_times
+                WHERE course_schedule_id = course_schedules.id
+                  AND time_index BETWEEN 0 AND {HALF_BITS - 1}
+            ),
+            slots_hi = (
+                SELECT coalesce(sum(1 << (time_index - {HALF_BITS})), 0) FROM course_schedule_times
+                WHERE course_schedule_id = course_schedules.id
+                  AND time_index BETWEEN {HALF_BITS} AND {SLOT_COUNT - 1}
+            )
+        WHERE id IN (SELECT course_schedule_id FROM course_schedule_times)
+    """
+    )
+    # 表上的索引和触发器随表一起删除
+    cursor.execute("DROP TABLE course_schedule_times")
+
+
+@migration(7, "分片模式的用户目录")
+def _user_shards(cursor):
+    # 只在分片模式的全局用户目录库中使用：记录每个用户的数据所在的分片
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+    """
+    )
+
+
+@migration(8, "按课程名、笔记名查找笔记的复合索引")
+def _note_lookup_index(cursor):
+    # /notes/files、/notes/file 按 (user_id, 课程, 笔记名) 定位一条笔记；
+    # ix_notes_user_id 保留，按 id 分页时仍要用它排序
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_notes_user_course_name ON notes(user_id, course_id, name)"
+    )
+
+
+@migration(9, "内容寻址存储：blobs 引用计数与 notes.blob_sha256")
+def _blobs(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    # 回收时查找引用计数为 0 的摘要
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_blobs_refcount ON blobs(refcount)")
+    cursor.execute("PRAGMA table_info(notes)")
+    if "blob_sha256" not in {row[1] for row in cursor.fetchall()}:
+        # 笔记文件内容的 SHA-256；NULL 表示文件仍按旧的 用户/课程/笔记 目录存放
+        cursor.execute("ALTER TABLE notes ADD COLUMN blob_sha256 TEXT")
+    # 引用计数由触发器维护，级联删除（删除用户、课程）同样会减少计数；
+    # 插入时不存在的 blobs 行由触发器创建，导入数据时无需先登记文件
+    increment = """
+        INSERT INTO blobs (sha256, refcount) SELECT NEW.blob_sha256, 1 WHERE NEW.blob_sha256 IS NOT NULL
+        ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1;"""
+    decrement = "UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.blob_sha256;"
+    for name, event, condition, statements in (
+        ("insert", "INSERT", "NEW.blob_sha256 IS NOT NULL", increment),
+        ("delete", "DELETE", "OLD.blob_sha256 IS NOT NULL", decrement),
+        ("update", "UPDATE OF blob_sha256", "OLD.blob_sha256 IS NOT NEW.blob_sha256", decrement + increment),
+    ):
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_notes_{name}_blob AFTER {event} ON notes
+            WHEN {condition}
+            BEGIN {statements} END
+        """
+        )
+
+
+@migration(10, "可续传上传：upload_sessions 与 upload_chunks")
+def _upload_sessions(cursor):
+    # 一次分块上传：文件先写到 blob 目录下的 uploads/<id>，完成后按摘要改名并创建笔记
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            lesson_name TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            tags TEXT,
+            size INTEGER NOT NULL,
+            sha256 TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """
+    )
+    # 回收长时间没有收到分块的会话
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_upload_sessions_updated ON upload_sessions(updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_upload_sessions_user_id ON upload_sessions(user_id)")
+    # 已写入的字节区间 [start_offset, end_offset)，相邻或重叠的区间在查询时合并
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_chunks (
+            session_id TEXT NOT NULL,
+            start_offset INTEGER NOT NULL,
+            end_offset INTEGER NOT NULL,
+            PRIMARY KEY (session_id, start_offset),
+            FOREIGN KEY (session_id) REFERENCES upload_sessions (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """
+    )
+
+
+@migration(11, "尚未迁移到内容寻址存储的笔记的部分索引")
+def _legacy_note_files_index(cursor):
+    # 旧目录迁移按 id 分批查找 blob_sha256 为空的笔记；迁移完成后索引几乎为空
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_notes_legacy_files ON notes(id) "
+        "WHERE blob_sha256 IS NULL AND file IS NOT NULL"
+    )
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def schema_version(conn):
+    """数据库当前的 schema 版本；全新的或迁移前的旧数据库返回 0。"""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        # schema_version 表不存在
+        return 0
+    return row[0] or 0
+
+
+def migrate(conn):
+    """
+    依次执行尚未应用的迁移，每个版本一个事务，返回本次应用的版本号列表。
+    多个进程同时启动时，后拿到写锁的进程会在事务内重新检查版本，不会重复执行。
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        with conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            if version <= schema_version(conn):
+                continue
+            step(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+        applied.append(version)
+    return applied
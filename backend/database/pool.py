@@ -0,0 +1,276 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """在 checkout 超时时间内没有可用连接。"""
+
+
+def _is_busy_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class RetryingCursor(sqlite3.Cursor):
+    """
+    遇到 SQLITE_BUSY / "database is locked" 时按指数退避重试语句的游标。
+    busy_timeout 已经覆盖了大部分等待场景，这里兜底处理 busy handler
+    不会介入的情况（例如 WAL 下的读升级写）。
+    """
+
+    def execute(self, sql, parameters=()):
+        return self.connection._pool._retry_busy(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.connection._pool._retry_busy(
+            super().executemany, sql, seq_of_parameters
+        )
+
+
+class PooledConnection(sqlite3.Connection):
+    """连接池创建的连接：游标统一使用连接池指定的 cursor_factory（默认 RetryingCursor）。"""
+
+    _pool = None
+    _file_id = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self._pool.cursor_factory)
+
+    # sqlite3.Connection.execute 不经过 cursor()，这里显式转发
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionPool:
+    """
+    针对单个 SQLite 文件的有界连接池。
+    - 最多同时打开 max_size 个连接，池满时等待至多 timeout 秒
+    - 每个新连接统一设置 WAL、synchronous=NORMAL、foreign_keys=ON、
+      busy_timeout 以及 cache/mmap 大小
+    - 数据库文件被删除或替换后，空闲连接会在下次 checkout 时被回收
+    - readonly=True 时以 mode=ro 打开，用于读写分离模式下的读连接
+    - 传入 metrics（QueryMetrics）时，游标换成记录耗时的 InstrumentedCursor
+    """
+
+    def __init__(
+        self,
+        db_path,
+        max_size=8,
+        timeout=10.0,
+        busy_timeout_ms=5000,
+        cache_size_kib=8192,
+        mmap_size=64 * 1024 * 1024,
+        busy_retries=3,
+        readonly=False,
+        connection_factory=PooledConnection,
+        metrics=None,
+    ):
+        self.db_path = Path(db_path)
+        self.max_size = max(1, int(max_size))
+        self.timeout = float(timeout)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.cache_size_kib = int(cache_size_kib)
+        self.mmap_size = int(mmap_size)
+        self.busy_retries = int(busy_retries)
+        self.readonly = readonly
+        self.connection_factory = connection_factory
+        self.metrics = metrics
+        self.cursor_factory = metrics.cursor_factory if metrics is not None else RetryingCursor
+
+        self._idle = collections.deque()
+        self._size = 0
+        self._closed = False
+        # 通过 get_pool 取得该池、尚未调用 close_pool 的持有者数
+        self._owners = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "busy_retries": 0,
+            "created": 0,
+            "recycled": 0,
+        }
+
+    def _current_file_id(self):
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def _connect(self):
+        if self.readonly:
+            target, uri = self.db_path.as_uri() + "?mode=ro", True
+        else:
+            target, uri = str(self.db_path), False
+        conn = sqlite3.connect(
+            target,
+            timeout=self.busy_timeout_ms / 1000,
+            uri=uri,
+            check_same_thread=False,
+            isolation_level="IMMEDIATE",
+            factory=self.connection_factory,
+        )
+        conn._pool = self
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+        if not self.readonly:
+            # 只对新建的空库生效（必须在建表之前设置），使定时维护可以用 incremental_vacuum 归还空闲页
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        # 负数表示以 KiB 为单位
+        conn.execute(f"PRAGMA cache_size = -{self.cache_size_kib}")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        return conn
+
+    def _discard_idle(self):
+        """关闭所有空闲连接（调用方需持有锁）。"""
+        while self._idle:
+            conn = self._idle.pop()
+            self._size -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def acquire(self, timeout=None):
+        """取出一个连接；池满时最多等待 timeout 秒，超时抛出 PoolTimeout。"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        # 数据库文件被删除/替换后，旧连接指向的是失效的文件，需要回收
+        file_id = self._current_file_id()
+        with self._cond:
+            waited = False
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("连接池已关闭")
+                while self._idle:
+                    conn = self._idle.pop()
+                    if conn._file_id == file_id:
+                        self._stats["checkouts"] += 1
+                        return conn
+                    self._size -= 1
+                    self._stats["recycled"] += 1
+                    conn.close()
+                if self._size < self.max_size:
+                    break
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"等待数据库连接超时（{timeout}s，池大小 {self.max_size}）"
+                    )
+                self._cond.wait(remaining)
+            self._size += 1
+            self._stats["checkouts"] += 1
+            self._stats["created"] += 1
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        conn._file_id = self._current_file_id()
+        return conn
+
+    def release(self, conn):
+        """归还连接；未提交的事务会被回滚。"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # 连接已损坏，直接丢弃
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        """关闭全部空闲连接，之后不再发放新连接。"""
+        with self._cond:
+            self._closed = True
+            self._discard_idle()
+            self._cond.notify_all()
+
+    def _retry_busy(self, func, *args):
+        delay = 0.01
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as e:
+                if attempt >= self.busy_retries or not _is_busy_error(e):
+                    raise
+                with self._cond:
+                    self._stats["busy_retries"] += 1
+                time.sleep(delay)
+                delay *= 2
+
+    def stats(self):
+        """返回连接池统计信息的快照。"""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                max_size=self.max_size,
+            )
+        return snapshot
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, readonly=False, **options):
+    """
+    按数据库路径（以及是否只读）获取共享的连接池。
+    同一路径的多个 Database 实例共用一个池；池的参数以第一次创建时为准。
+    每次调用都要对应一次 close_pool。
+    """
+    key = (str(Path(db_path).resolve()), readonly)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(key[0], readonly=readonly, **options)
+            _pools[key] = pool
+        pool._owners += 1
+        return pool
+
+
+def close_pool(db_path, readonly=False):
+    """
+    释放一次 get_pool 取得的连接池；最后一个持有者释放时才关闭并移除该池，
+    同一路径上的其他实例不受影响。
+    """
+    key = (str(Path(db_path).resolve()), readonly)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            return
+        pool._owners -= 1
+        if pool._owners > 0:
+            return
+        del _pools[key]
+    pool.close()
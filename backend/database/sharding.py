@@ -0,0 +1,209 @@
+import hashlib
+import inspect
+import itertools
+import os
+from pathlib import Path
+
+from .database import DB_FILE, INSTRUMENT, SLOW_QUERY_MS, Database
+from .metrics import QueryMetrics
+
+# 分片数；大于 1 时 storage 使用 ShardedDatabase（环境变量 db_shards）
+SHARD_COUNT = int(os.getenv("db_shards", "0"))
+
+
+def shard_path(db_path, index):
+    """第 index 个分片的文件：与用户目录库同目录，例如 database-shard0.db。"""
+    db_path = Path(db_path)
+    return db_path.with_name(f"{db_path.stem}-shard{index}{db_path.suffix}")
+
+
+class ShardedDatabase:
+    """
+    按用户分片的数据库，对外接口与 Database 相同。
+    - 全局用户目录库（db_path）保存账号信息和 user_shards（用户 -> 分片），登录、注册只访问它
+    - 每个用户的数据写在 shard_count 个分片之一，每个分片是独立的 Database（各自的连接池、写锁）
+    - 新用户分到 user_id % shard_count；已有用户按 user_shards 记录路由，
+      之后调整分片数不会改变老用户的位置
+    - 带 user_id 参数的方法按该参数路由到对应分片；用户行同时复制到分片，满足外键约束
+    """
+
+    # 只涉及账号的方法由用户目录处理
+    DIRECTORY_METHODS = frozenset(
+        {"add_user", "find_user_by_credentials", "find_user_by_username_or_email", "get_user"}
+    )
+
+    def __init__(self, db_path=None, shard_count=None, instrument=None, slow_query_ms=None, **options):
+        self.db_path = Path(db_path if db_path else DB_FILE).resolve()
+        self.shard_count = int(SHARD_COUNT if shard_count is None else shard_count)
+        if self.shard_count < 1:
+            raise ValueError(f"分片数必须大于 0: {self.shard_count}")
+        # 所有库共用一份查询统计，/metrics 和请求级计数与单库模式一致
+        if INSTRUMENT if instrument is None else instrument:
+            options["metrics"] = QueryMetrics(SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms)
+        self.directory = Database(str(self.db_path), **options)
+        self.shards = [
+            Database(str(shard_path(self.db_path, index)), **options)
+            for index in range(self.shard_count)
+        ]
+        self._shard_of = {}
+
+    @property
+    def db_paths(self):
+        return [self.db_path] + [shard.db_path for shard in self.shards]
+
+    @property
+    def metrics(self):
+        return self.directory.metrics
+
+    def shard_for(self, user_id):
+        """用户数据所在的分片（Database）。"""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            # 非法的 user_id 查不到任何数据，交给任意一个分片返回空结果
+            return self.shards[0]
+        index = self._shard_of.get(user_id)
+        if index is None:
+            index = self.directory._get_user_shard(user_id)
+            if index is None or index >= self.shard_count:
+                index = user_id % self.shard_count
+            self._shard_of[user_id] = index
+        return self.shards[index]
+
+    def _group_by_shard(self, user_ids):
+        """按分片分组：[(分片, [user_id, ...]), ...]"""
+        groups = {}
+        for user_id in user_ids:
+            shard = self.shard_for(user_id)
+            groups.setdefault(id(shard), (shard, []))[1].append(user_id)
+        return list(groups.values())
+
+    def __getattr__(self, name):
+        method = getattr(Database, name, None)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(name)
+        if name in self.DIRECTORY_METHODS:
+            return getattr(self.directory, name)
+        signature = inspect.signature(method)
+        if "user_id" not in signature.parameters:
+            raise AttributeError(f"分片模式不支持 {name}")
+
+        def routed(*args, **kwargs):
+            bound = signature.bind(None, *args, **kwargs)
+            bound.apply_defaults()
+            return getattr(self.shard_for(bound.arguments["user_id"]), name)(*args, **kwargs)
+
+        routed.__name__ = name
+        # 缓存到实例上，之后的访问不再经过 __getattr__
+        self.__dict__[name] = routed
+        return routed
+
+    def add_user(self, username, email, password):
+        """在用户目录中注册，再把用户行复制到分配的分片。"""
+        user = self.directory.add_user(username, email, password)
+        if user is None:
+            return None
+        index = user["id"] % self.shard_count
+        self.directory._set_user_shard(user["id"], index)
+        self._shard_of[user["id"]] = index
+        self.shards[index]._replicate_user(user["id"], username, email, password)
+        return user
+
+    def delete_user(self, user_id):
+        self.shard_for(user_id).delete_user(user_id)
+        return self.directory.delete_user(user_id)
+
+    def get_week_occupancy(self, user_ids):
+        occupancy = {}
+        for shard, ids in self._group_by_shard(user_ids):
+            part = shard.get_week_occupancy(ids)
+            if part is None:
+                return None
+            occupancy.update(part)
+        return occupancy
+
+    def find_free_slots(self, user_ids):
+        # 合并逻辑与单库相同，只是占用数据来自各个分片
+        return Database.find_free_slots(self, user_ids)
+
+    def import_user(self, records, user_id=None, blobs=None):
+        """
+        导入到已有用户时直接交给其分片；新建用户时先在用户目录注册，
+        分片导入失败则删除刚注册的用户，保持与单库模式一样的整体成败。
+        """
+        if user_id is not None:
+            return self.shard_for(user_id).import_user(records, user_id, blobs)
+        records = iter(records)
+        header = []
+        for record in records:
+            if record.get("type") == "users":
+                break
+            if record.get("type") != "header":
+                raise ValueError("users 记录必须在其他数据之前")
+            header = [record]
+        else:
+            raise ValueError("缺少 users 记录")
+        if not all(record.get(field) for field in ("username", "email", "password")):
+            raise ValueError("users 记录缺少 username、email 或 password")
+        user = self.add_user(record["username"], record["email"], record["password"])
+        if user is None:
+            return None
+        result = None
+        try:
+            result = self.shard_for(user["id"]).import_user(itertools.chain(header, records), user["id"], blobs)
+        finally:
+            if result is None:
+                self.delete_user(user["id"])
+        return result
+
+    def unreferenced_blobs(self, limit=500):
+        # 文件存储由所有分片共用，候选摘要还要经过 forget_blob 在所有分片上确认
+        digests = []
+        for shard in self.shards:
+            digests.extend(d for d in shard.unreferenced_blobs(limit) if d not in digests)
+        return digests[:limit]
+
+    def known_blobs(self, digests):
+        digests = list(digests)
+        return set().union(*(shard.known_blobs(digests) for shard in self.shards))
+
+    def forget_blob(self, digest):
+        # 任何一个分片仍有引用，文件就不能删除
+        return all([shard.forget_blob(digest) for shard in self.shards])
+
+    def purge_uploads(self, before):
+        return [upload_id for shard in self.shards for upload_id in shard.purge_uploads(before)]
+
+    def setup_database(self):
+        for db in [self.directory, *self.shards]:
+            db.setup_database()
+
+    def get_epoch(self):
+        # 任意一个库被重建都会改变 ETag
+        epochs = "-".join(db.get_epoch() for db in [self.directory, *self.shards])
+        return hashlib.sha1(epochs.encode()).hexdigest()[:16]
+
+    def pool_stats(self):
+        return {
+            "directory": self.directory.pool_stats(),
+            "shards": [shard.pool_stats() for shard in self.shards],
+        }
+
+    def query_stats(self):
+        return self.directory.query_stats()
+
+    def write_stats(self):
+        if self.directory.write_stats() is None:
+            return None
+        return {
+            "directory": self.directory.write_stats(),
+            "shards": [shard.write_stats() for shard in self.shards],
+        }
+
+    def close_connection(self):
+        for db in [self.directory, *self.shards]:
+            db.close_connection()
+
+    def close(self):
+        for db in [self.directory, *self.shards]:
+            db.close()
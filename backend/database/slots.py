@@ -0,0 +1,64 @@
+# 一周 7 天 × 12 节 = 84 个时间段，time_index = 节次 * 7 + 星期（与 spider/sync_schedule.py 一致）
+SLOT_COUNT = 84
+DAYS_PER_WEEK = 7
+# SQLite 的 INTEGER 是 64 位有符号整数，放不下 84 位：拆成 slots_lo / slots_hi 两列，各 42 位
+HALF_BITS = 42
+HALF_MASK = (1 << HALF_BITS) - 1
+FULL_MASK = (1 << SLOT_COUNT) - 1
+
+
+def slots_to_mask(times):
+    """时间索引列表 -> 84 位掩码；索引不是 0-83 的整数时抛出 ValueError。"""
+    mask = 0
+    for time_index in times:
+        if isinstance(time_index, bool) or not isinstance(time_index, int) or not 0 <= time_index < SLOT_COUNT:
+            raise ValueError(f"时间索引必须是 0-{SLOT_COUNT - 1} 的整数: {time_index!r}")
+        mask |= 1 << time_index
+    return mask
+
+
+def mask_to_slots(mask):
+    """84 位掩码 -> 升序的时间索引列表。"""
+    slots = []
+    while mask:
+        lowest = mask & -mask
+        slots.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return slots
+
+
+def split_mask(mask):
+    """84 位掩码 -> 数据库中的 (slots_lo, slots_hi)。"""
+    return mask & HALF_MASK, mask >> HALF_BITS
+
+
+def join_mask(slots_lo, slots_hi):
+    """数据库中的 (slots_lo, slots_hi) -> 84 位掩码。"""
+    return (slots_lo or 0) | ((slots_hi or 0) << HALF_BITS)
+
+
+def pack_slots(times):
+    """时间索引列表 -> (slots_lo, slots_hi)。"""
+    return split_mask(slots_to_mask(times))
+
+
+def unpack_slots(slots_lo, slots_hi):
+    """(slots_lo, slots_hi) -> 升序的时间索引列表。"""
+    return mask_to_slots(join_mask(slots_lo, slots_hi))
+
+
+def week_masks(week_type, mask):
+    """
+    按周次类型拆成 (单周掩码, 双周掩码)。
+    week_type：0-每周，1-单周，2-双周；未知取值按每周处理。
+    """
+    return (0 if week_type == 2 else mask), (0 if week_type == 1 else mask)
+
+
+def busy_counts(masks):
+    """每个时间段被多少个掩码占用，返回长度为 84 的列表。"""
+    counts = [0] * SLOT_COUNT
+    for mask in masks:
+        for time_index in mask_to_slots(mask):
+            counts[time_index] += 1
+    return counts
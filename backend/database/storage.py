@@ -1,14 +1,72 @@
 from pathlib import Path
 
 from .database import Database
+from .transfer import spool_records
+from .sharding import SHARD_COUNT, ShardedDatabase
 
-db = Database()
+# db_shards 大于 1 时按用户分片，接口与单库相同
+db = ShardedDatabase() if SHARD_COUNT > 1 else Database()
+
+
+def close_connection():
+    """归还当前线程持有的数据库连接"""
+    db.close_connection()
+
+
+def pool_stats():
+    """获取连接池统计信息"""
+    return db.pool_stats()
+
+
+def query_stats():
+    """查询统计（需开启 db_instrument），未开启时返回 None"""
+    return db.query_stats()
+
+
+def write_stats():
+    """queue 写入模式下的写队列统计，direct 模式返回 None"""
+    return db.write_stats()
+
+
+def get_revision(user_id):
+    """获取用户数据的版本号"""
+    return db.get_revision(user_id)
+
+
+def get_etag(user_id, kind, revision=None):
+    """
+    基于用户数据版本号生成强 ETag。
+    kind 区分不同接口的表示形式；数据库实例标识保证清库重建后不会与旧 ETag 碰撞。
+    """
+    if revision is None:
+        revision = db.get_revision(user_id)
+    return f"{db.get_epoch()}-{kind}-{user_id}-{revision}"
+
+
+def search(user_id, query, limit=20, offset=0):
+    """全文检索用户的课程、笔记、任务和链接"""
+    return db.search(user_id, query, limit, offset)
 
 
 def get_user(user_id=1):
     return db.get_user_with_courses_and_notes(user_id)
 
 
+def find_note(user_id, course_title, note_name):
+    """按课程名和笔记名查找笔记：用户不存在时为 None，否则为 {"courseId", "note"}"""
+    return db.find_note(user_id, course_title, note_name)
+
+
+def get_storage_usage(user_id):
+    """用户笔记引用的文件总大小（字节）"""
+    return db.get_storage_usage(user_id)
+
+
+def get_notes_page(user_id, limit=50, cursor=None, course_title=None):
+    """分页获取用户的笔记（键集分页）"""
+    return db.get_notes_page(user_id, limit, cursor, course_title)
+
+
 def find_user_by_credentials(username_or_email, password):
     return db.find_user_by_credentials(username_or_email, password)
 
@@ -34,12 +92,49 @@ def add_course(title, tags=None, user_id=None):
     return course
 
 
-def add_note(title, lessonName, tags=None, files=None, user_id=None):
+def add_note(title, lessonName, tags=None, files=None, user_id=None, blob=None, quota=None):
     tags = tags or []
     files = files or []
-    note = db.add_note(title, lessonName, tags, files, user_id)
+    note = db.add_note(title, lessonName, tags, files, user_id, blob, quota)
     return note
 
+def create_upload(user_id, title, lessonName, filename, size, tags=None, sha256=None):
+    """新建可续传上传会话"""
+    return db.create_upload(user_id, title, lessonName, filename, size, tags, sha256)
+
+
+def get_upload(user_id, upload_id):
+    return db.get_upload(user_id, upload_id)
+
+
+def add_upload_chunk(user_id, upload_id, start, end):
+    return db.add_upload_chunk(user_id, upload_id, start, end)
+
+
+def complete_upload(user_id, upload_id, blob, quota=None):
+    """删除上传会话并创建笔记（一个事务），写入后超出 quota 时抛出 QuotaExceeded"""
+    return db.complete_upload(user_id, upload_id, blob, quota)
+
+
+def delete_upload(user_id, upload_id):
+    return db.delete_upload(user_id, upload_id)
+
+
+def add_notes_bulk(user_id, notes):
+    """批量添加笔记（一个事务）"""
+    return db.add_notes_bulk(user_id, notes)
+
+
+def add_tasks_bulk(user_id, tasks):
+    """批量添加任务（一个事务）"""
+    return db.add_tasks_bulk(user_id, tasks)
+
+
+def add_cloud_results(user_id, notes, tasks):
+    """在同一个事务中写入 /cloud 同步得到的笔记和任务"""
+    return db.add_cloud_results(user_id, notes, tasks)
+
+
 def edit_course(user_id, oldname, newname):
     """修改课程名称"""
     return db.edit_course(user_id, oldname, newname)
@@ -71,6 +166,16 @@ def get_useful_links_by_category(user_id):
     return db.get_useful_links_by_category(user_id)
 
 
+def get_useful_links_page(user_id, limit=50, cursor=None, category_id=None):
+    """分页获取用户的链接（键集分页）"""
+    return db.get_useful_links_page(user_id, limit, cursor, category_id)
+
+
+def replace_link_categories(user_id, link_categories):
+    """整体替换用户的链接分类及链接"""
+    return db.replace_link_categories(user_id, link_categories)
+
+
 def delete_link_category(user_id, category_id):
     """删除链接分类"""
     return db.delete_link_category(user_id, category_id)
@@ -92,6 +197,16 @@ def get_tasks(user_id):
     return db.get_tasks(user_id)
 
 
+def get_tasks_page(user_id, limit=50, cursor=None):
+    """按截止时间分页获取任务（键集分页）"""
+    return db.get_tasks_page(user_id, limit, cursor)
+
+
+def get_upcoming_tasks(user_id, days=7):
+    """获取接下来 days 天内到期的任务"""
+    return db.get_upcoming_tasks(user_id, days)
+
+
 def update_task(user_id, task_id, **updates):
     """更新任务信息"""
     return db.update_task(user_id, task_id, **updates)
@@ -102,9 +217,9 @@ def delete_task(user_id, task_id):
     return db.delete_task(user_id, task_id)
 
 
-def update_deadlines(user_id, deadlines):
-    """批量更新用户的DDL列表"""
-    return db.update_deadlines(user_id, deadlines)
+def update_deadlines(user_id, deadlines, reconcile=True):
+    """批量更新用户的DDL列表，返回插入/更新/删除的数量"""
+    return db.update_deadlines(user_id, deadlines, reconcile)
 
 def add_course_schedule(user_id, name, teacher, location, week_type, times):
     """添加课程表"""
@@ -114,6 +229,32 @@ def get_course_schedules(user_id):
     """获取用户的所有课程表"""
     return db.get_course_schedules(user_id)
 
+
+def get_course_schedules_page(user_id, limit=50, cursor=None):
+    """分页获取课程表（键集分页）"""
+    return db.get_course_schedules_page(user_id, limit, cursor)
+
+def find_free_slots(user_ids):
+    """求多个用户的共同空闲时间段"""
+    return db.find_free_slots(user_ids)
+
+
+def get_schedule_conflicts(user_id):
+    """找出用户课表中时间重叠的课程"""
+    return db.get_schedule_conflicts(user_id)
+
+def export_user(user_id):
+    """导出用户的全部数据（逐条产出记录的生成器），用户不存在时返回 None"""
+    return db.export_user(user_id)
+
+
+def import_user(records, user_id=None, blobs=None):
+    """
+    导入 export_user 产生的记录，user_id 为 None 时新建用户，blobs 为随导入上传的文件 {sha256: size}。
+    记录先在调用线程中读完并暂存，之后的写事务（queue 模式下在写线程中）只读本地临时文件
+    """
+    return db.import_user(spool_records(records), user_id, blobs)
+
 def update_course_schedule(user_id, schedule_id, **updates):
     """更新课程表信息"""
     return db.update_course_schedule(user_id, schedule_id, **updates)
@@ -122,6 +263,6 @@ def delete_course_schedule(user_id, schedule_id):
     """删除课程表"""
     return db.delete_course_schedule(user_id, schedule_id)
 
-def update_course_table(user_id, course_table):
-    """批量更新用户的课表"""
-    return db.update_course_table(user_id, course_table)
\ No newline at end of file
+def update_course_table(user_id, course_table, reconcile=True):
+    """批量更新用户的课表，返回插入/更新/删除的数量"""
+    return db.update_course_table(user_id, course_table, reconcile)
\ No newline at end of file
@@ -185,6 +185,32 @@ class TestNoteOperations:
         # Assert
         assert note is None
 
+    def test_find_note(self, mock_db, test_user):
+        """测试按课程名和笔记名直接查找笔记"""
+        user_id = test_user['id']
+        for i in range(20):
+            mock_db.add_course_to_user(user_id, f"课程{i}", [])
+        first = mock_db.add_note("讲义", "课程7", [], ["a.pdf"], user_id)
+        mock_db.add_note("讲义", "课程7", [], ["b.pdf"], user_id)
+        mock_db.add_note("讲义", "课程8", [], ["c.pdf"], user_id)
+
+        found = mock_db.find_note(user_id, "课程7", "讲义")
+        assert found["note"] == {
+            "id": first["id"], "name": "讲义", "file": "a.pdf", "lessonName": "课程7", "sha256": None
+        }
+        assert mock_db.find_note(user_id, "课程7", "没有") == {"courseId": found["courseId"], "note": None}
+        assert mock_db.find_note(user_id, "没有", "讲义") == {"courseId": None, "note": None}
+        assert mock_db.find_note(user_id + 1000, "课程7", "讲义") is None
+
+        conn = mock_db.get_db_connection()
+        plan = " ".join(
+            row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM notes WHERE user_id = ? AND course_id = ? AND name = ?",
+                (user_id, found["courseId"], "讲义"),
+            )
+        )
+        assert "ix_notes_user_course_name" in plan
+
 class TestLinkManagement:
     """链接管理测试"""
     
@@ -291,4 +317,1266 @@ class TestSimpleScenarios:
             assert task is not None or task is False
         except Exception as e:
             print(f"注意: add_task 可能有问题: {e}")
-            pytest.skip(f"add_task 函数有问题: {e}")
\ No newline at end of file
+            pytest.skip(f"add_task 函数有问题: {e}")
+
+class TestAggregateQueries:
+    """聚合查询测试 - 查询次数不随课程/链接/课表数量增长"""
+
+    def test_aggregate_query_count_is_constant(self, mock_db):
+        from .bench_aggregates import (
+            count_queries,
+            legacy_get_course_schedules,
+            legacy_get_useful_links_by_category,
+            legacy_get_user_with_courses_and_notes,
+            seed_user,
+        )
+
+        small = seed_user(mock_db, 1)
+        large = seed_user(mock_db, 12)
+
+        loaders = [
+            (mock_db.get_user_with_courses_and_notes, legacy_get_user_with_courses_and_notes),
+            (mock_db.get_useful_links_by_category, legacy_get_useful_links_by_category),
+            (mock_db.get_course_schedules, legacy_get_course_schedules),
+        ]
+        for new_fn, legacy_fn in loaders:
+            _, small_queries = count_queries(mock_db, new_fn, small)
+            result, large_queries = count_queries(mock_db, new_fn, large)
+            assert small_queries == large_queries
+
+            # 输出与逐条查询版本完全一致
+            expected = legacy_fn(mock_db, large)
+            assert json.dumps(result, ensure_ascii=False) == json.dumps(expected, ensure_ascii=False)
+
+
+class TestConnectionPool:
+    """连接池测试"""
+
+    def test_instances_with_different_paths_do_not_share_connections(self, tmp_path):
+        from database import Database
+
+        db1 = Database(str(tmp_path / "a.db"))
+        db2 = Database(str(tmp_path / "b.db"))
+        try:
+            db1.add_user("pool_a", "a@pool.com", "pw")
+            assert db1.find_user_by_username_or_email("pool_a") is not None
+            assert db2.find_user_by_username_or_email("pool_a") is None
+        finally:
+            db1.close()
+            db2.close()
+
+    def test_closing_one_instance_keeps_shared_pool_open(self, tmp_path):
+        from database import Database
+
+        db1 = Database(str(tmp_path / "shared.db"))
+        db2 = Database(str(tmp_path / "shared.db"))
+        try:
+            assert db1._pool is db2._pool
+            db1.close()
+            db1.close()
+            db2.add_user("shared", "shared@pool.com", "pw")
+            assert db2.find_user_by_username_or_email("shared") is not None
+        finally:
+            db2.close()
+        assert db2._pool._closed
+
+    def test_connection_pragmas(self, mock_db):
+        conn = mock_db.get_db_connection()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        # NORMAL = 1
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] > 0
+
+    def test_pool_is_bounded_and_reports_stats(self, tmp_path):
+        from database.pool import ConnectionPool, PoolTimeout
+
+        pool = ConnectionPool(tmp_path / "bounded.db", max_size=2, timeout=0.05)
+        try:
+            c1 = pool.acquire()
+            c2 = pool.acquire()
+            with pytest.raises(PoolTimeout):
+                pool.acquire()
+            pool.release(c1)
+            # 归还后的连接会被复用，而不是新建
+            assert pool.acquire() is c1
+            pool.release(c1)
+            pool.release(c2)
+
+            stats = pool.stats()
+            assert stats["checkouts"] == 3
+            assert stats["created"] == 2
+            assert stats["waits"] == 1
+            assert stats["timeouts"] == 1
+            assert stats["size"] == 2 and stats["in_use"] == 0
+        finally:
+            pool.close()
+
+    def test_methods_return_connections_to_pool(self, mock_db):
+        mock_db.close_connection()
+        before = mock_db.pool_stats()
+        mock_db.add_user("pooled", "pooled@test.com", "pw")
+        mock_db.get_user_with_courses_and_notes(1)
+        after = mock_db.pool_stats()
+        assert after["checkouts"] > before["checkouts"]
+        assert after["in_use"] == 0
+
+
+class TestWriteQueue:
+    """单写线程（queue 模式）测试"""
+
+    def test_concurrent_writes_are_group_committed(self, tmp_path):
+        import threading
+
+        from database import Database
+
+        db = Database(str(tmp_path / "queue.db"), write_mode="queue")
+        try:
+            user = db.add_user("queued", "queued@test.com", "pw")
+            assert db.add_course_to_user(user["id"], "队列课程", []) is not None
+
+            def writer(i):
+                for j in range(20):
+                    assert db.add_note(f"笔记{i}-{j}", "队列课程", [], [], user["id"])
+                # 失败的写操作只回滚自身，不影响同批次的其他操作
+                assert db.add_note("无效", "不存在的课程", [], [], user["id"]) is None
+
+            threads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            data = db.get_user_with_courses_and_notes(user["id"])
+            assert len(data["courses"][0]["myNotes"]) == 160
+            stats = db.write_stats()
+            assert stats["failed_batches"] == 0
+            assert stats["batches"] < stats["ops"]
+        finally:
+            db.close()
+
+    def test_failed_op_does_not_roll_back_its_batch(self, tmp_path):
+        import threading
+
+        from database import Database
+
+        db = Database(str(tmp_path / "queue_abort.db"), write_mode="queue")
+        try:
+            user_id = db.add_user("batch", "batch@test.com", "pw")["id"]
+            upload = db.create_upload(user_id, "录像", "不存在的课程", "rec.mp4", 3)
+            # 先用一个操作占住写线程，让后面两个写操作进入同一批次
+            started, release = threading.Event(), threading.Event()
+
+            def block():
+                started.set()
+                release.wait()
+
+            db._writer.batch_ms = 500
+            blocker = threading.Thread(target=db._writer.submit, args=(block,))
+            blocker.start()
+            started.wait()
+            results = {}
+            ops = [
+                threading.Thread(target=lambda: results.update(task=db.add_task(user_id, "作业", "2025-01-01"))),
+                threading.Thread(target=lambda: results.update(
+                    upload=db.complete_upload(user_id, upload["id"], {"sha256": "a" * 64, "size": 3})
+                )),
+            ]
+            for t in ops:
+                t.start()
+            while db.write_stats()["queued"] < 2:
+                pass
+            release.set()
+            for t in [blocker, *ops]:
+                t.join()
+
+            assert results["upload"] is False
+            assert results["task"] is not None
+            assert [t["name"] for t in db.get_tasks(user_id)] == ["作业"]
+            assert db.get_upload(user_id, upload["id"]) is not None
+            assert db.write_stats()["max_batch"] >= 2
+        finally:
+            db.close()
+
+    def test_reads_use_readonly_connections(self, tmp_path):
+        import sqlite3
+
+        from database import Database
+
+        db = Database(str(tmp_path / "queue_ro.db"), write_mode="queue")
+        try:
+            conn = db.get_db_connection()
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM users")
+            assert db.get_user(1) is not None
+        finally:
+            db.close()
+
+
+class TestUserRevision:
+    """用户数据版本号与缓存测试"""
+
+    def test_every_mutation_bumps_revision(self, mock_db, test_user):
+        user_id = test_user['id']
+        revisions = [mock_db.get_revision(user_id)]
+
+        def changed():
+            revisions.append(mock_db.get_revision(user_id))
+            return revisions[-1] > revisions[-2]
+
+        mock_db.add_course_to_user(user_id, "版本课程", [])
+        assert changed()
+        mock_db.add_note("版本笔记", "版本课程", [], [], user_id)
+        assert changed()
+        mock_db.edit_note(user_id, "版本课程", "版本笔记", "新笔记")
+        assert changed()
+        mock_db.update_deadlines(user_id, [{"name": "ddl", "deadline": "2025-01-01"}])
+        assert changed()
+        schedule = mock_db.add_course_schedule(user_id, "课表", "", "", 0, [1])
+        assert changed()
+        mock_db.update_course_schedule(user_id, schedule["id"], times=[2, 3])
+        assert changed()
+        mock_db.replace_link_categories(user_id, [{"category": "c", "icon": "i", "links": []}])
+        assert changed()
+        # 只读操作不改变版本号
+        mock_db.get_user_with_courses_and_notes(user_id)
+        assert not changed()
+
+    def test_versioned_cache_lru_and_ttl(self):
+        from database.cache import VersionedLRUCache
+
+        cache = VersionedLRUCache(max_entries=2, ttl=60)
+        cache.put(1, 1, b"a")
+        assert cache.get(1, 1) == b"a"
+        # 新版本替换旧版本
+        cache.put(1, 2, b"b")
+        assert cache.get(1, 1) is None
+        cache.put(2, 1, b"c")
+        cache.put(3, 1, b"d")
+        assert cache.get(1, 2) is None  # 被 LRU 淘汰
+        assert cache.stats()["evictions"] == 1
+
+        expired = VersionedLRUCache(ttl=0)
+        assert expired.get_or_build(1, 1, lambda: b"x") == b"x"
+        assert expired.get(1, 1) is None
+        assert expired.stats()["expirations"] == 1
+
+
+class TestReconcile:
+    """DDL / 课表差量同步测试"""
+
+    def test_update_deadlines_applies_only_the_diff(self, mock_db, test_user):
+        user_id = test_user['id']
+        deadlines = [
+            {"name": "作业1", "deadline": "2025-01-01", "message": "a", "status": "0"},
+            {"name": "作业2", "deadline": "2025-01-02", "message": "b", "status": "0"},
+        ]
+        assert mock_db.update_deadlines(user_id, deadlines) == {
+            "inserted": 2, "updated": 0, "deleted": 0, "unchanged": 0
+        }
+        ids = {row['name']: row['id'] for row in mock_db.get_db_connection().execute(
+            "SELECT id, name FROM tasks WHERE user_id = ?", (user_id,)
+        )}
+
+        # 完全相同的同步不产生任何写入，也不改变数据版本号
+        revision = mock_db.get_revision(user_id)
+        assert mock_db.update_deadlines(user_id, deadlines)["unchanged"] == 2
+        assert mock_db.get_revision(user_id) == revision
+
+        deadlines[0]["status"] = 1
+        changes = mock_db.update_deadlines(
+            user_id, [deadlines[0], {"name": "作业3", "deadline": "2025-01-03"}]
+        )
+        assert changes == {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 0}
+        rows = {row['name']: dict(row) for row in mock_db.get_db_connection().execute(
+            "SELECT * FROM tasks WHERE user_id = ?", (user_id,)
+        )}
+        # 更新的行保留原有 id
+        assert rows["作业1"]["id"] == ids["作业1"]
+        assert rows["作业1"]["status"] == "1"
+        assert set(rows) == {"作业1", "作业3"}
+
+    def test_update_course_table_applies_only_the_diff(self, mock_db, test_user):
+        user_id = test_user['id']
+        table = [
+            {"name": "高数", "teacher": "张", "location": "A", "weekType": 0, "times": [1, 2]},
+            {"name": "英语", "teacher": "李", "location": "B", "weekType": 1, "times": [5]},
+        ]
+        assert mock_db.update_course_table(user_id, table)["inserted"] == 2
+        before = {c["name"]: c for c in mock_db.get_course_schedules(user_id)}
+        assert mock_db.update_course_table(user_id, table)["unchanged"] == 2
+
+        table[0]["times"] = [2, 3]
+        table[1]["location"] = "C"
+        changes = mock_db.update_course_table(user_id, table)
+        assert changes == {"inserted": 0, "updated": 2, "deleted": 0, "unchanged": 0}
+        after = {c["name"]: c for c in mock_db.get_course_schedules(user_id)}
+        assert after["高数"]["id"] == before["高数"]["id"]
+        assert after["高数"]["times"] == [2, 3]
+        assert after["英语"]["location"] == "C"
+
+        changes = mock_db.update_course_table(user_id, table[:1], reconcile=False)
+        assert changes["deleted"] == 2 and changes["inserted"] == 1
+        assert [c["name"] for c in mock_db.get_course_schedules(user_id)] == ["高数"]
+
+
+class TestSlots:
+    """课程时间段掩码测试"""
+
+    def test_mask_round_trip(self):
+        from database.slots import HALF_BITS, pack_slots, unpack_slots
+
+        times = [0, 13, 41, 42, 70, 83]
+        slots_lo, slots_hi = pack_slots(times + [13])
+        # 两列都在 SQLite 的 64 位有符号整数范围内
+        assert 0 <= slots_lo < 1 << HALF_BITS and 0 <= slots_hi < 1 << HALF_BITS
+        assert unpack_slots(slots_lo, slots_hi) == times
+        assert unpack_slots(0, 0) == []
+        for bad in (["1"], [1.5], [True]):
+            with pytest.raises(ValueError):
+                pack_slots(bad)
+
+    @pytest.mark.parametrize("times", [[84], [-1], [0, 100]])
+    def test_out_of_range_is_rejected(self, mock_db, test_user, times):
+        from database.slots import pack_slots
+
+        with pytest.raises(ValueError):
+            pack_slots(times)
+        assert mock_db.add_course_schedule(test_user['id'], "课表", "", "", 0, times) is None
+        assert mock_db.update_course_table(test_user['id'], [{"name": "课表", "times": times}]) is False
+
+    def test_schedules_are_read_with_one_query(self, mock_db, test_user):
+        user_id = test_user['id']
+        for i in range(5):
+            mock_db.add_course_schedule(user_id, f"课程{i}", "", "", 0, [i, 50 + i])
+        conn = mock_db.get_db_connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            schedules = mock_db.get_course_schedules(user_id)
+        finally:
+            conn.set_trace_callback(None)
+        assert len(statements) == 1
+        assert [c["times"] for c in schedules] == [[i, 50 + i] for i in range(5)]
+
+    def test_free_slots_for_many_users(self, mock_db):
+        user_ids = [mock_db.add_user(f"u{i}", f"u{i}@example.com", "pw")["id"] for i in range(300)]
+        for i, user_id in enumerate(user_ids):
+            mock_db.add_course_schedule(user_id, "课", "", "", i % 3, [i % 80])
+
+        free = mock_db.find_free_slots(user_ids)
+        assert free["free"] == [80, 81, 82, 83]
+        assert free["busyCount"][:3] == [4, 4, 4] and sum(free["busyCount"]) == 300
+        # 第 1 个用户的课只在单周，第 2 个只在双周
+        odd_only = mock_db.find_free_slots(user_ids[1:2])
+        assert 1 in odd_only["freeEvenWeeks"] and 1 not in odd_only["freeOddWeeks"]
+        even_only = mock_db.find_free_slots(user_ids[2:3])
+        assert 2 in even_only["freeOddWeeks"] and 2 not in even_only["freeEvenWeeks"]
+
+    def test_migration_packs_time_rows(self, mock_db, test_user):
+        user_id = test_user['id']
+        conn = mock_db.get_db_connection()
+        with conn:
+            # 迁移前的结构：上课时间每个时间段一行
+            conn.execute(
+                "CREATE TABLE course_schedule_times (id INTEGER PRIMARY KEY, course_schedule_id INTEGER, time_index INTEGER)"
+            )
+            schedule_id = conn.execute(
+                "INSERT INTO course_schedules (name, week_type, user_id) VALUES ('高数', 0, ?)", (user_id,)
+            ).lastrowid
+            untouched = mock_db.add_course_schedule(user_id, "英语", "", "", 0, [7])
+            conn.executemany(
+                "INSERT INTO course_schedule_times (course_schedule_id, time_index) VALUES (?, ?)",
+                [(schedule_id, t) for t in (83, 1, 42, 41)],
+            )
+            conn.execute("DELETE FROM schema_version WHERE version >= 6")
+        mock_db.setup_database()
+
+        schedules = {c["name"]: c for c in mock_db.get_course_schedules(user_id)}
+        assert schedules["高数"]["times"] == [1, 41, 42, 83]
+        assert schedules["英语"]["times"] == untouched["times"]
+        assert conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'course_schedule_times'"
+        ).fetchone() is None
+
+
+class TestTransfer:
+    """导出/导入测试"""
+
+    def test_export_holds_one_connection_until_closed(self, mock_db, test_user):
+        user_id = test_user['id']
+        for i in range(5):
+            mock_db.add_course_to_user(user_id, f"课程{i}", [])
+        in_use = mock_db.pool_stats()["in_use"]
+
+        records = mock_db.export_user(user_id)
+        assert mock_db.pool_stats()["in_use"] == in_use
+        assert next(records)["type"] == "header"
+        assert mock_db.pool_stats()["in_use"] == in_use + 1
+        assert next(records)["username"] == test_user['username']
+        course = next(records)
+        assert (course["type"], course["title"], course["tags"]) == ("courses", "课程0", "[]")
+        records.close()
+        assert mock_db.pool_stats()["in_use"] == in_use
+        assert mock_db.export_user(99999) is None
+
+    def test_import_into_existing_user(self, mock_db, test_user):
+        user_id = test_user['id']
+        mock_db.add_course_to_user(user_id, "高数", [])
+        mock_db.update_deadlines(user_id, [{"name": "作业", "deadline": "2025-01-02"}])
+        records = list(mock_db.export_user(user_id))
+
+        other = mock_db.add_user("other", "other@example.com", "pw")
+        result = mock_db.import_user(iter(records), other['id'])
+        assert result["userId"] == other['id']
+        assert result["courses"] == result["tasks"] == 1
+        # 截止时间的时间戳在导入时重新计算
+        deadlines = mock_db.get_db_connection().execute(
+            "SELECT DISTINCT deadline_at, has_deadline FROM tasks WHERE user_id IN (?, ?)", (user_id, other['id'])
+        ).fetchall()
+        assert len(deadlines) == 1 and deadlines[0]["has_deadline"] == 1
+        # 同名课程冲突，整体回滚
+        assert mock_db.import_user(iter(records), other['id']) is None
+        assert len(mock_db.get_tasks(other['id'])) == 1
+
+
+    def test_import_only_keeps_blobs_it_can_vouch_for(self, mock_db, test_user):
+        user_id = test_user['id']
+        mine, theirs, uploaded = ({"sha256": c * 64, "size": n} for c, n in (("a", 3), ("b", 4), ("c", 5)))
+        other = mock_db.add_user("owner", "owner@example.com", "pw")['id']
+        for uid, blob in ((user_id, mine), (other, theirs)):
+            mock_db.add_course_to_user(uid, "课程", [])
+            mock_db.add_note("已有", "课程", [], ["x.pdf"], uid, blob)
+        records = [
+            {"type": "courses", "id": 1, "title": "导入"},
+            *({"type": "notes", "id": i, "course_id": 1, "name": f"笔记{i}", "file": "x.pdf", "blob_sha256": blob["sha256"]}
+              for i, blob in enumerate((mine, theirs, uploaded))),
+        ]
+        result = mock_db.import_user(iter(records), user_id, blobs={uploaded["sha256"]: uploaded["size"]})
+        assert result["notes"] == 3 and result["missing_blobs"] == 1
+        digests = [
+            row["blob_sha256"] for row in mock_db.get_db_connection().execute(
+                "SELECT blob_sha256 FROM notes WHERE user_id = ? AND name LIKE '笔记%' ORDER BY name", (user_id,)
+            )
+        ]
+        assert digests == [mine["sha256"], None, uploaded["sha256"]]
+        assert mock_db.get_storage_usage(user_id) == mine["size"] + uploaded["size"]
+
+class TestBackup:
+    """在线备份测试"""
+
+    def test_snapshot_while_writing_and_retention(self, mock_db, test_user, tmp_path):
+        import sqlite3
+        import threading
+        from database.backup import list_backups, snapshot, verify_backup
+
+        user_id = test_user['id']
+        mock_db.add_tasks_bulk(user_id, [{"name": f"任务{i}", "deadline": "", "message": "x" * 500} for i in range(500)])
+        stop = threading.Event()
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                mock_db.add_course_to_user(user_id, f"并发{i}", [])
+                mock_db.close_connection()
+                i += 1
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            results = [snapshot(mock_db.db_path, tmp_path, keep=2, pages=4) for _ in range(3)]
+        finally:
+            stop.set()
+            thread.join()
+
+        assert all(r["integrity"] == "ok" and r["steps"] > 1 for r in results)
+        assert results[-1]["pruned"] == [results[0]["path"]]
+        assert [str(p) for p in list_backups(mock_db.db_path, tmp_path)] == [r["path"] for r in results[1:]]
+        assert verify_backup(results[-1]["path"]) == []
+        conn = sqlite3.connect(results[-1]["path"])
+        assert conn.execute("SELECT count(*) FROM tasks").fetchone()[0] == 500
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        conn.close()
+
+    def test_sharded_snapshots_are_pruned_per_file(self, tmp_path):
+        from database.backup import list_backups, snapshot
+        from database.sharding import ShardedDatabase
+
+        db = ShardedDatabase(str(tmp_path / "database.db"), shard_count=2)
+        try:
+            backup_dir = tmp_path / "backups"
+            # 与应用中一样，每个库文件各自定时快照，共用同一个备份目录
+            for _ in range(4):
+                for path in db.db_paths:
+                    snapshot(path, backup_dir, keep=3)
+            for path in db.db_paths:
+                snapshots = list_backups(path, backup_dir)
+                assert len(snapshots) == 3
+                assert all(p.name.startswith(f"{path.stem}-2") for p in snapshots)
+        finally:
+            db.close()
+
+    def test_restore(self, mock_db, test_user, tmp_path):
+        from database.backup import BackupError, backup_database, restore_backup
+
+        user_id = test_user['id']
+        mock_db.add_course_to_user(user_id, "备份前", [])
+        path = tmp_path / "snap.db"
+        backup_database(mock_db.db_path, path)
+        epoch = mock_db.get_epoch()
+        mock_db.add_course_to_user(user_id, "备份后", [])
+        mock_db.close_connection()
+
+        restore_backup(path, mock_db.db_path)
+        titles = [c["name"] for c in mock_db.get_user_with_courses_and_notes(user_id)["courses"]]
+        assert titles == ["备份前"]
+        # 版本号回到快照时的值，实例标识随之更换
+        assert mock_db.get_epoch() not in ("", epoch)
+        # 恢复写入的是数据页，线上库仍保持 WAL 模式
+        assert mock_db.get_db_connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        corrupt = tmp_path / "corrupt.db"
+        corrupt.write_bytes(path.read_bytes()[:4096] + b"\xff" * 4096)
+        with pytest.raises(BackupError):
+            restore_backup(corrupt, mock_db.db_path)
+
+    def test_scheduler_records_duration(self, mock_db, tmp_path):
+        from database.backup import BackupScheduler
+
+        scheduler = BackupScheduler(mock_db.db_path, interval=3600, backup_dir=tmp_path, keep=1)
+        assert scheduler.run_once()["seconds"] >= 0
+        stats = scheduler.stats()
+        assert stats["runs"] == 1 and stats["failures"] == 0 and stats["snapshots"] == 1
+        assert stats["last"]["integrity"] == "ok"
+
+
+class TestMaintenance:
+    """定时维护测试"""
+
+    def test_purges_orphans_in_batches(self, mock_db, test_user):
+        import sqlite3
+        from database.maintenance import Maintenance
+
+        user_id = test_user['id']
+        mock_db.add_course_to_user(user_id, "保留", [])
+        mock_db.close_connection()
+        # 模拟旧版本未开启外键时留下的数据：父行已删除，子行还在
+        conn = sqlite3.connect(mock_db.db_path)
+        conn.execute("INSERT INTO users (id, username, email, password) VALUES (999, 'gone', 'gone@x', 'p')")
+        conn.executemany(
+            "INSERT INTO courses (user_id, title) VALUES (999, ?)", [(f"孤儿{i}",) for i in range(25)]
+        )
+        conn.execute("INSERT INTO tasks (user_id, name, deadline) VALUES (999, '孤儿任务', '')")
+        conn.execute("DELETE FROM users WHERE id = 999")
+        conn.commit()
+        conn.close()
+
+        report = Maintenance(mock_db.db_path, batch_size=10, pause_ms=0).run_once()
+        orphans = report["tasks"]["orphans"]
+        assert orphans == {"deleted": {"courses": 25, "tasks": 1}, "complete": True, "seconds": orphans["seconds"]}
+        titles = [c["name"] for c in mock_db.get_user_with_courses_and_notes(user_id)["courses"]]
+        assert titles == ["保留"]
+        # 统计信息已生成，之后只做 PRAGMA optimize
+        again = Maintenance(mock_db.db_path, pause_ms=0).run_once()
+        assert again["tasks"]["optimize"]["analyze"] is False
+        assert again["tasks"]["orphans"]["deleted"] == {}
+
+    def test_budget_stops_purge(self, mock_db):
+        from database.maintenance import Maintenance
+
+        report = Maintenance(mock_db.db_path, pause_ms=0, budget_s=0).run_once()
+        assert report["tasks"]["orphans"]["complete"] is False
+
+    def test_incremental_vacuum_reclaims_pages(self, mock_db, test_user):
+        from database.maintenance import Maintenance
+
+        user_id = test_user['id']
+        conn = mock_db.get_db_connection()
+        # 连接池新建的库使用增量 vacuum
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        mock_db.add_tasks_bulk(user_id, [{"name": f"任务{i}", "deadline": "", "message": "x" * 2000} for i in range(300)])
+        with conn:
+            conn.execute("DELETE FROM tasks")
+        mock_db.close_connection()
+
+        report = Maintenance(mock_db.db_path, vacuum_pages=16, pause_ms=0).run_once()
+        vacuum = report["tasks"]["vacuum"]
+        assert vacuum["enabled"] is True and vacuum["freelist"] == 0 and vacuum["pages_freed"] > 16
+        assert report["pages_reclaimed"] >= vacuum["pages_freed"]
+        assert report["bytes_reclaimed"] == report["pages_reclaimed"] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+    def test_enable_incremental_vacuum_on_existing_db(self, tmp_path):
+        import sqlite3
+        from database.maintenance import enable_incremental_vacuum
+
+        path = tmp_path / "old.db"
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE t (x)")
+        conn.close()
+        assert enable_incremental_vacuum(path) is True
+        assert enable_incremental_vacuum(path) is False
+
+    def test_scheduler_records_stats(self, mock_db):
+        from database.maintenance import MaintenanceScheduler
+
+        scheduler = MaintenanceScheduler(mock_db.db_path, interval=3600, pause_ms=0)
+        report = scheduler.run_once()
+        assert set(report["tasks"]) == {"optimize", "orphans", "uploads", "search_index", "checkpoint", "vacuum"}
+        assert report["tasks"]["uploads"]["skipped"] is True
+        stats = scheduler.stats()
+        assert stats["runs"] == 1 and stats["failures"] == 0
+        assert stats["last"]["seconds"] == report["seconds"]
+
+
+    def test_scheduler_collects_expired_uploads(self, mock_db, test_user, tmp_path):
+        import io
+        import time
+
+        from database.blobstore import BlobStore
+        from database.maintenance import MaintenanceScheduler
+
+        store = BlobStore(tmp_path / "blobs")
+        user_id = test_user['id']
+        abandoned = mock_db.create_upload(user_id, "中断", "课程", "x.bin", 10, now=time.time() - 7200)
+        store.write_chunk(abandoned["id"], 0, io.BytesIO(b"12345"), 5)
+        fresh = mock_db.create_upload(user_id, "进行中", "课程", "y.bin", 10)
+
+        scheduler = MaintenanceScheduler(
+            mock_db.db_path, interval=3600, pause_ms=0, blob_store=store, upload_ttl_s=3600
+        )
+        report = scheduler.run_once()
+        assert report["tasks"]["uploads"]["removed"] == 1
+        assert mock_db.get_upload(user_id, abandoned["id"]) is None
+        assert mock_db.get_upload(user_id, fresh["id"]) is not None
+        assert not store.upload_path(abandoned["id"]).exists()
+
+class TestSharding:
+    """分片模式测试"""
+
+    @pytest.fixture
+    def sharded(self, tmp_path):
+        from database import ShardedDatabase
+
+        db = ShardedDatabase(str(tmp_path / "directory.db"), shard_count=3)
+        yield db
+        db.close()
+
+    def test_users_are_routed_to_their_shard(self, sharded, tmp_path):
+        users = [sharded.add_user(f"s{i}", f"s{i}@example.com", "pw") for i in range(6)]
+        assert sharded.add_user("s0", "other@example.com", "pw") is None
+        for user in users:
+            sharded.add_course_to_user(user["id"], f"课程{user['id']}", [])
+            sharded.add_note("笔记", f"课程{user['id']}", [], None, user["id"])
+
+        for user in users:
+            shard = sharded.shards[user["id"] % 3]
+            assert shard is sharded.shard_for(str(user["id"]))
+            titles = [row["title"] for row in shard.get_db_connection().execute(
+                "SELECT title FROM courses WHERE user_id = ?", (user["id"],)
+            )]
+            assert titles == [f"课程{user['id']}"]
+            data = sharded.get_user_with_courses_and_notes(user["id"])
+            assert data["courses"][0]["myNotes"][0]["name"] == "笔记"
+        # 其他分片里没有该用户的数据，只有用户目录保存账号
+        assert sharded.directory.get_db_connection().execute("SELECT count(*) FROM courses").fetchone()[0] == 0
+        assert sharded.find_user_by_credentials("s4", "pw")["id"] == users[4]["id"]
+        assert sorted(p.name for p in tmp_path.glob("*.db")) == [
+            "directory-shard0.db", "directory-shard1.db", "directory-shard2.db", "directory.db",
+        ]
+
+    def test_directory_keeps_placement_when_shard_count_changes(self, sharded, tmp_path):
+        from database import ShardedDatabase
+
+        user = sharded.add_user("mover", "mover@example.com", "pw")
+        sharded.add_task(user["id"], "作业", "2025-01-01")
+        sharded.close_connection()
+
+        resized = ShardedDatabase(str(tmp_path / "directory.db"), shard_count=5)
+        try:
+            assert [t["name"] for t in resized.get_tasks(user["id"])] == ["作业"]
+        finally:
+            resized.close_connection()
+
+    def test_cross_shard_free_slots_and_import(self, sharded):
+        users = [sharded.add_user(f"f{i}", f"f{i}@example.com", "pw") for i in range(3)]
+        for i, user in enumerate(users):
+            sharded.add_course_schedule(user["id"], "课", "", "", 0, [i])
+        assert sharded.find_free_slots([u["id"] for u in users])["free"][:2] == [3, 4]
+
+        records = list(sharded.export_user(users[0]["id"]))
+        records[1].update(username="copy", email="copy@example.com")
+        result = sharded.import_user(iter(records))
+        assert result["course_schedules"] == 1
+        assert sharded.get_course_schedules(result["userId"])[0]["times"] == [0]
+        assert sharded.find_user_by_username_or_email("copy")["id"] == result["userId"]
+
+
+class TestBulkInsert:
+    """批量写入测试"""
+
+    def test_add_notes_bulk_returns_rows_in_input_order(self, mock_db, test_user):
+        user_id = test_user['id']
+        mock_db.add_course_to_user(user_id, "高数", [])
+        mock_db.add_course_to_user(user_id, "英语", [])
+        notes = [
+            {"title": f"笔记{i}", "lessonName": "高数" if i % 2 else "英语", "files": [f"f{i}.pdf"]}
+            for i in range(5)
+        ]
+        notes.insert(2, {"title": "孤儿", "lessonName": "不存在", "files": []})
+
+        created = mock_db.add_notes_bulk(user_id, notes)
+        assert created[2] is None
+        for note, row in zip(notes, created):
+            if row is not None:
+                assert row["name"] == note["title"]
+                assert row["file"] == note["files"][0]
+        ids = [row["id"] for row in created if row]
+        assert ids == sorted(ids)
+
+    def test_add_cloud_results_is_one_transaction(self, mock_db, test_user):
+        user_id = test_user['id']
+        mock_db.add_course_to_user(user_id, "高数", [])
+        notes = [{"title": f"讲义{i}", "lessonName": "高数", "files": [f"{i}.pdf"]} for i in range(50)]
+        tasks = [
+            {"name": f"作业{i}", "deadline": f"2025-01-{i % 28 + 1:02d}", "message": "", "status": "1"}
+            for i in range(40)
+        ]
+        conn = mock_db.get_db_connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            written = mock_db.add_cloud_results(user_id, notes, tasks)
+        finally:
+            conn.set_trace_callback(None)
+
+        assert len(written["notes"]) == 50 and all(written["notes"])
+        assert [t["name"] for t in written["tasks"]] == [t["name"] for t in tasks]
+        assert sum(1 for sql in statements if sql.strip().upper() == "COMMIT") == 1
+        assert len(mock_db.get_tasks(user_id)) == 40
+
+    def test_add_tasks_bulk_skips_incomplete_items(self, mock_db, test_user):
+        user_id = test_user['id']
+        created = mock_db.add_tasks_bulk(
+            user_id, [{"name": "作业1", "deadline": "2025-01-01"}, {"name": None, "deadline": "x"}]
+        )
+        assert [t["name"] for t in created] == ["作业1"]
+
+
+class TestSearch:
+    """全文检索测试"""
+
+    def test_index_follows_updates_and_deletes(self, mock_db, test_user):
+        user_id = test_user['id']
+        mock_db.add_course_to_user(user_id, "Operating Systems", ["kernel"])
+        assert [r["kind"] for r in mock_db.search(user_id, "kernel")] == ["course"]
+
+        mock_db.edit_course(user_id, "Operating Systems", "Compilers")
+        assert mock_db.search(user_id, "Operating") == []
+        assert mock_db.search(user_id, "Compilers")[0]["title"] == "<mark>Compilers</mark>"
+
+        conn = mock_db.get_db_connection()
+        with conn:
+            conn.execute("DELETE FROM courses WHERE user_id = ?", (user_id,))
+        assert mock_db.search(user_id, "Compilers") == []
+
+    def test_existing_rows_are_backfilled(self, mock_db, test_user):
+        user_id = test_user['id']
+        mock_db.add_task(user_id, "reading list", "2025-03-01")
+        conn = mock_db.get_db_connection()
+        conn.execute("DROP TABLE search_index")
+        conn.execute("DELETE FROM schema_version WHERE version >= 3")
+        conn.commit()
+        mock_db.setup_database()
+        assert [r["kind"] for r in mock_db.search(user_id, "reading")] == ["task"]
+
+
+class TestMigrations:
+    """schema 迁移测试"""
+
+    def test_fresh_database_is_at_latest_version(self, mock_db):
+        from database.migrations import MIGRATIONS, latest_version, migrate, schema_version
+
+        conn = mock_db.get_db_connection()
+        assert schema_version(conn) == latest_version()
+        versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+        assert versions == [version for version, _, _ in MIGRATIONS]
+
+    def test_migrated_database_opens_with_one_query(self, mock_db):
+        # Database 构造时已完成迁移，再次 setup 只读取版本号
+        conn = mock_db.get_db_connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            mock_db.setup_database()
+        finally:
+            conn.set_trace_callback(None)
+        assert len(statements) == 1
+
+    def test_unversioned_database_is_adopted(self, mock_db, test_user):
+        from database.migrations import MIGRATIONS, latest_version, migrate, schema_version
+
+        # 迁移机制引入之前建好的数据库：表都已存在，但没有 schema_version
+        conn = mock_db.get_db_connection()
+        conn.execute("DROP TABLE schema_version")
+        conn.commit()
+        assert schema_version(conn) == 0
+
+        assert migrate(conn) == [version for version, _, _ in MIGRATIONS]
+        assert schema_version(conn) == latest_version()
+        assert mock_db.get_user(test_user['id'])['username'] == test_user['username']
+        assert migrate(conn) == []
+
+
+class TestInstrumentation:
+    """查询统计测试"""
+
+    def test_disabled_by_default(self, mock_db):
+        assert mock_db.metrics is None
+        assert mock_db.query_stats() is None
+
+    def test_records_latency_rows_and_slow_plans(self, tmp_path, capsys):
+        from database import Database
+
+        db = Database(str(tmp_path / "instrumented.db"), instrument=True, slow_query_ms=0)
+        try:
+            user = db.add_user("probe", "probe@example.com", "pw")
+            db.add_course_to_user(user["id"], "高数", [])
+            db.add_course_to_user(user["id"], "英语", [])
+            db.metrics.start_scope()
+            db.get_user_with_courses_and_notes(user["id"])
+            scope = db.metrics.end_scope()
+            assert scope["queries"] == 3
+
+            stats = db.query_stats()
+            by_sql = {s["sql"]: s for s in stats["statements"]}
+            courses = by_sql["SELECT c.* FROM courses c WHERE c.user_id = ?"]
+            assert courses["count"] == 1 and courses["rows"] == 2
+            assert sum(courses["histogram"].values()) == 1
+
+            # slow_query_ms=0：每条语句都按慢查询记录执行计划
+            slow = [q for q in stats["slow_queries"] if "FROM courses" in q["sql"]]
+            assert slow and any("courses" in line for line in slow[-1]["plan"])
+            assert "慢查询" in capsys.readouterr().out
+        finally:
+            db.close()
+
+
+class TestQueryPlans:
+    """执行计划回归测试：每条语句都走索引"""
+
+    def test_every_statement_uses_an_index(self, tmp_path):
+        from database.bench_plans import WORKLOAD, required_methods, run
+
+        statements, problems = run(users=60, per_user=8, repeat=2, workdir=tmp_path)
+        assert problems == []
+        assert required_methods() <= set(WORKLOAD)
+        issued_by = {method for s in statements for method in s["methods"]}
+        assert issued_by == set(WORKLOAD)
+        assert all(s["p50_ms"] <= s["p99_ms"] for s in statements)
+
+    def test_detects_table_scan(self):
+        import sqlite3
+        from database.bench_plans import explain, scanned_tables
+
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT)")
+        sql = "SELECT id FROM notes WHERE user_id = ? AND name = ?"
+        assert scanned_tables(explain(conn, sql, (1, "n"))) == ["notes"]
+        conn.execute("CREATE INDEX ix_notes_user_id ON notes(user_id)")
+        assert scanned_tables(explain(conn, sql, (1, "n"))) == []
+        assert scanned_tables(explain(conn, "SELECT * FROM (VALUES (1), (2))", ())) == []
+        conn.close()
+
+
+class TestPagination:
+    """键集分页测试"""
+
+    def test_notes_page_filters_by_course(self, mock_db, test_user):
+        user_id = test_user['id']
+        mock_db.add_course_to_user(user_id, "高数", [])
+        mock_db.add_course_to_user(user_id, "英语", [])
+        for i in range(5):
+            mock_db.add_note(f"高数{i}", "高数", [], [], user_id)
+            mock_db.add_note(f"英语{i}", "英语", [], [], user_id)
+
+        page = mock_db.get_notes_page(user_id, limit=3, course_title="英语")
+        assert [n["name"] for n in page["items"]] == ["英语0", "英语1", "英语2"]
+        rest = mock_db.get_notes_page(user_id, limit=3, cursor=page["nextCursor"], course_title="英语")
+        assert [n["name"] for n in rest["items"]] == ["英语3", "英语4"]
+        assert rest["nextCursor"] is None
+        assert {n["lessonName"] for n in page["items"] + rest["items"]} == {"英语"}
+
+    def test_pages_use_composite_indexes(self, mock_db, test_user):
+        conn = mock_db.get_db_connection()
+        plan = " ".join(
+            row[-1]
+            for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM tasks WHERE user_id = ? AND has_deadline = ? "
+                "AND (deadline_at, id) > (?, ?) ORDER BY deadline_at, id LIMIT 10",
+                (1, 1, 1735660800, 0),
+            )
+        )
+        assert "ix_tasks_user_due" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+class TestDeadlines:
+    """截止时间解析与范围查询测试"""
+
+    @pytest.mark.parametrize("value, expected", [
+        ("2025-01-15 23:59:59", "2025-01-15 23:59:59+08:00"),
+        ("2025-01-15T08:00:00+00:00", "2025-01-15 16:00:00+08:00"),
+        ("2025/01/15 12:30", "2025-01-15 12:30:00+08:00"),
+        ("2025-01-15", "2025-01-15 23:59:59+08:00"),
+        ("2025年1月15日 09:00", "2025-01-15 09:00:00+08:00"),
+    ])
+    def test_parse_deadline(self, value, expected):
+        from database.deadlines import parse_deadline
+
+        assert parse_deadline(value) == int(datetime.fromisoformat(expected).timestamp())
+
+    @pytest.mark.parametrize("value", [None, "", "None", "null", "下周一", "2025-13-45"])
+    def test_unknown_deadlines(self, value):
+        from database.deadlines import deadline_columns
+
+        text, deadline_at, has_deadline = deadline_columns(value)
+        assert deadline_at is None and has_deadline == 0
+        assert text != "None"
+
+    @pytest.mark.parametrize("value", [float("nan"), float("inf"), -float("inf"), 2.0 ** 63])
+    def test_invalid_timestamps_are_rejected(self, value):
+        from database.deadlines import parse_deadline
+
+        with pytest.raises(ValueError):
+            parse_deadline(value)
+        assert parse_deadline(1736870400.5) == 1736870400
+
+    def test_inserts_skip_invalid_timestamps(self, mock_db, test_user):
+        user_id = test_user['id']
+        assert mock_db.add_task(user_id, "坏", float("nan")) is None
+        created = mock_db.add_tasks_bulk(user_id, [
+            {"name": "无穷", "deadline": float("inf")},
+            {"name": "好", "deadline": "2025-01-02"},
+        ])
+        assert [t["name"] for t in created] == ["好"]
+        assert [t["name"] for t in mock_db.get_tasks(user_id)] == ["好"]
+
+    def test_tasks_sort_chronologically_and_undated_last(self, mock_db, test_user):
+        user_id = test_user['id']
+        mock_db.update_deadlines(user_id, [
+            {"name": "无期限", "deadline": None},
+            {"name": "二月", "deadline": "2025/02/01"},
+            {"name": "一月", "deadline": "2025-01-20 10:00"},
+            {"name": "十二月", "deadline": "2024-12-31T23:00:00"},
+        ])
+        assert [t["name"] for t in mock_db.get_tasks(user_id)] == ["十二月", "一月", "二月", "无期限"]
+
+        names = []
+        page = mock_db.get_tasks_page(user_id, limit=3)
+        names += [t["name"] for t in page["items"]]
+        page = mock_db.get_tasks_page(user_id, limit=3, cursor=page["nextCursor"])
+        names += [t["name"] for t in page["items"]]
+        assert names == ["十二月", "一月", "二月", "无期限"]
+        assert page["nextCursor"] is None
+
+    def test_upcoming_uses_range_scan(self, mock_db, test_user):
+        from database.deadlines import parse_deadline
+
+        user_id = test_user['id']
+        mock_db.update_deadlines(user_id, [
+            {"name": "过期", "deadline": "2025-01-01 00:00"},
+            {"name": "明天", "deadline": "2025-01-11 09:00"},
+            {"name": "下周", "deadline": "2025-01-16 09:00"},
+            {"name": "下月", "deadline": "2025-02-20 09:00"},
+            {"name": "无期限", "deadline": "None"},
+        ])
+        now = parse_deadline("2025-01-10 12:00")
+        upcoming = mock_db.get_upcoming_tasks(user_id, days=7, now=now)
+        assert [t["name"] for t in upcoming] == ["明天", "下周"]
+        assert upcoming[0]["deadlineAt"] == parse_deadline("2025-01-11 09:00")
+
+        plan = " ".join(
+            row[-1]
+            for row in mock_db.get_db_connection().execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM tasks WHERE user_id = ? AND has_deadline = 1 "
+                "AND deadline_at >= ? AND deadline_at < ? ORDER BY deadline_at, id",
+                (user_id, 0, 1),
+            )
+        )
+        assert "ix_tasks_user_due (user_id=? AND has_deadline=? AND deadline_at>? AND deadline_at<?)" in plan
+
+    def test_migration_backfills_existing_rows(self, mock_db, test_user):
+        user_id = test_user['id']
+        conn = mock_db.get_db_connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO tasks (name, deadline, user_id) VALUES (?, ?, ?)",
+                [("旧任务", "2025-03-01 08:00", user_id), ("LLM 空值", "None", user_id)],
+            )
+            conn.execute("DELETE FROM schema_version WHERE version >= 5")
+        mock_db.setup_database()
+
+        rows = {r["name"]: r for r in conn.execute("SELECT * FROM tasks WHERE user_id = ?", (user_id,))}
+        assert rows["旧任务"]["has_deadline"] == 1 and rows["旧任务"]["deadline_at"] is not None
+        assert rows["LLM 空值"]["deadline"] == "" and rows["LLM 空值"]["has_deadline"] == 0
+
+
+class TestBlobStore:
+    """内容寻址存储测试"""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        from database.blobstore import BlobStore
+
+        return BlobStore(tmp_path / "blobs")
+
+    @pytest.fixture
+    def db(self, tmp_path):
+        from database.database import Database
+
+        db = Database(str(tmp_path / "blobs.db"))
+        yield db
+        db.close()
+
+    def test_same_content_is_stored_once(self, store):
+        import hashlib
+        import io
+
+        first = store.put_stream(io.BytesIO(b"lecture"))
+        second = store.put_stream(io.BytesIO(b"lecture"))
+        assert first == second == {"sha256": hashlib.sha256(b"lecture").hexdigest(), "size": 7}
+        assert list(store.iter_digests()) == [first["sha256"]]
+        assert store.path(first["sha256"]).read_bytes() == b"lecture"
+        # 临时文件已改名或删除
+        assert list(store.tmp_dir.iterdir()) == []
+        with pytest.raises(ValueError):
+            store.put_stream(io.BytesIO(b"other"), expected=first["sha256"])
+        assert list(store.iter_digests()) == [first["sha256"]]
+
+    def test_refcount_follows_notes(self, db, store):
+        import io
+
+        blob = store.put_stream(io.BytesIO(b"slides"))
+        refcount = lambda: db.get_db_connection().execute(
+            "SELECT refcount, size FROM blobs WHERE sha256 = ?", (blob["sha256"],)
+        ).fetchone()
+        alice = db.add_user("alice", "alice@example.com", "pw")["id"]
+        bob = db.add_user("bob", "bob@example.com", "pw")["id"]
+        db.add_course_to_user(alice, "课程", [])
+        db.add_course_to_user(bob, "课程", [])
+        db.add_note("讲义", "课程", [], ["a.pdf"], alice, blob)
+        db.add_note("讲义", "课程", [], ["a.pdf"], bob, blob)
+        assert tuple(refcount()) == (2, 6)
+        # 同一用户多次引用同一文件只计一次用量
+        db.add_note("讲义副本", "课程", [], ["b.pdf"], alice, blob)
+        assert db.get_storage_usage(alice) == 6
+        assert refcount()["refcount"] == 3
+        assert db.find_note(alice, "课程", "讲义")["note"]["sha256"] == blob["sha256"]
+
+        # 级联删除同样减少引用计数
+        db.delete_user(alice)
+        assert refcount()["refcount"] == 1
+        assert db.get_storage_usage(alice) == 0
+        assert db.unreferenced_blobs() == []
+        db.delete_user(bob)
+        assert db.unreferenced_blobs() == [blob["sha256"]]
+
+    def test_garbage_collection_respects_grace(self, db, store):
+        import io
+
+        user_id = db.add_user("gc", "gc@example.com", "pw")["id"]
+        db.add_course_to_user(user_id, "课程", [])
+        kept = store.put_stream(io.BytesIO(b"kept"))
+        dropped = store.put_stream(io.BytesIO(b"dropped"))
+        stray = store.put_stream(io.BytesIO(b"stray"))
+        db.add_note("保留", "课程", [], ["k.pdf"], user_id, kept)
+        db.add_note("删除", "课程", [], ["d.pdf"], user_id, dropped)
+        with db.get_db_connection() as conn:
+            conn.execute("DELETE FROM notes WHERE name = '删除'")
+
+        # 宽限期内什么都不删
+        assert store.collect_garbage(db, grace_s=3600)["removed"] == 0
+        result = store.collect_garbage(db, grace_s=0)
+        assert result["removed"] == 2 and result["bytes"] == len(b"dropped") + len(b"stray")
+        assert sorted(store.iter_digests()) == [kept["sha256"]]
+        assert db.known_blobs([kept["sha256"], dropped["sha256"], stray["sha256"]]) == {kept["sha256"]}
+
+    def test_garbage_collection_keeps_blob_reused_concurrently(self, db, store, monkeypatch):
+        import io
+        import os
+        import time
+
+        user_id = db.add_user("race", "race@example.com", "pw")["id"]
+        db.add_course_to_user(user_id, "课程", [])
+        blob = store.put_stream(io.BytesIO(b"reused"))
+        db.add_note("旧", "课程", [], ["r.pdf"], user_id, blob)
+        with db.get_db_connection() as conn:
+            conn.execute("DELETE FROM notes WHERE name = '旧'")
+        old = time.time() - 3600
+        os.utime(store.path(blob["sha256"]), (old, old))
+
+        forget_blob = db.forget_blob
+
+        def forget_then_reupload(digest):
+            # 回收判断可以删除之后，同样内容被重新上传并被新笔记引用
+            forgotten = forget_blob(digest)
+            assert store.put_stream(io.BytesIO(b"reused")) == blob
+            db.add_note("新", "课程", [], ["r.pdf"], user_id, blob)
+            return forgotten
+
+        monkeypatch.setattr(db, "forget_blob", forget_then_reupload)
+        assert store.collect_garbage(db, grace_s=60)["removed"] == 0
+        assert store.path(blob["sha256"]).read_bytes() == b"reused"
+        assert list(store.gc_dir.iterdir()) == []
+        assert db.known_blobs([blob["sha256"]]) == {blob["sha256"]}
+
+    def test_quota_is_checked_inside_the_write(self, db):
+        from database.database import QuotaExceeded
+
+        user_id = db.add_user("quota", "quota@example.com", "pw")["id"]
+        db.add_course_to_user(user_id, "课程", [])
+        first, second = {"sha256": "a" * 64, "size": 6}, {"sha256": "b" * 64, "size": 6}
+        assert db.add_note("一", "课程", [], ["a.pdf"], user_id, first, quota=10)
+        with pytest.raises(QuotaExceeded) as excinfo:
+            db.add_note("二", "课程", [], ["b.pdf"], user_id, second, quota=10)
+        assert excinfo.value.used == 6
+        # 已经引用的文件不重复计入用量
+        assert db.add_note("一副本", "课程", [], ["a.pdf"], user_id, first, quota=10)
+
+        upload = db.create_upload(user_id, "录像", "课程", "b.pdf", 6)
+        with pytest.raises(QuotaExceeded):
+            db.complete_upload(user_id, upload["id"], second, quota=10)
+        assert db.get_upload(user_id, upload["id"]) is not None
+        assert db.get_storage_usage(user_id) == 6
+        assert db.known_blobs([second["sha256"]]) == set()
+
+    def test_migrate_legacy_files(self, db, store, tmp_path):
+        from database.blobstore import migrate_legacy_files
+
+        root = tmp_path / "uploads"
+        user_id = db.add_user("old", "old@example.com", "pw")["id"]
+        db.add_course_to_user(user_id, "课程", [])
+        for name, file, content in [("讲义", "a.pdf", b"aaa"), ("讲义", "a.pdf", b"aaa"), ("作业", "b.pdf", b"bb")]:
+            db.add_note(name, "课程", [], [file], user_id)
+            path = root / str(user_id) / "课程" / name / file
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+        db.add_note("丢失", "课程", [], ["c.pdf"], user_id)
+        db.add_note("无文件", "课程", [], [], user_id)
+        assert len(db.legacy_note_files()) == 4
+
+        result = migrate_legacy_files(db, store, root, batch_size=2)
+        # 同名笔记共用一个目录，两条记录都指向同一文件
+        assert result == {"migrated": 3, "missing": 1, "bytes": 8}
+        assert len(list(store.iter_digests())) == 2
+        assert list(root.iterdir()) == []
+        assert [row["name"] for row in db.legacy_note_files()] == ["丢失"]
+        refcounts = db.get_db_connection().execute("SELECT refcount, size FROM blobs ORDER BY size").fetchall()
+        assert [tuple(row) for row in refcounts] == [(1, 2), (2, 3)]
+
+        # 改名只更新数据库，文件仍可找到
+        db.edit_course(user_id, "课程", "新课程")
+        db.edit_note(user_id, "新课程", "作业", "新作业")
+        assert store.exists(db.find_note(user_id, "新课程", "新作业")["note"]["sha256"])
+        assert migrate_legacy_files(db, store, root) == {"migrated": 0, "missing": 1, "bytes": 0}
+
+    def test_sharded_forget_requires_every_shard(self, tmp_path, store):
+        import io
+        from database.sharding import ShardedDatabase
+
+        db = ShardedDatabase(str(tmp_path / "directory.db"), shard_count=2)
+        try:
+            blob = store.put_stream(io.BytesIO(b"shared"))
+            users = [db.add_user(f"u{i}", f"u{i}@example.com", "pw")["id"] for i in range(2)]
+            for user_id in users:
+                db.add_course_to_user(user_id, "课程", [])
+                db.add_note("讲义", "课程", [], ["s.pdf"], user_id, blob)
+            db.delete_user(users[0])
+            # 另一个分片仍引用该文件
+            assert db.unreferenced_blobs() == [blob["sha256"]]
+            assert db.forget_blob(blob["sha256"]) is False
+            assert store.collect_garbage(db, grace_s=0)["removed"] == 0
+            db.delete_user(users[1])
+            assert store.collect_garbage(db, grace_s=0)["removed"] == 1
+        finally:
+            db.close()
+
+
+class TestResumableUpload:
+    """可续传上传测试"""
+
+    def test_received_ranges_are_merged(self, tmp_path):
+        from database.database import Database
+
+        db = Database(str(tmp_path / "uploads.db"))
+        try:
+            user_id = db.add_user("up", "up@example.com", "pw")["id"]
+            upload = db.create_upload(user_id, "录像", "课程", "rec.mp4", 100, ["视频"])
+            assert upload["tags"] == ["视频"] and upload["received"] == []
+            for start, end in [(50, 100), (0, 10), (10, 30), (20, 40)]:
+                assert db.add_upload_chunk(user_id, upload["id"], start, end)
+            upload = db.get_upload(user_id, upload["id"])
+            assert upload["received"] == [[0, 40], [50, 100]] and upload["complete"] is False
+            db.add_upload_chunk(user_id, upload["id"], 40, 50)
+            assert db.get_upload(user_id, upload["id"])["complete"] is True
+            # 其他用户无权访问
+            assert db.get_upload(user_id + 1, upload["id"]) is None
+            assert db.add_upload_chunk(user_id + 1, upload["id"], 0, 1) is False
+        finally:
+            db.close()
+
+    def test_parallel_chunks_and_abandoned_sessions(self, tmp_path):
+        import hashlib
+        import io
+        from concurrent.futures import ThreadPoolExecutor
+        from database.blobstore import BlobStore
+        from database.database import Database
+
+        db = Database(str(tmp_path / "uploads.db"))
+        store = BlobStore(tmp_path / "blobs")
+        try:
+            user_id = db.add_user("up", "up@example.com", "pw")["id"]
+            content = bytes(range(256)) * 64
+            upload = db.create_upload(user_id, "录像", "课程", "rec.mp4", len(content), now=1000)
+
+            def write(offset):
+                chunk = content[offset:offset + 1024]
+                assert store.write_chunk(upload["id"], offset, io.BytesIO(chunk), len(chunk)) == len(chunk)
+                db.add_upload_chunk(user_id, upload["id"], offset, offset + len(chunk), now=1000)
+
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                list(pool.map(write, range(0, len(content), 1024)))
+            assert db.get_upload(user_id, upload["id"])["complete"] is True
+            blob = store.hash_upload(upload["id"], len(content), hashlib.sha256(content).hexdigest())
+            store.commit_upload(upload["id"], blob)
+            assert store.path(blob["sha256"]).read_bytes() == content
+            assert db.delete_upload(user_id, upload["id"]) is True
+
+            abandoned = db.create_upload(user_id, "中断", "课程", "x.bin", 10, now=1000)
+            store.write_chunk(abandoned["id"], 0, io.BytesIO(b"12345"), 5)
+            fresh = db.create_upload(user_id, "进行中", "课程", "y.bin", 10, now=2000)
+            assert store.collect_uploads(db, ttl_s=500, now=2000) == {"removed": 1}
+            assert db.get_upload(user_id, abandoned["id"]) is None
+            assert db.get_upload(user_id, fresh["id"]) is not None
+            assert not store.upload_path(abandoned["id"]).exists()
+        finally:
+            db.close()
+
+    def test_complete_upload_claims_session_once(self, tmp_path):
+        from database.database import Database
+
+        db = Database(str(tmp_path / "uploads.db"))
+        try:
+            user_id = db.add_user("up", "up@example.com", "pw")["id"]
+            blob = {"sha256": "a" * 64, "size": 3}
+            upload = db.create_upload(user_id, "录像", "课程", "rec.mp4", 3)
+            # 课程不存在：回滚，会话保留
+            assert db.complete_upload(user_id, upload["id"], blob) is False
+            assert db.get_upload(user_id, upload["id"]) is not None
+            db.add_course_to_user(user_id, "课程", [])
+            note = db.complete_upload(user_id, upload["id"], blob)
+            assert note["name"] == "录像" and note["blob_sha256"] == blob["sha256"]
+            assert db.complete_upload(user_id, upload["id"], blob) is None
+            assert db.get_upload(user_id, upload["id"]) is None
+        finally:
+            db.close()
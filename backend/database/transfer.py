@@ -0,0 +1,229 @@
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from pathlib import Path, PurePosixPath
+
+# 导出格式：每行一个 JSON 对象（NDJSON），"type" 为记录类型
+EXPORT_FORMAT = "pku-intelligence-export"
+EXPORT_VERSION = 1
+
+# 各表导出的列（不含 id、user_id）；按此顺序导出，父表在子表之前
+EXPORT_COLUMNS = {
+    "courses": ("title", "tags"),
+    "notes": ("course_id", "name", "file", "blob_sha256"),
+    "tasks": ("name", "deadline", "message", "status", "created_at"),
+    "link_categories": ("category", "icon", "sort_order", "created_at"),
+    "useful_links": ("category_id", "name", "url", "description", "is_trusted", "sort_order", "created_at"),
+    "course_schedules": ("name", "teacher", "location", "week_type", "created_at"),
+}
+# 导入时必须提供的列
+REQUIRED_COLUMNS = {
+    "courses": ("title",),
+    "notes": ("course_id", "name"),
+    "tasks": ("name",),
+    "link_categories": ("category", "icon"),
+    "useful_links": ("category_id", "name", "url"),
+    "course_schedules": ("name",),
+}
+# 子表中引用父表 id 的列：导入时按新分配的 id 重新映射
+PARENT_COLUMNS = {"course_id": "courses", "category_id": "link_categories"}
+
+# tar 归档：先是 data.ndjson，然后是 files/ 下的上传文件（相对用户目录的路径），
+# 最后是 blobs/<sha256>：笔记引用的内容寻址存储中的文件
+DATA_MEMBER = "data.ndjson"
+FILES_PREFIX = "files/"
+BLOBS_PREFIX = "blobs/"
+CHUNK_SIZE = 64 * 1024
+# data.ndjson 在内存中最多缓冲这么多字节，超过后落到临时文件
+SPOOL_MAX_BYTES = 1024 * 1024
+_BLOCK = tarfile.BLOCKSIZE
+
+
+def ndjson_lines(records):
+    """记录 -> 逐行产出的 NDJSON 字节串。"""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def parse_ndjson(lines):
+    """逐行解析 NDJSON（可迭代的 bytes/str 行），空行跳过；格式错误时抛出 ValueError。"""
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {number} 行不是合法的 JSON: {e}") from None
+        if not isinstance(record, dict) or not isinstance(record.get("type"), str):
+            raise ValueError(f"第 {number} 行缺少 type 字段")
+        yield record
+
+
+def spool_records(records):
+    """
+    先把全部记录读入临时文件（小于 SPOOL_MAX_BYTES 时留在内存），返回逐条重新读取的迭代器。
+    records 通常是对请求体的流式解析：JSON 格式错误在写事务开始之前就抛出，
+    导入的写事务只读取本地的临时文件，上传再慢也不会一直占着写锁。
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        for record in records:
+            spool.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return _read_spool(spool)
+
+
+def _read_spool(spool):
+    with spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+def _tar_member(name, size, fileobj, mtime):
+    """产出一个 tar 成员：头部、按块读取的内容、补齐到 512 字节的填充。"""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    # PAX 格式支持中文等非 ASCII 文件名
+    yield info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+    remaining = size
+    while remaining > 0:
+        chunk = fileobj.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            # 文件在导出过程中被截断，用 0 补足头部声明的长度
+            chunk = b"\0" * min(CHUNK_SIZE, remaining)
+        yield chunk
+        remaining -= len(chunk)
+    if size % _BLOCK:
+        yield b"\0" * (_BLOCK - size % _BLOCK)
+
+
+def tar_stream(records, files_root, blob_store=None):
+    """
+    把记录和 files_root 下的所有文件打成 tar 流，逐块产出字节串。
+    tar 头部需要成员长度，data.ndjson 先写入临时文件（小于 SPOOL_MAX_BYTES 时留在内存）；
+    上传文件按块读取，内存占用与文件大小无关。
+    给出 blob_store 时，笔记记录引用的文件以 blobs/<sha256> 附在最后。
+    """
+    files_root = Path(files_root)
+    # 按出现顺序去重：多条笔记可以引用同一个文件
+    digests = {}
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as data:
+        for record in records:
+            if record.get("type") == "notes" and record.get("blob_sha256"):
+                digests[record["blob_sha256"]] = None
+            data.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        size = data.tell()
+        data.seek(0)
+        yield from _tar_member(DATA_MEMBER, size, data, time.time())
+
+    if files_root.is_dir():
+        for directory, dirnames, filenames in os.walk(files_root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = Path(directory) / filename
+                try:
+                    fileobj = open(path, "rb")
+                except OSError:
+                    # 导出期间被删除的文件直接跳过
+                    continue
+                with fileobj:
+                    st = os.fstat(fileobj.fileno())
+                    arcname = FILES_PREFIX + path.relative_to(files_root).as_posix()
+                    yield from _tar_member(arcname, st.st_size, fileobj, st.st_mtime)
+
+    if blob_store is not None:
+        for digest in digests:
+            try:
+                fileobj = blob_store.open(digest)
+            except (OSError, ValueError):
+                # 文件缺失（或摘要不合法）时只导出记录
+                continue
+            with fileobj:
+                st = os.fstat(fileobj.fileno())
+                yield from _tar_member(BLOBS_PREFIX + digest, st.st_size, fileobj, st.st_mtime)
+    # 归档结束标记：两个全 0 块
+    yield b"\0" * (2 * _BLOCK)
+
+
+def _safe_destination(root, relative):
+    """归档中的相对路径 -> root 下的目标路径；绝对路径或包含 .. 时返回 None。"""
+    path = PurePosixPath(relative)
+    if not relative or path.is_absolute() or ".." in path.parts:
+        return None
+    return Path(root).joinpath(*path.parts)
+
+
+def read_archive(fileobj, import_records, files_root, blob_store=None):
+    """
+    逐个成员读取 tar_stream 产生的归档（fileobj 只需支持顺序读取），全部读完后再导入。
+    data.ndjson 先暂存；blobs/<sha256> 成员校验摘要后写入 blob_store，摘要不符的成员被跳过；
+    files/ 成员先写到 files_root 下的临时目录。之后调用 import_records(records, blobs) 导入，
+    blobs 为本归档中写入存储的文件 {sha256: size}，返回值需包含新数据所属的 "userId"；
+    导入成功后把 files/ 成员移到 files_root/<userId>/ 下，路径越出该目录的成员被跳过。
+    返回 import_records 的结果并附带写入的文件数；import_records 返回 None 时直接返回 None
+    （已写入存储的文件无人引用，由回收清理）。归档格式错误时抛出 ValueError。
+    """
+    files_root = Path(files_root)
+    files_root.mkdir(parents=True, exist_ok=True)
+    data = None
+    blobs = {}
+    staged = []
+    with tempfile.TemporaryDirectory(dir=files_root, prefix=".import-") as staging:
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+                for member in tar:
+                    if data is None:
+                        if member.name != DATA_MEMBER:
+                            raise ValueError(f"归档的第一个文件必须是 {DATA_MEMBER}")
+                        data = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+                        shutil.copyfileobj(tar.extractfile(member), data, CHUNK_SIZE)
+                        data.seek(0)
+                        continue
+                    if not member.isfile():
+                        continue
+                    if member.name.startswith(BLOBS_PREFIX) and blob_store is not None:
+                        try:
+                            blob = blob_store.put_stream(
+                                tar.extractfile(member), expected=member.name[len(BLOBS_PREFIX):]
+                            )
+                        except ValueError:
+                            continue
+                        blobs[blob["sha256"]] = blob["size"]
+                        continue
+                    if not member.name.startswith(FILES_PREFIX):
+                        continue
+                    relative = member.name[len(FILES_PREFIX):]
+                    destination = _safe_destination(staging, relative)
+                    if destination is None:
+                        # 绝对路径或 .. 可能写到用户目录之外，跳过
+                        continue
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    with open(destination, "wb") as out:
+                        shutil.copyfileobj(tar.extractfile(member), out, CHUNK_SIZE)
+                    staged.append(relative)
+        except tarfile.TarError as e:
+            raise ValueError(f"无法读取归档: {e}") from None
+        if data is None:
+            raise ValueError(f"归档中缺少 {DATA_MEMBER}")
+        with data:
+            result = import_records(parse_ndjson(data), blobs)
+        if result is None:
+            return None
+        user_root = files_root / str(result["userId"])
+        for relative in staged:
+            destination = _safe_destination(user_root, relative)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(_safe_destination(staging, relative), destination)
+    result["files"] = len(blobs) + len(staged)
+    return result
@@ -0,0 +1,147 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from .pool import ConnectionPool, PooledConnection
+
+
+class GroupCommitConnection(PooledConnection):
+    """
+    写线程专用连接。
+    Database 各方法里的 `with conn:` 在这里变成 SAVEPOINT：单个操作失败只回滚它自己，
+    真正的 COMMIT 由 WriteQueue 在一批操作执行完后统一完成。
+    """
+
+    def __enter__(self):
+        self.execute("SAVEPOINT write_op")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute("RELEASE write_op")
+        else:
+            try:
+                self.execute("ROLLBACK TO write_op")
+                self.execute("RELEASE write_op")
+            except sqlite3.Error:
+                # 整个事务已被 SQLite 中止，交给 WriteQueue 处理
+                pass
+        return False
+
+    def commit(self):
+        # 由 WriteQueue 统一提交
+        pass
+
+
+class WriteQueue:
+    """
+    单写线程队列。
+    所有写操作都在同一个线程、同一个连接上执行；队列中积压的操作
+    （最多 batch_size 个，或在第一个操作到达后再等待 batch_ms 毫秒）
+    合并进一个事务提交，调用方阻塞到所在批次提交完成。
+    """
+
+    def __init__(self, db_path, bind, batch_size=64, batch_ms=2.0, **pool_options):
+        self.batch_size = max(1, int(batch_size))
+        self.batch_ms = float(batch_ms)
+        self._bind = bind
+        self._pool = ConnectionPool(
+            db_path, max_size=1, connection_factory=GroupCommitConnection, **pool_options
+        )
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {"ops": 0, "batches": 0, "failed_batches": 0, "max_batch": 0}
+        self._thread = threading.Thread(
+            target=self._run, name="sqlite-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """在写线程上执行 fn，阻塞到其所在批次提交后返回结果。"""
+        if threading.current_thread() is self._thread:
+            # 写操作内部嵌套调用其他写操作，直接在当前批次中执行
+            return fn(*args, **kwargs)
+        if not self._thread.is_alive():
+            raise sqlite3.ProgrammingError("写线程已停止")
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future.result()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.batch_ms / 1000
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                # 先处理完当前批次，再退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = self._pool.acquire()
+        self._bind(conn)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = self._collect(item)
+            outcomes = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for future, fn, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        outcomes.append((future, fn(*args, **kwargs), None))
+                    except BaseException as e:
+                        outcomes.append((future, None, e))
+                sqlite3.Connection.commit(conn)
+            except sqlite3.Error as e:
+                try:
+                    sqlite3.Connection.rollback(conn)
+                except sqlite3.Error:
+                    pass
+                with self._stats_lock:
+                    self._stats["failed_batches"] += 1
+                for future, _, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            with self._stats_lock:
+                self._stats["ops"] += len(outcomes)
+                self._stats["batches"] += 1
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(outcomes))
+            for future, result, error in outcomes:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        self._bind(None)
+        self._pool.release(conn)
+        self._pool.close()
+
+    def close(self, timeout=None):
+        """处理完队列中剩余的操作后停止写线程。"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def stats(self):
+        """写队列统计：ops、batches、max_batch、当前排队数。"""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["queued"] = self._queue.qsize()
+        return snapshot
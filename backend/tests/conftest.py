@@ -37,9 +37,9 @@ def _clean_state():
         DELETE FROM link_categories;
         DELETE FROM useful_links;
         DELETE FROM tasks;
-        DELETE FROM course_schedule_times;
         DELETE FROM course_schedules;
         DELETE FROM users WHERE id != 1;
+        DELETE FROM blobs;
         """
     )
     conn.commit()
@@ -1,5 +1,7 @@
 from typing import Dict
 
+import pytest
+
 
 def _register_user(client, username="alice", email="alice@example.com", password="secret") -> Dict:
     resp = client.post(
@@ -108,3 +110,142 @@ def test_create_course_attaches_to_user(client):
     user_payload = userdata_resp.get_json()["data"]
     assert len(user_payload["courses"]) == 1
     assert user_payload["courses"][0]["name"] == "Algebra"
+
+
+def test_userdata_is_cached_and_invalidated_on_change(client):
+    from backend import app as backend_app
+
+    user = _register_user(client, username="cache", email="cache@example.com")
+    first = client.get("/userdata", query_string={"id": user["id"]})
+    hits_before = backend_app.USERDATA_CACHE.stats()["hits"]
+    second = client.get("/userdata", query_string={"id": user["id"]})
+    assert second.data == first.data
+    assert backend_app.USERDATA_CACHE.stats()["hits"] == hits_before + 1
+
+    client.post(
+        "/courses/create",
+        json={"title": "Cached", "tags": [], "userId": user["id"]},
+    )
+    third = client.get("/userdata", query_string={"id": user["id"]}).get_json()["data"]
+    assert [c["name"] for c in third["courses"]] == ["Cached"]
+
+
+
+def test_userdata_cache_is_not_reused_after_restore(client, tmp_path):
+    from backend import app as backend_app
+    from database.backup import backup_database, restore_backup
+
+    user = _register_user(client, username="restore", email="restore@example.com")
+    snapshot = tmp_path / "snap.db"
+    backup_database(backend_app.storage.db.db_path, snapshot)
+
+    def create(title):
+        client.post("/courses/create", json={"title": title, "tags": [], "userId": user["id"]})
+        return client.get("/userdata", query_string={"id": user["id"]}).get_json()["data"]["courses"]
+
+    assert [c["name"] for c in create("Before")] == ["Before"]
+    # 恢复后再做一次修改，版本号与上面缓存的那一份相同
+    restore_backup(snapshot, backend_app.storage.db.db_path)
+    assert [c["name"] for c in create("After")] == ["After"]
+
+def test_edit_link_category_replaces_links(client):
+    user = _register_user(client, username="linkedit", email="linkedit@example.com")
+    resp = client.post(
+        "/edit/linkcategory",
+        json={
+            "userId": user["id"],
+            "linkCategories": [
+                {
+                    "category": "Docs",
+                    "icon": "📚",
+                    "links": [{"name": "A", "url": "https://a.example", "isTrusted": True}],
+                }
+            ],
+        },
+    )
+    assert resp.status_code == 200
+    data = client.get("/userdata", query_string={"id": user["id"]}).get_json()["data"]
+    assert data["linkCategories"][0]["links"][0]["name"] == "A"
+
+
+@pytest.mark.parametrize(
+    "url, param",
+    [("/userdata", "id"), ("/schedule", "userId"), ("/links", "userId")],
+)
+def test_read_endpoints_support_etag(client, url, param):
+    user = _register_user(client, username="etag", email="etag@example.com")
+    first = client.get(url, query_string={param: user["id"]})
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert etag and not etag.startswith("W/")
+
+    cached = client.get(
+        url, query_string={param: user["id"]}, headers={"If-None-Match": etag}
+    )
+    assert cached.status_code == 304
+    assert cached.data == b""
+    assert cached.headers["ETag"] == etag
+
+    # 任意修改都会改变 ETag
+    client.post(
+        "/course-table",
+        json={"userId": user["id"], "name": "Algo", "times": [1]},
+    )
+    changed = client.get(
+        url, query_string={param: user["id"]}, headers={"If-None-Match": etag}
+    )
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_metrics_endpoint_and_query_count_header(client, monkeypatch):
+    from backend import app as backend_app
+    from backend.database.metrics import QueryMetrics
+
+    storage = backend_app.storage
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["pool"]["max_size"] >= 1
+    assert "hits" in body["userdataCache"]
+    assert body["queries"] is None
+    assert "X-Query-Count" not in resp.headers
+
+    # 运行时打开统计：连接池下一次创建游标起即生效
+    metrics = QueryMetrics(slow_ms=1000)
+    monkeypatch.setattr(storage.db._pool, "metrics", metrics)
+    monkeypatch.setattr(storage.db._pool, "cursor_factory", metrics.cursor_factory)
+
+    user = _register_user(client, username="metrics", email="metrics@example.com")
+    resp = client.get("/userdata", query_string={"id": user["id"]})
+    assert int(resp.headers["X-Query-Count"]) >= 3
+
+    queries = client.get("/metrics").get_json()["queries"]
+    assert any("FROM users WHERE id = ?" in s["sql"] for s in queries["statements"])
+
+
+def test_course_table_rejects_out_of_range_times(client):
+    user = _register_user(client, username="slots", email="slots@example.com")
+    resp = client.post(
+        "/course-table",
+        json={"userId": user["id"], "name": "Algo", "times": [0, 83]},
+    )
+    assert resp.status_code == 201
+    course = resp.get_json()["course"]
+    assert course["times"] == [0, 83]
+
+    for times in ([84], [-1], [True]):
+        resp = client.post(
+            "/course-table",
+            json={"userId": user["id"], "name": "Bad", "times": times},
+        )
+        assert resp.status_code == 400
+    resp = client.put(
+        f"/course-table/{course['id']}",
+        json={"userId": user["id"], "times": [42, 100]},
+    )
+    assert resp.status_code == 400
+
+    table = client.get("/schedule", query_string={"userId": user["id"]}).get_json()["courseTable"]
+    assert [c["times"] for c in table] == [[0, 83]]
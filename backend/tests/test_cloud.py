@@ -90,3 +90,46 @@ def test_cloud_course_download_branch(client, monkeypatch, tmp_path):
     assert data["success"] is True
     assert data["notes"][0]["status"] == "success"
     assert data["deadlines"][0]["name"] == "ddl1"
+    # LLM 没给出截止时间：记为无截止时间，而不是字符串 "None"
+    assert data["tasks"][0]["deadline"] == ""
+    assert data["tasks"][0]["has_deadline"] == 0
+
+
+def test_cloud_skips_tasks_with_invalid_deadlines(client, monkeypatch, tmp_path):
+    import requests
+
+    monkeypatch.setattr("backend.app.get_session", lambda x, y: requests.Session())
+    monkeypatch.setattr("backend.app.spider.download_handouts_for_course", lambda *args, **kwargs: [])
+    # LLM 清洗结果经 json.loads 后可能出现 NaN / Infinity
+    deadlines = [
+        {"name": "nan", "deadline": float("nan")},
+        {"name": "inf", "deadline": float("inf")},
+        {"name": "nan-text", "deadline": "NaN"},
+        {"name": "inf-text", "deadline": "inf"},
+        {"name": "ok", "deadline": "2025-01-02 10:00"},
+    ]
+    monkeypatch.setattr(
+        "backend.app.ddl_LLM.build_deadline_payload_with_llm",
+        lambda session, user_id: {"UserId": user_id, "deadlines": deadlines},
+    )
+    from backend import app as backend_app
+
+    backend_app._courses = [{"name": "CourseNaN"}]
+    user = client.post(
+        "/auth/register", json={"username": "nan", "email": "nan@example.com", "password": "pw"}
+    ).get_json()["user"]
+
+    resp = client.post(
+        "/cloud",
+        json={"userId": user["id"], "xuehao": "20250001", "password": "pwd", "course": 1},
+    )
+    assert resp.status_code == 200
+    assert [t["name"] for t in resp.get_json()["tasks"]] == ["nan-text", "inf-text", "ok"]
+
+    resp = client.get("/tasks", query_string={"userId": user["id"]})
+    assert resp.status_code == 200
+    tasks = {t["name"]: t for t in resp.get_json()["tasks"]}
+    assert set(tasks) == {"nan-text", "inf-text", "ok"}
+    # 文本形式的 NaN / inf 无法识别，按无截止时间保存
+    assert tasks["nan-text"]["deadline"] == "NaN"
+    assert tasks["ok"]["deadline"] == "2025-01-02 10:00"
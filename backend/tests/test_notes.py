@@ -1,8 +1,6 @@
 from io import BytesIO
 from typing import Dict
 
-import pytest
-
 
 def _register_user(client, username="note-user", email="note@example.com", password="secret") -> Dict:
     resp = client.post(
@@ -101,6 +99,337 @@ def test_upload_and_fetch_note_files(client):
     assert download_resp.data == b"hello world"
 
 
+def test_identical_uploads_share_one_blob(client):
+    from backend import app as backend_app
+
+    digests = []
+    for name in ("alice", "bob"):
+        user = _register_user(client, username=name, email=f"{name}@example.com")
+        _create_course(client, user["id"], title="CS101")
+        resp = client.post(
+            "/notes/upload",
+            data={
+                "title": "Slides",
+                "lessonName": "CS101",
+                "userId": str(user["id"]),
+                "files": [(BytesIO(b"same slides"), f"{name}.pdf")],
+            },
+            content_type="multipart/form-data",
+        )
+        assert resp.status_code == 200
+        digests.append(resp.get_json()["sha256"])
+
+        download = client.get(
+            "/notes/file",
+            query_string={"userId": user["id"], "lessonName": "CS101", "noteName": "Slides", "filename": f"{name}.pdf"},
+        )
+        assert download.status_code == 200
+        assert download.data == b"same slides"
+
+    assert digests[0] == digests[1]
+    assert list(backend_app.BLOB_STORE.iter_digests()) == [digests[0]]
+
+
+def test_raw_body_upload_streams_into_blob_store(client):
+    import hashlib
+
+    user = _register_user(client, username="raw", email="raw@example.com")
+    _create_course(client, user["id"], title="CS101")
+    payload = bytes(range(256)) * 8192  # 2 MiB，跨越多个读取块
+    resp = client.post(
+        "/notes/upload",
+        query_string={"title": "Recording", "lessonName": "CS101", "userId": user["id"], "filename": "rec.mp4"},
+        data=payload,
+        content_type="application/octet-stream",
+    )
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["saved_files"] == ["rec.mp4"]
+    assert body["sha256"] == hashlib.sha256(payload).hexdigest()
+
+    download = client.get(
+        "/notes/file",
+        query_string={"userId": user["id"], "lessonName": "CS101", "noteName": "Recording", "filename": "rec.mp4"},
+    )
+    assert download.data == payload
+
+
+def test_upload_enforces_user_quota(client, monkeypatch):
+    from backend import app as backend_app
+
+    monkeypatch.setattr(backend_app, "USER_QUOTA_BYTES", 10)
+    user = _register_user(client, username="quota", email="quota@example.com")
+    _create_course(client, user["id"], title="CS101")
+
+    def upload(title, content):
+        return client.post(
+            "/notes/upload",
+            data={
+                "title": title,
+                "lessonName": "CS101",
+                "userId": str(user["id"]),
+                "files": [(BytesIO(content), "f.txt")],
+            },
+            content_type="multipart/form-data",
+        )
+
+    assert upload("first", b"123456").status_code == 200
+    resp = upload("second", b"123456")
+    assert resp.status_code == 413
+    assert resp.get_json()["used"] == 6
+    # 被拒绝的上传不留下任何文件或笔记
+    assert len(list(backend_app.BLOB_STORE.iter_digests())) == 1
+    assert list(backend_app.BLOB_STORE.tmp_dir.iterdir()) == []
+    assert upload("third", b"1234").status_code == 200
+
+    # 原始请求体上传按 Content-Length 提前拒绝
+    resp = client.post(
+        "/notes/upload",
+        query_string={"title": "raw", "lessonName": "CS101", "userId": user["id"], "filename": "r.bin"},
+        data=b"x",
+        content_type="application/octet-stream",
+    )
+    assert resp.status_code == 413
+
+
+
+def test_concurrent_uploads_cannot_exceed_quota(client, monkeypatch):
+    from backend import app as backend_app
+
+    monkeypatch.setattr(backend_app, "USER_QUOTA_BYTES", 10)
+    user = _register_user(client, username="racer", email="racer@example.com")
+    _create_course(client, user["id"], title="CS101")
+
+    def upload(title, content):
+        return client.post(
+            "/notes/upload",
+            data={
+                "title": title,
+                "lessonName": "CS101",
+                "userId": str(user["id"]),
+                "files": [(BytesIO(content), title + ".txt")],
+            },
+            content_type="multipart/form-data",
+        )
+
+    assert upload("first", b"123456").status_code == 200
+    # 模拟并发：第二个上传开始时读到的用量还不包含第一个
+    monkeypatch.setattr(backend_app.storage, "get_storage_usage", lambda user_id: 0)
+    resp = upload("second", b"abcdef")
+    assert resp.status_code == 413
+    assert resp.get_json()["used"] == 6
+    notes = client.get("/userdata", query_string={"id": user["id"]}).get_json()["data"]["courses"][0]["myNotes"]
+    assert [note["name"] for note in notes] == ["first"]
+
+def _upload_slides(client, content):
+    user = _register_user(client, username="reader", email="reader@example.com")
+    _create_course(client, user["id"], title="CS101")
+    client.post(
+        "/notes/upload",
+        data={
+            "title": "Slides",
+            "lessonName": "CS101",
+            "userId": str(user["id"]),
+            "files": [(BytesIO(content), "slides.pdf")],
+        },
+        content_type="multipart/form-data",
+    )
+    files = client.get(
+        "/notes/files", query_string={"userId": user["id"], "lessonName": "CS101", "noteName": "Slides"}
+    ).get_json()["files"]
+    return files[0]["url"]
+
+
+def test_note_file_supports_range_and_conditional_requests(client):
+    import hashlib
+
+    content = b"0123456789" * 100
+    digest = hashlib.sha256(content).hexdigest()
+    url = _upload_slides(client, content)
+    assert url.endswith(f"&v={digest}")
+
+    full = client.get(url)
+    assert full.status_code == 200
+    assert full.headers["ETag"] == f'"{digest}"'
+    assert full.headers["Accept-Ranges"] == "bytes"
+    assert "Last-Modified" in full.headers
+    assert full.cache_control.private and full.cache_control.max_age == 365 * 24 * 3600
+    assert full.cache_control.immutable
+
+    part = client.get(url, headers={"Range": "bytes=10-19"})
+    assert part.status_code == 206
+    assert part.data == content[10:20]
+    assert part.headers["Content-Range"] == "bytes 10-19/1000"
+
+    assert client.get(url, headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+    # If-Range 与当前版本不符时返回完整文件
+    stale = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert stale.status_code == 200 and stale.data == content
+    assert client.get(url, headers={"Range": "bytes=0-9", "If-Range": f'"{digest}"'}).status_code == 206
+
+    # 不带版本的链接每次重新验证
+    unversioned = client.get(url.replace(f"&v={digest}", ""))
+    assert unversioned.cache_control.no_cache and not unversioned.cache_control.immutable
+
+
+def test_note_file_can_be_sent_by_front_proxy(client, monkeypatch):
+    from backend import app as backend_app
+
+    url = _upload_slides(client, b"proxied")
+    monkeypatch.setattr(backend_app, "FILE_SENDFILE", "x-accel-redirect")
+    resp = client.get(url, headers={"Range": "bytes=0-1"})
+    # Range 由代理处理，Python 不读取文件
+    assert resp.status_code == 200
+    assert resp.data == b""
+    digest = resp.headers["ETag"].strip('"')
+    assert resp.headers["X-Accel-Redirect"] == f"/_blobs/{digest[:2]}/{digest[2:4]}/{digest}"
+    assert "X-Sendfile" not in resp.headers
+    assert client.get(url, headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+
+    monkeypatch.setattr(backend_app, "FILE_SENDFILE", "x-sendfile")
+    resp = client.get(url)
+    assert resp.headers["X-Sendfile"] == str(backend_app.BLOB_STORE.path(digest))
+
+
+def test_resumable_upload_accepts_chunks_in_any_order(client):
+    import hashlib
+
+    user = _register_user(client, username="resume", email="resume@example.com")
+    _create_course(client, user["id"], title="CS101")
+    content = bytes(range(256)) * 40  # 10240 字节，分成 4 块
+    digest = hashlib.sha256(content).hexdigest()
+    resp = client.post(
+        "/notes/uploads",
+        json={
+            "userId": user["id"],
+            "title": "Recording",
+            "lessonName": "CS101",
+            "filename": "rec.mp4",
+            "size": len(content),
+            "sha256": digest,
+        },
+    )
+    assert resp.status_code == 201
+    upload = resp.get_json()["upload"]
+    assert upload["received"] == [] and upload["complete"] is False
+    url = f"/notes/uploads/{upload['id']}"
+
+    def put(offset, end):
+        return client.put(
+            url,
+            query_string={"userId": user["id"], "offset": offset},
+            data=content[offset:end],
+            content_type="application/octet-stream",
+        )
+
+    assert put(7680, 10240).get_json()["received"] == [[7680, 10240]]
+    assert put(0, 2560).get_json()["received"] == [[0, 2560], [7680, 10240]]
+    too_long = client.put(url, query_string={"userId": user["id"], "offset": 10000}, data=b"x" * 300)
+    assert too_long.status_code == 416
+
+    # 断线后查询已收到的区间，只补传缺少的部分
+    status = client.get(url, query_string={"userId": user["id"]}).get_json()["upload"]
+    assert status["received"] == [[0, 2560], [7680, 10240]]
+    incomplete = client.post(f"{url}/complete", query_string={"userId": user["id"]})
+    assert incomplete.status_code == 409
+
+    body = put(2560, 7680).get_json()
+    assert body == {"success": True, "received": [[0, 10240]], "complete": True}
+    done = client.post(f"{url}/complete", query_string={"userId": user["id"]})
+    assert done.status_code == 200
+    assert done.get_json()["sha256"] == digest
+    assert client.get(url, query_string={"userId": user["id"]}).status_code == 404
+
+    download = client.get(
+        "/notes/file",
+        query_string={"userId": user["id"], "lessonName": "CS101", "noteName": "Recording", "filename": "rec.mp4"},
+    )
+    assert download.data == content
+
+
+def _open_upload(client, user_id, content, lessonName="CS101"):
+    resp = client.post(
+        "/notes/uploads",
+        json={"userId": user_id, "title": "Rec", "lessonName": lessonName, "filename": "r.bin", "size": len(content)},
+    )
+    assert resp.status_code == 201
+    url = f"/notes/uploads/{resp.get_json()['upload']['id']}"
+    client.put(url, query_string={"userId": user_id, "offset": 0}, data=content)
+    return url
+
+
+def test_resumable_upload_rechecks_quota_on_completion(client, monkeypatch):
+    from backend import app as backend_app
+
+    monkeypatch.setattr(backend_app, "USER_QUOTA_BYTES", 10)
+    user = _register_user(client, username="quota2", email="quota2@example.com")
+    _create_course(client, user["id"], title="CS101")
+    # 两个会话都在剩余配额之内，但合计超出
+    first = _open_upload(client, user["id"], b"12345678")
+    second = _open_upload(client, user["id"], b"abcdefgh")
+    assert client.post(f"{first}/complete", query_string={"userId": user["id"]}).status_code == 200
+    resp = client.post(f"{second}/complete", query_string={"userId": user["id"]})
+    assert resp.status_code == 413
+    assert resp.get_json()["used"] == 8
+
+
+def test_resumable_upload_completion_is_idempotent_and_retryable(client):
+    user = _register_user(client, username="retry", email="retry@example.com")
+    _create_course(client, user["id"], title="CS101")
+    url = _open_upload(client, user["id"], b"payload")
+
+    # 课程被改名：笔记无法创建，会话保留
+    client.post("/edit/course", json={"userId": user["id"], "oldname": "CS101", "newname": "CS102"})
+    resp = client.post(f"{url}/complete", query_string={"userId": user["id"]})
+    assert resp.status_code == 404
+    assert client.get(url, query_string={"userId": user["id"]}).get_json()["upload"]["complete"] is True
+
+    client.post("/edit/course", json={"userId": user["id"], "oldname": "CS102", "newname": "CS101"})
+    done = client.post(f"{url}/complete", query_string={"userId": user["id"]})
+    assert done.status_code == 200 and done.get_json()["note"]["name"] == "Rec"
+    # 重复的完成请求不会再创建笔记
+    assert client.post(f"{url}/complete", query_string={"userId": user["id"]}).status_code == 404
+    notes = client.get("/userdata", query_string={"id": user["id"]}).get_json()["data"]["courses"][0]["myNotes"]
+    assert len(notes) == 1
+
+
+def test_resumable_upload_rejects_wrong_content_and_can_be_cancelled(client):
+    from backend import app as backend_app
+
+    user = _register_user(client, username="resume2", email="resume2@example.com")
+    _create_course(client, user["id"], title="CS101")
+
+    def create():
+        resp = client.post(
+            "/notes/uploads",
+            json={
+                "userId": user["id"],
+                "lessonName": "CS101",
+                "filename": "a.bin",
+                "size": 3,
+                "sha256": "0" * 64,
+            },
+        )
+        return f"/notes/uploads/{resp.get_json()['upload']['id']}"
+
+    url = create()
+    client.put(url, query_string={"userId": user["id"], "offset": 0}, data=b"abc")
+    resp = client.post(f"{url}/complete", query_string={"userId": user["id"]})
+    assert resp.status_code == 422
+    assert client.get(url, query_string={"userId": user["id"]}).status_code == 404
+
+    url = create()
+    client.put(url, query_string={"userId": user["id"], "offset": 1}, data=b"bc")
+    assert client.delete(url, query_string={"userId": user["id"]}).get_json()["success"] is True
+    assert list(backend_app.BLOB_STORE.uploads_dir.iterdir()) == []
+    assert list(backend_app.BLOB_STORE.iter_digests()) == []
+
+    # 其他用户看不到该会话
+    other = _register_user(client, username="other", email="other@example.com")
+    url = create()
+    assert client.get(url, query_string={"userId": other["id"]}).status_code == 404
+
+
 def test_upload_note_to_missing_course_returns_empty_note(client):
     upload_resp = client.post(
         "/notes/upload",
@@ -127,8 +456,21 @@ def test_get_notes_files_handles_missing_resources(client):
     assert "course not found" in resp.get_json()["error"]
 
 
-@pytest.mark.xfail(reason="当前实现重命名后不移动文件夹，下载会失败", strict=False)
-def test_renamed_course_and_note_should_keep_files_accessible(client):
+def test_note_file_routes_report_which_part_is_missing(client):
+    user = _register_user(client, username="lookup", email="lookup@example.com")
+    _create_course(client, user["id"], title="CS101")
+    query = {"userId": user["id"], "lessonName": "CS101", "noteName": "Nope", "filename": "x.txt"}
+
+    resp = client.get("/notes/file", query_string=query)
+    assert resp.status_code == 404
+    assert "note not found" in resp.get_json()["error"]
+
+    resp = client.get("/notes/file", query_string={**query, "userId": user["id"] + 1000})
+    assert resp.status_code == 404
+    assert resp.get_json()["error"] == "user not found"
+
+
+def test_renamed_course_and_note_keep_files_accessible(client):
     user = _register_user(client, username="editor", email="editor@example.com")
     _create_course(client, user["id"], title="CS101")
     client.post(
@@ -173,6 +515,36 @@ def test_renamed_course_and_note_should_keep_files_accessible(client):
     assert download_resp.status_code == 200
 
 
+def test_migrated_legacy_files_survive_renames(client):
+    from backend import app as backend_app
+    from backend.database import storage
+    from backend.database.blobstore import migrate_legacy_files
+
+    user = _register_user(client, username="legacy", email="legacy@example.com")
+    _create_course(client, user["id"], title="CS101")
+    # 内容寻址存储之前的布局：<用户>/<课程>/<笔记>/<文件>
+    storage.add_note("Week1", "CS101", files=["w1.txt"], user_id=user["id"])
+    legacy_dir = backend_app.BASE_STORAGE_DIR / str(user["id"]) / "CS101" / "Week1"
+    legacy_dir.mkdir(parents=True)
+    (legacy_dir / "w1.txt").write_bytes(b"old layout")
+
+    result = migrate_legacy_files(storage.db, backend_app.BLOB_STORE, backend_app.BASE_STORAGE_DIR)
+    assert result == {"migrated": 1, "missing": 0, "bytes": 10}
+    assert not (backend_app.BASE_STORAGE_DIR / str(user["id"])).exists()
+
+    client.post("/edit/course", json={"userId": user["id"], "oldname": "CS101", "newname": "CS102"})
+    client.post(
+        "/edit/note",
+        json={"userId": user["id"], "courseName": "CS102", "oldname": "Week1", "newname": "Week2"},
+    )
+    download = client.get(
+        "/notes/file",
+        query_string={"userId": user["id"], "lessonName": "CS102", "noteName": "Week2", "filename": "w1.txt"},
+    )
+    assert download.status_code == 200
+    assert download.data == b"old layout"
+
+
 def test_links_crud_flow(client):
     user = _register_user(client, username="linker", email="linker@example.com")
 
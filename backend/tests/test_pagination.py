@@ -0,0 +1,92 @@
+def _register_user(client, username="frank", email="frank@example.com", password="pw"):
+    resp = client.post(
+        "/auth/register",
+        json={"username": username, "email": email, "password": password},
+    )
+    assert resp.status_code == 201
+    return resp.get_json()["user"]
+
+
+def _collect(client, url, key, **params):
+    items, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, **({"cursor": cursor} if cursor else {}))
+        body = client.get(url, query_string=query).get_json()
+        assert body["success"] is True
+        items += body[key]
+        pages += 1
+        cursor = body["nextCursor"]
+        if cursor is None:
+            return items, pages
+
+
+def test_tasks_are_paged_by_deadline(client):
+    user = _register_user(client)
+    deadlines = [
+        {"name": f"hw{i}", "deadline": f"2025-03-{(i * 7) % 28 + 1:02d}"} for i in range(12)
+    ]
+    client.post("/edit/deadline", json={"userId": user["id"], "deadlines": deadlines})
+
+    tasks, pages = _collect(client, "/tasks", "tasks", userId=user["id"], limit=5)
+    assert pages == 3
+    assert len({t["id"] for t in tasks}) == 12
+    assert [t["deadline"] for t in tasks] == sorted(t["deadline"] for t in tasks)
+
+
+def test_cursor_is_stable_under_concurrent_inserts(client):
+    user = _register_user(client)
+    deadlines = [{"name": f"hw{i}", "deadline": f"2025-04-{i + 10:02d}"} for i in range(6)]
+    client.post("/edit/deadline", json={"userId": user["id"], "deadlines": deadlines})
+
+    first = client.get("/tasks", query_string={"userId": user["id"], "limit": 3}).get_json()
+    # 翻页之间插入一个排在第一页范围内的任务：下一页既不重复也不遗漏
+    client.post(
+        "/edit/deadline",
+        json={
+            "userId": user["id"],
+            "deadlines": deadlines + [{"name": "early", "deadline": "2025-04-01"}],
+        },
+    )
+    second = client.get(
+        "/tasks",
+        query_string={"userId": user["id"], "limit": 3, "cursor": first["nextCursor"]},
+    ).get_json()
+    assert [t["name"] for t in first["tasks"]] == ["hw0", "hw1", "hw2"]
+    assert [t["name"] for t in second["tasks"]] == ["hw3", "hw4", "hw5"]
+    assert second["nextCursor"] is None
+
+
+def test_schedule_and_links_accept_limit(client):
+    user = _register_user(client)
+    for name in ["C", "A", "B"]:
+        client.post("/course-table", json={"userId": user["id"], "name": name, "times": [1]})
+    schedule, pages = _collect(client, "/schedule", "courseTable", userId=user["id"], limit=2)
+    assert [c["name"] for c in schedule] == ["A", "B", "C"] and pages == 2
+
+    category = client.post(
+        "/links/categories", json={"userId": user["id"], "category": "c", "icon": "i"}
+    ).get_json()["category"]
+    for i in range(3):
+        client.post(
+            "/links",
+            json={
+                "userId": user["id"],
+                "categoryId": category["id"],
+                "name": f"l{i}",
+                "url": f"https://example.com/{i}",
+                "sortOrder": 2 - i,
+            },
+        )
+    links, _ = _collect(
+        client, "/links", "links", userId=user["id"], categoryId=category["id"], limit=2
+    )
+    assert [link["name"] for link in links] == ["l2", "l1", "l0"]
+
+
+def test_invalid_cursor_is_rejected(client):
+    user = _register_user(client)
+    resp = client.get("/tasks", query_string={"userId": user["id"], "cursor": "not-a-cursor"})
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
+    resp = client.get("/notes", query_string={"userId": user["id"], "limit": 0})
+    assert resp.status_code == 400
@@ -0,0 +1,58 @@
+def _register_user(client, username, password="pw"):
+    resp = client.post(
+        "/auth/register",
+        json={"username": username, "email": f"{username}@example.com", "password": password},
+    )
+    assert resp.status_code == 201
+    return resp.get_json()["user"]
+
+
+def _add_course(client, user, name, times, week_type=0):
+    resp = client.post(
+        "/course-table",
+        json={"userId": user["id"], "name": name, "times": times, "weekType": week_type},
+    )
+    assert resp.status_code == 201
+    return resp.get_json()["course"]
+
+
+def test_free_slots_respects_week_type(client):
+    alice = _register_user(client, "alice")
+    bob = _register_user(client, "bob")
+    _add_course(client, alice, "高数", [0, 1])
+    _add_course(client, alice, "英语", [2], week_type=1)
+    _add_course(client, bob, "物理", [3], week_type=2)
+
+    resp = client.get("/schedule/free-slots", query_string={"userIds": f"{alice['id']},{bob['id']}"})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["userIds"] == [alice["id"], bob["id"]]
+    assert data["free"][:2] == [4, 5] and len(data["free"]) == 80
+    assert data["freeOddWeeks"][:2] == [3, 4]
+    assert data["freeEvenWeeks"][:2] == [2, 4]
+    assert data["busyCount"][:5] == [1, 1, 1, 1, 0]
+
+
+def test_free_slots_validates_user_ids(client):
+    assert client.get("/schedule/free-slots").status_code == 400
+    assert client.get("/schedule/free-slots", query_string={"userIds": "1,a"}).status_code == 400
+    too_many = ",".join(str(i) for i in range(1, 502))
+    assert client.get("/schedule/free-slots", query_string={"userIds": too_many}).status_code == 400
+
+    # 没有课表的用户全天空闲
+    data = client.get("/schedule/free-slots", query_string={"userIds": "999"}).get_json()
+    assert len(data["free"]) == 84
+
+
+def test_conflicts(client):
+    user = _register_user(client, "carol")
+    math = _add_course(client, user, "高数", [10, 11])
+    odd = _add_course(client, user, "单周课", [11, 12], week_type=1)
+    _add_course(client, user, "双周课", [12], week_type=2)
+
+    resp = client.get("/schedule/conflicts", query_string={"userId": user["id"]})
+    assert resp.status_code == 200
+    assert resp.get_json()["conflicts"] == [
+        {"courseIds": [odd["id"], math["id"]], "names": ["单周课", "高数"], "weekType": 1, "times": [11]}
+    ]
+    assert client.get("/schedule/conflicts").status_code == 400
@@ -0,0 +1,79 @@
+def _register_user(client, username="erin", email="erin@example.com", password="pw"):
+    resp = client.post(
+        "/auth/register",
+        json={"username": username, "email": email, "password": password},
+    )
+    assert resp.status_code == 201
+    return resp.get_json()["user"]
+
+
+def test_search_finds_courses_notes_tasks_and_links(client):
+    user = _register_user(client)
+    client.post(
+        "/courses/create",
+        json={"userId": user["id"], "title": "高等数学", "tags": ["必修"]},
+    )
+    client.post(
+        "/edit/deadline",
+        json={
+            "userId": user["id"],
+            "deadlines": [
+                {"name": "数学作业", "deadline": "2025-01-02", "message": "第三章 homework"}
+            ],
+        },
+    )
+    category = client.post(
+        "/links/categories", json={"userId": user["id"], "category": "学习", "icon": "📚"}
+    ).get_json()["category"]
+    client.post(
+        "/links",
+        json={
+            "userId": user["id"],
+            "categoryId": category["id"],
+            "name": "教学网",
+            "url": "https://course.pku.edu.cn",
+            "description": "课程 homework 提交",
+        },
+    )
+
+    resp = client.get("/search", query_string={"userId": user["id"], "q": "homework"})
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["success"] is True
+    assert {r["kind"] for r in body["results"]} == {"task", "link"}
+    assert all("<mark>homework</mark>" in r["snippet"] for r in body["results"])
+
+    # 少于 3 个字的中文词同样可以检索
+    resp = client.get("/search", query_string={"userId": user["id"], "q": "数学"})
+    kinds = sorted(r["kind"] for r in resp.get_json()["results"])
+    assert kinds == ["course", "task"]
+
+
+def test_search_is_scoped_to_user_and_paginates(client):
+    alice = _register_user(client)
+    bob = _register_user(client, username="bob", email="bob@example.com")
+    deadlines = [{"name": f"report {i}", "deadline": f"2025-02-{i + 1:02d}"} for i in range(5)]
+    client.post("/edit/deadline", json={"userId": alice["id"], "deadlines": deadlines})
+
+    resp = client.get("/search", query_string={"userId": bob["id"], "q": "report"})
+    assert resp.get_json()["results"] == []
+
+    first = client.get(
+        "/search", query_string={"userId": alice["id"], "q": "report", "limit": 3}
+    ).get_json()
+    assert len(first["results"]) == 3
+    assert first["nextOffset"] == 3
+    second = client.get(
+        "/search",
+        query_string={"userId": alice["id"], "q": "report", "limit": 3, "offset": 3},
+    ).get_json()
+    assert len(second["results"]) == 2
+    assert second["nextOffset"] is None
+    ids = {r["id"] for r in first["results"] + second["results"]}
+    assert len(ids) == 5
+
+
+def test_search_requires_user_and_query(client):
+    resp = client.get("/search", query_string={"userId": 1})
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
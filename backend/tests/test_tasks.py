@@ -136,3 +136,56 @@ def test_course_schedule_invalid_ids_and_isolation(client):
     delete_missing = client.delete("/course-table/9999", query_string={"userId": user1["id"]})
     assert delete_missing.status_code == 400
 import pytest
+
+
+def test_update_deadline_reports_changes(client):
+    user = _register_user(client, username="ddldiff", email="ddldiff@example.com")
+    payload = {
+        "userId": user["id"],
+        "deadlines": [{"name": "a", "deadline": "2025-01-01"}, {"name": "b", "deadline": "2025-01-02"}],
+    }
+    first = client.post("/edit/deadline", json=payload).get_json()
+    assert first["changes"]["inserted"] == 2
+    second = client.post("/edit/deadline", json=payload).get_json()
+    assert second["changes"] == {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 2}
+
+
+def test_upcoming_tasks_endpoint(client):
+    from datetime import datetime, timedelta
+
+    user = _register_user(client, username="soon", email="soon@example.com")
+    now = datetime.now()
+    deadlines = [
+        {"name": "later", "deadline": (now + timedelta(days=20)).strftime("%Y-%m-%d %H:%M")},
+        {"name": "soon", "deadline": (now + timedelta(days=2)).strftime("%Y-%m-%d %H:%M")},
+        {"name": "past", "deadline": (now - timedelta(days=2)).strftime("%Y-%m-%d %H:%M")},
+        {"name": "undated", "deadline": None},
+    ]
+    client.post("/edit/deadline", json={"userId": user["id"], "deadlines": deadlines})
+
+    resp = client.get("/tasks/upcoming", query_string={"userId": user["id"], "days": 7})
+    assert resp.status_code == 200
+    assert [t["name"] for t in resp.get_json()["tasks"]] == ["soon"]
+
+    resp = client.get("/tasks/upcoming", query_string={"userId": user["id"], "days": 30})
+    assert [t["name"] for t in resp.get_json()["tasks"]] == ["soon", "later"]
+
+    resp = client.get("/tasks/upcoming", query_string={"userId": user["id"], "days": 0})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("deadline", [float("nan"), float("inf"), -float("inf"), 1e300])
+def test_update_deadline_rejects_invalid_timestamps(client, deadline):
+    user = _register_user(client, username="ddlnan", email="ddlnan@example.com")
+    payload = {"userId": user["id"], "deadlines": [{"name": "ok", "deadline": "2025-01-01"}]}
+    assert client.post("/edit/deadline", json=payload).status_code == 200
+
+    # Flask 的 JSON 解析接受 NaN / Infinity 字面量
+    payload["deadlines"].append({"name": "bad", "deadline": deadline})
+    resp = client.post("/edit/deadline", json=payload)
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
+
+    resp = client.get("/tasks", query_string={"userId": user["id"]})
+    assert resp.status_code == 200
+    assert [t["name"] for t in resp.get_json()["tasks"]] == ["ok"]
@@ -0,0 +1,226 @@
+import hashlib
+import io
+import json
+import shutil
+import tarfile
+from io import BytesIO
+
+
+def _register_user(client, username="mover", email="mover@example.com", password="pw"):
+    resp = client.post(
+        "/auth/register",
+        json={"username": username, "email": email, "password": password},
+    )
+    assert resp.status_code == 201
+    return resp.get_json()["user"]
+
+
+def _seed(client, user_id):
+    client.post("/courses/create", json={"title": "CS101", "tags": ["core"], "userId": user_id})
+    resp = client.post(
+        "/notes/upload",
+        data={
+            "title": "Lecture1",
+            "lessonName": "CS101",
+            "userId": str(user_id),
+            "files": [(BytesIO(b"hello world"), "notes.txt")],
+        },
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 200
+    client.post(
+        "/edit/deadline",
+        json={"userId": user_id, "deadlines": [{"name": "hw1", "deadline": "2025-01-02", "message": "m"}]},
+    )
+    client.post(
+        "/edit/linkcategory",
+        json={
+            "userId": user_id,
+            "linkCategories": [
+                {"category": "Docs", "icon": "📚", "links": [{"name": "A", "url": "https://a.example"}]}
+            ],
+        },
+    )
+    client.post("/course-table", json={"userId": user_id, "name": "Algo", "times": [3, 60], "weekType": 1})
+
+
+def _userdata(client, user_id):
+    data = client.get("/userdata", query_string={"id": user_id}).get_json()["data"]
+    for category in data["linkCategories"]:
+        category.pop("id", None)
+        for link in category["links"]:
+            link.pop("id", None)
+    for course in data["courseTable"]:
+        course.pop("id")
+    for course in data["courses"]:
+        course.pop("id", None)
+        course.pop("user_id", None)
+        for note in course["myNotes"]:
+            note.pop("id", None)
+    for task in data["deadlines"]:
+        task.pop("id", None)
+    data.pop("username")
+    data.pop("email", None)
+    data.pop("id", None)
+    return data
+
+
+def _delete_user(user_id):
+    from backend import app as backend_app
+
+    conn = backend_app.storage.db.get_db_connection()
+    with conn:
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    shutil.rmtree(backend_app.BASE_STORAGE_DIR / str(user_id), ignore_errors=True)
+    # 测试中只有这一个用户的文件，清空存储以验证导入会恢复文件内容
+    shutil.rmtree(backend_app.BLOB_STORE.root, ignore_errors=True)
+
+
+def test_ndjson_export_import_round_trip(client):
+    user = _register_user(client)
+    _seed(client, user["id"])
+
+    resp = client.get("/export", query_string={"userId": user["id"]})
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    assert resp.is_streamed
+    records = [json.loads(line) for line in resp.data.decode("utf-8").splitlines()]
+    assert [r["type"] for r in records] == [
+        "header", "users", "courses", "notes", "tasks", "link_categories", "useful_links", "course_schedules",
+    ]
+    assert records[-1]["times"] == [3, 60]
+
+    # 用户名、邮箱冲突
+    resp = client.post("/import", data=resp.data, content_type="application/x-ndjson")
+    assert resp.status_code == 409
+
+    records[1].update(username="copy", email="copy@example.com")
+    body = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+    resp = client.post("/import", data=body, content_type="application/x-ndjson")
+    assert resp.status_code == 201
+    imported = resp.get_json()["imported"]
+    assert imported["courses"] == imported["notes"] == imported["useful_links"] == 1
+    assert _userdata(client, imported["userId"]) == _userdata(client, user["id"])
+
+    # NDJSON 不带文件内容：不能借导入引用已在存储中的（别人的）文件
+    assert imported["missing_blobs"] == 1
+    download = client.get(
+        "/notes/file",
+        query_string={
+            "userId": imported["userId"],
+            "lessonName": "CS101",
+            "noteName": "Lecture1",
+            "filename": "notes.txt",
+        },
+    )
+    assert download.status_code == 404
+
+
+def test_tar_export_import_restores_files(client):
+    user = _register_user(client)
+    _seed(client, user["id"])
+
+    resp = client.get("/export", query_string={"userId": user["id"], "files": "1"})
+    assert resp.status_code == 200
+    archive = resp.data
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        assert tar.getnames() == ["data.ndjson", "blobs/" + hashlib.sha256(b"hello world").hexdigest()]
+    before = _userdata(client, user["id"])
+
+    _delete_user(user["id"])
+    resp = client.post("/import", data=archive, content_type="application/x-tar")
+    assert resp.status_code == 201
+    imported = resp.get_json()["imported"]
+    assert imported["files"] == 1 and imported["missing_blobs"] == 0
+    assert _userdata(client, imported["userId"]) == before
+    # 文件大小随导入记录，计入用量
+    from backend import app as backend_app
+
+    assert backend_app.storage.get_storage_usage(imported["userId"]) == len(b"hello world")
+
+    download = client.get(
+        "/notes/file",
+        query_string={
+            "userId": imported["userId"],
+            "lessonName": "CS101",
+            "noteName": "Lecture1",
+            "filename": "notes.txt",
+        },
+    )
+    assert download.status_code == 200
+    assert download.data == b"hello world"
+
+
+def test_import_of_old_archive_moves_files_into_blob_store(client):
+    from backend import app as backend_app
+
+    user = _register_user(client)
+    _seed(client, user["id"])
+    records = [json.loads(line) for line in client.get("/export", query_string={"userId": user["id"]}).data.splitlines()]
+    # 旧版本的导出：笔记没有 blob_sha256，文件在 files/<课程>/<笔记>/ 下
+    for record in records:
+        record.pop("blob_sha256", None)
+    records[1].update(username="old", email="old@example.com")
+    data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for name, content in (("data.ndjson", data), ("files/CS101/Lecture1/notes.txt", b"hello world")):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+    resp = client.post("/import", data=archive.getvalue(), content_type="application/x-tar")
+    assert resp.status_code == 201
+    imported = resp.get_json()["imported"]
+    assert not (backend_app.BASE_STORAGE_DIR / str(imported["userId"])).exists()
+    note = backend_app.storage.find_note(imported["userId"], "CS101", "Lecture1")["note"]
+    assert note["sha256"] == hashlib.sha256(b"hello world").hexdigest()
+
+
+def test_export_and_import_validation(client):
+    assert client.get("/export").status_code == 400
+    assert client.get("/export", query_string={"userId": 9999}).status_code == 404
+    assert client.post("/import", query_string={"userId": 9999}, data=b"").status_code == 404
+
+    user = _register_user(client)
+    course = {"type": "courses", "id": 1, "title": "x"}
+    cases = [
+        (b"not json\n", None),
+        # 新建用户时 users 记录必须在最前面
+        (json.dumps(course).encode(), None),
+        # 笔记引用了不存在的课程：整个导入回滚，已写入的课程也不保留
+        (
+            (json.dumps(course) + "\n" + json.dumps({"type": "notes", "id": 1, "course_id": 42, "name": "n"})).encode(),
+            {"userId": user["id"]},
+        ),
+    ]
+    for body, params in cases:
+        resp = client.post("/import", query_string=params, data=body, content_type="application/x-ndjson")
+        assert resp.status_code == 400
+    assert _userdata(client, user["id"])["courses"] == []
+
+
+def test_import_reads_all_records_before_taking_write_lock(client):
+    import sqlite3
+
+    from backend import app as backend_app
+
+    user = _register_user(client)
+    _seed(client, user["id"])
+    records = list(backend_app.storage.export_user(user["id"]))
+    records[1].update(username="slow", email="slow@example.com")
+    db_path = backend_app.storage.db.db_path
+
+    def slow_upload():
+        for record in records:
+            yield record
+            # 模拟上传过程中其他请求写库：导入还在读请求体，不能已经占着写锁
+            other = sqlite3.connect(db_path, timeout=0)
+            try:
+                other.execute("BEGIN IMMEDIATE")
+                other.rollback()
+            finally:
+                other.close()
+
+    imported = backend_app.storage.import_user(slow_upload())
+    assert imported["courses"] == imported["notes"] == 1